@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 import os
+from datetime import timedelta
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -41,8 +42,24 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
             'uralapi.backends.JWTAuthentication',
         ),
+    # FastJSONRenderer использует orjson, если он установлен (pip install orjson), иначе стандартный json.
+    # Для рендеринга стандартным JSONRenderer DRF указать 'rest_framework.renderers.JSONRenderer'
+    'DEFAULT_RENDERER_CLASSES': (
+            'uralapi.renderers.FastJSONRenderer',
+        ),
 }
 
+# Аутентификация по роли из токена без запроса пользователя к базе (uralapi/backends.py).
+# Активность пользователя проверяется по кэшу, который живет JWT_USER_CACHE_TTL секунд
+JWT_STATELESS_AUTH = False
+
+JWT_USER_CACHE_TTL = 60
+
+# время жизни токена; выданный токен переиспользуется, пока до истечения не останется JWT_TOKEN_REFRESH_MARGIN
+JWT_TOKEN_LIFETIME = timedelta(days=30)
+
+JWT_TOKEN_REFRESH_MARGIN = timedelta(days=1)
+
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -64,7 +81,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'querycount.middleware.QueryCountMiddleware'
+    'uralapi.metrics.MetricsMiddleware',
 ]
 
 
@@ -88,6 +105,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'Uralintern.wsgi.application'
 
+# тесты запускаются с бюджетами запросов и кэшем в памяти, см. uralapi/testing.py
+TEST_RUNNER = 'uralapi.testing.TestRunner'
+
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
@@ -109,6 +129,54 @@ DATABASES = {
 }
 
 
+# Password hashing
+# https://docs.djangoproject.com/en/3.2/topics/auth/passwords/
+
+# количество итераций PBKDF2, при изменении пароли перехэшируются при следующем входе пользователя
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 260000))
+
+PASSWORD_HASHERS = [
+    'uralapi.hashers.TunablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
+
+# рассылка писем (uralapi/mailing.py): количество SMTP соединений, максимум писем в секунду (None - без
+# ограничения), количество попыток отправки одного письма и начальная задержка между попытками в секундах
+MAIL_DELIVERY = {
+    'CONNECTIONS': 2,
+    'RATE_LIMIT': 5,
+    'MAX_ATTEMPTS': 3,
+    'BACKOFF': 5.0,
+}
+
+# через сколько секунд задача в статусе RUNNING считается брошенной и возвращается в очередь (uralapi/jobs.py)
+BACKGROUND_JOB_STALE_TIMEOUT = 60 * 60
+
+# сколько дней хранить журнал изменений для синхронизации мобильного клиента (manage.py prune_changelog).
+# Клиент с более старым токеном получит полный набор данных
+SYNC_CHANGELOG_RETENTION_DAYS = 30
+
+# токен синхронизации отстает на столько секунд от последних записей журнала: id записей выдаются при вставке,
+# а фиксируются транзакции в другом порядке, поэтому недавние записи повторно проверяются при следующем запросе.
+# Должно быть больше самой долгой транзакции, которая пишет в журнал
+SYNC_TOKEN_MARGIN = 60
+
+# обработка изображений стажеров (uralapi/images.py): наибольшая сторона сохраняемого оригинала,
+# стороны квадратных миниатюр по названиям размеров, формат миниатюр (WEBP или JPEG) и качество сжатия
+TRAINEE_IMAGE = {
+    'MAX_SIZE': 1280,
+    'THUMBNAILS': {'small': 96, 'medium': 320},
+    'FORMAT': 'WEBP',
+    'QUALITY': 80,
+}
+
+# количество процессов для хэширования паролей при импорте стажеров из CSV (None - по числу ядер)
+CSV_IMPORT_HASH_WORKERS = None
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -128,6 +196,28 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+# кэш должен быть общим для всех процессов (процессы сервера, воркер run_jobs), в том числе с DEBUG,
+# иначе сброс версии справочников (uralapi/cache.py) и поля пользователя, закэшированные при аутентификации,
+# обновятся только в процессе, в котором изменили данные. Каталог кэша можно задать в CACHE_LOCATION.
+# Тесты используют кэш процесса (uralapi.testing.TestRunner), чтобы записи не переходили между запусками
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_LOCATION') or os.path.join(BASE_DIR, 'cache'),
+    }
+}
+
+# кэш справочных данных: этапы, мероприятия, описания оценок
+REFERENCE_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 60 * 60 * 24,
+    'LRU_SIZE': 128,
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
 
@@ -164,18 +254,27 @@ MEDIA_URL = '/media/'
 # Путь хранения картинок
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
-# if DEBUG:
-QUERYCOUNT = {
-    'THRESHOLDS': {
-        'MEDIUM': 50,
-        'HIGH': 200,
-        'MIN_TIME_TO_LOG':0,
-        'MIN_QUERY_COUNT_TO_LOG':0
-    },
-    'IGNORE_REQUEST_PATTERNS': [r'^/admin/'],
-    'IGNORE_SQL_PATTERNS': [],
-    'DISPLAY_DUPLICATES': 5,
-    'RESPONSE_HEADER': 'X-DjangoQueryCount-Count'
+# загруженные файлы, которые нельзя отдавать по ссылке (CSV для импорта стажеров), вне MEDIA_ROOT
+PRIVATE_UPLOAD_ROOT = os.path.join(BASE_DIR, 'uploads')
+
+# отдача медиа и статических файлов без DEBUG (uralapi/media.py): сколько секунд клиент кэширует файлы
+# без хэша содержимого в имени, передача файла фронтенд прокси ('X-Sendfile', 'X-Accel-Redirect' или None -
+# отдает приложение) и префикс internal location nginx для X-Accel-Redirect
+MEDIA_SERVING = {
+    'MAX_AGE': 60 * 60,
+    'SENDFILE': os.environ.get('MEDIA_SENDFILE') or None,
+    'ACCEL_PREFIX': '/protected',
+}
+
+# метрики запросов (uralapi/metrics.py, api/_metrics): размер кольцевого буфера последних запросов,
+# исключаемые адреса, заголовок ответа с количеством SQL запросов (None - не добавлять) и проверка
+# query_budget представлений исключением - включена при запуске тестов
+API_METRICS = {
+    'BUFFER_SIZE': 5000,
+    'IGNORE_REQUEST_PATTERNS': [r'^/admin/', r'^/media/', r'^/static/'],
+    'RESPONSE_HEADER': 'X-Query-Count',
+    # включается при запуске тестов (uralapi.testing.TestRunner)
+    'ENFORCE_BUDGETS': False,
 }
 
 
@@ -14,11 +14,11 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.conf.urls import url
-from django.views.static import serve as mediaserve
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
 
+from uralapi.media import serve as mediaserve
 from . import settings
 
 admin.site.site_header = 'Уральский центр стажировок'
@@ -1,25 +1,94 @@
 import csv
-import codecs
+import uuid
 
 from django.contrib import admin
+from django.contrib.admin import helpers
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin, Group
-from django.core.mail import send_mail, send_mass_mail
+from django.core.exceptions import PermissionDenied
 from django.http import HttpResponse
 from django.shortcuts import redirect
-from django.urls import path
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.html import format_html
 from django.db import transaction
 from .models import *
 from import_export.admin import ExportMixin
 from .resources import GradeResource
+from .exports import GradeExporter
+from .pivot import GradePivot, GradePivotExporter
+from .deletion import delete_users, deletion_counts, describe
 from django.contrib import messages
-from .functions import generate_password
 from .forms import CsvImportForm, UserCreationForm
+from .storage import upload_storage
+from .tasks import import_trainees_csv, replace_trainee_image, send_credentials
 
 admin.site.unregister(Group)
 
 
+def job_message(text, background_job):
+    """Сообщение администратору со ссылкой на страницу фоновой задачи"""
+    url = reverse('admin:uralapi_backgroundjob_change', args=[background_job.pk])
+    return format_html('{}: <a href="{}">{}</a>', text, url, background_job)
+
+
+class BulkDeleteUsersMixin:
+    """
+    Удаление пользователей и профилей через delete_users (uralapi/deletion.py): оценки, профили и пользователи
+    удаляются несколькими запросами для всего набора. Стандартное действие удаления заменено действием
+    bulk_delete, страница подтверждения которого показывает только количество удаляемых записей,
+    без списка всех связанных объектов.
+    """
+    # поле с id пользователя в записях модели
+    user_id_field = 'user_id'
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def get_user_ids(self, queryset):
+        return list(queryset.values_list(self.user_id_field, flat=True))
+
+    def delete_model(self, request, obj):
+        delete_users(self.get_user_ids(self.model.objects.filter(pk=obj.pk)))
+
+    def delete_queryset(self, request, queryset):
+        delete_users(self.get_user_ids(queryset))
+
+    def bulk_delete(self, request, queryset):
+        """Действие в выпадающем списке: удаление выбранных записей после подтверждения с количеством записей"""
+        user_ids = self.get_user_ids(queryset)
+        if request.POST.get('confirm'):
+            self.message_user(request, f'Удалено: {describe(delete_users(user_ids))}')
+            return None
+
+        counts = deletion_counts(user_ids)
+        teams = counts.pop(Team)
+        select_across = request.POST.get('select_across', '0')
+        # при выборе всех записей списка они определяются фильтрами в адресе страницы, id передается один,
+        # потому что без выбранных записей действие не выполняется
+        selected = request.POST.getlist(helpers.ACTION_CHECKBOX_NAME)[:1] if select_across == '1' \
+            else request.POST.getlist(helpers.ACTION_CHECKBOX_NAME)
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Подтверждение удаления',
+            'opts': self.model._meta,
+            'counts': [(model._meta.verbose_name_plural, count) for model, count in counts.items()],
+            'teams': teams,
+            'selected': selected,
+            'select_across': select_across,
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        }
+        request.current_app = self.admin_site.name
+        return TemplateResponse(request, 'admin/uralapi/bulk_delete_confirmation.html', context)
+
+    bulk_delete.short_description = "Удалить выбранные записи с пользователями и оценками"
+    bulk_delete.allowed_permissions = ('delete',)
+
+
 @admin.register(User)
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(BulkDeleteUsersMixin, BaseUserAdmin):
     add_form = UserCreationForm
 
     fieldsets = (
@@ -37,25 +106,27 @@ class UserAdmin(BaseUserAdmin):
     list_display = ('username', 'email', 'system_role', 'is_staff', 'unhashed_password', 'social_url')
     list_filter = ('is_staff', 'is_active', 'system_role')
     search_fields = ('username',)
-    actions = ["send_emails"]
+    actions = ["send_emails", "resend_emails", "bulk_delete"]
+    user_id_field = 'pk'
 
     def send_emails(self, request,queryset):
         """
-        Действие в выпадающем списке в панели администратора, рассылка сообщения выбранным пользователям на почтовые ящики
+        Действие в выпадающем списке в панели администратора, рассылка сообщения выбранным пользователям на почтовые ящики.
+        Письма отправляются фоновой задачей, ход рассылки виден в разделе "Фоновые задачи"
         """
-        mails = []
-        for user in queryset:
-            subject = "Вход в личный кабинет Uralintern"
-            message = f"Привет!\nВот твои логин и пароль для входа в личный кабинет для оценки по стажёрским компетециям." \
-                      f"\nЛогин -  {user.email}" \
-                      f"\nПароль - {user.unhashed_password}" \
-                      f"\nОценки можно давать через веб-приложение pa-uralintern.herokuapp.com" \
-                      f" и мобильное приложение drive.google.com/drive/folders/10kfrNJ5FTeJHMkG1pdri1tyDOi8uo0oT"
-            mails.append((subject, message, settings.EMAIL_HOST_USER, [user.email]))
-        send_mass_mail(mails, fail_silently=False)
+        background_job = send_credentials.delay(user_ids=list(queryset.values_list('pk', flat=True)))
+        self.message_user(request, job_message("Рассылка поставлена в очередь", background_job))
 
     send_emails.short_description = "Разослать данные на почту"
 
+    def resend_emails(self, request, queryset):
+        """Рассылка данных для входа, в том числе пользователям, которым письмо уже было отправлено.
+        Пароль не меняется, отправляется текущий"""
+        background_job = send_credentials.delay(user_ids=list(queryset.values_list('pk', flat=True)), force=True)
+        self.message_user(request, job_message("Рассылка поставлена в очередь", background_job))
+
+    resend_emails.short_description = "Разослать данные на почту повторно"
+
     def get_readonly_fields(self, request, obj=None):
         #Переопределение метода, разрешает изменять роль только при создании записи
         if obj:
@@ -64,8 +135,9 @@ class UserAdmin(BaseUserAdmin):
 
 
 @admin.register(Trainee)
-class TraineeAdmin(admin.ModelAdmin):
+class TraineeAdmin(BulkDeleteUsersMixin, admin.ModelAdmin):
     change_list_template = "admin/uralapi/trainee_changelist.html"
+    actions = ["bulk_delete"]
     list_display = ('user', 'image', 'course', 'internship', 'speciality', 'institution', 'team', 'event', 'date_start')
     search_fields = ('user__username', 'course', 'internship', 'speciality', 'team__team_name')
     readonly_fields = ('user',)
@@ -90,20 +162,22 @@ class TraineeAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
         return False
 
+    def save_model(self, request, obj, form, change):
+        if 'image' in form.changed_data:
+            # миниатюры прежнего изображения удаляются, для нового создаются фоновой задачей
+            replace_trainee_image(obj, obj.image)
+        else:
+            super().save_model(request, obj, form, change)
+
     def import_csv(self, request):
         """Импорт данных из CSV"""
-        from django.template.response import TemplateResponse
-
         if request.method == "POST":
             dialect = csv.Sniffer().sniff(str(request.FILES['csv_file'].readline().decode('utf-8-sig')),
                                           delimiters=',;')
-            csv_file = csv.DictReader(codecs.iterdecode(request.FILES['csv_file'], encoding='utf-8-sig'),
-                                      dialect=dialect)
-            all_data = []
-            for row in csv_file:
-                all_data.append(row)
-            self._create_trainee_user(all_data)
-            self.message_user(request, "Файл был импортирован")
+            # файл обрабатывается фоновой задачей, поэтому сохраняется в закрытом хранилище вне MEDIA_ROOT
+            path = upload_storage.save(f'imports/{uuid.uuid4().hex}.csv', request.FILES['csv_file'])
+            background_job = import_trainees_csv.delay(path=path, delimiter=dialect.delimiter)
+            self.message_user(request, job_message("Импорт поставлен в очередь", background_job))
             return redirect("..")
         form = CsvImportForm()
 
@@ -118,59 +192,6 @@ class TraineeAdmin(admin.ModelAdmin):
         return TemplateResponse(request, ['admin/uralapi/csv_form.html'],
                                 context)
 
-    def _create_trainee_user(self, all_data):
-        """ Метод создания пользователя и связанной с ним записи о стажере.
-
-        :param all_data: Словарь данных о стажерах
-        """
-        local_users = []
-        local_trainees = []
-        validated_data = {}
-        # Последний созданый пользователь
-        latest_user = User.objects.latest('pk')
-        for data in all_data:
-            if "Частный e-mail" in data.keys() and "ФИО" in data.keys() and data["Частный e-mail"]:
-                random_password = generate_password()
-
-                user = User(username=data["ФИО"], email=data["Частный e-mail"], social_url=data["Личная страница"])
-                user.set_password(random_password)
-
-                validated_data[data["ФИО"]] = data
-                local_users.append(user)
-
-        with transaction.atomic():
-            User.objects.bulk_create(local_users, ignore_conflicts=True)
-        # Берет пользователей, которые были созданы позже чем latest_user
-        users = User.objects.filter(pk__gt=latest_user.pk).order_by("-pk")
-        users_with_data = {}
-        for user in users:
-            # Сопоставление пользователей и их данных из словаря
-            if user.username in validated_data.keys():
-                users_with_data[user] = validated_data[user.username]
-
-        teams = Team.objects.all()
-        events = Event.objects.all()
-
-        cash_team = list(teams)
-        cash_events = list(events)
-
-        for user, data in users_with_data.items():
-            team = teams.filter(team_name=data["Команда"]).first()
-            event = events.filter(event_name=data["Мероприятие"]).first()
-
-            trainee = Trainee(user=user,
-                              internship=data["Направление стажировки"],
-                              course=int(data["Курс"]),
-                              speciality=data["Учебная специальность"],
-                              institution=data["Учебное заведение"],
-                              team=team,
-                              event=event,
-                              date_start=datetime.today())
-
-            local_trainees.append(trainee)
-        with transaction.atomic():
-            Trainee.objects.bulk_create(local_trainees, ignore_conflicts=True)
-
 
 @admin.register(Team)
 class TeamAdmin(admin.ModelAdmin):
@@ -186,8 +207,9 @@ class StageAdmin(admin.ModelAdmin):
 
 
 @admin.register(Curator)
-class CuratorAdmin(admin.ModelAdmin):
+class CuratorAdmin(BulkDeleteUsersMixin, admin.ModelAdmin):
     list_display = ('user',)
+    actions = ["bulk_delete"]
     readonly_fields = ('user',)
 
     def has_add_permission(self, request):
@@ -195,8 +217,9 @@ class CuratorAdmin(admin.ModelAdmin):
 
 
 @admin.register(Expert)
-class ExpertAdmin(admin.ModelAdmin):
+class ExpertAdmin(BulkDeleteUsersMixin, admin.ModelAdmin):
     list_display = ('user',)
+    actions = ["bulk_delete"]
     readonly_fields = ('user',)
 
     def has_add_permission(self, request):
@@ -205,9 +228,52 @@ class ExpertAdmin(admin.ModelAdmin):
 
 @admin.register(Grade)
 class GradeAdmin(ExportMixin, admin.ModelAdmin):
+    change_list_template = "admin/uralapi/grade_changelist.html"
     resource_class = GradeResource
     list_display = [field.name for field in Grade._meta.get_fields() if field.name != 'id']
+    list_filter = ('stage__event', 'stage', 'team')
     search_fields = ('user__username', 'trainee__user__username', 'stage__stage_name')
+    actions = ['export_pivot']
+
+    def get_urls(self):
+        """
+        Перегрузка метода. Добавляет адреса потоковой выгрузки оценок
+        :return: URL адреса на странице
+        """
+        urls = super().get_urls()
+        info = self.get_model_info()
+        my_urls = [
+            path('export-csv/', self.admin_site.admin_view(self.export_csv), name='%s_%s_export_csv' % info),
+            path('export-xlsx/', self.admin_site.admin_view(self.export_xlsx), name='%s_%s_export_xlsx' % info),
+        ]
+        return my_urls + urls
+
+    def _exporter(self, request):
+        if not self.has_export_permission(request):
+            raise PermissionDenied
+        # учитываются поиск и фильтры, выбранные в списке оценок
+        return GradeExporter(self.get_export_queryset(request))
+
+    def export_csv(self, request):
+        """Потоковая выгрузка оценок в CSV"""
+        return self._exporter(request).csv_response()
+
+    def export_xlsx(self, request):
+        """Выгрузка оценок в XLSX, книга записывается построчно"""
+        return self._exporter(request).xlsx_response()
+
+    def export_pivot(self, request, queryset):
+        """Сводная таблица средних оценок стажер x этап x компетенция по выбранным оценкам в XLSX"""
+        return GradePivotExporter(GradePivot(queryset).compute()).xlsx_response()
+
+    export_pivot.short_description = "Сводная таблица по стажерам и этапам (XLSX)"
+
+    def save_model(self, request, obj, form, change):
+        """Перегрузка метода. Учитывает изменение оценки в сводной таблице стажера"""
+        previous = Grade.objects.select_related('user', 'trainee').get(pk=obj.pk) if change else None
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            TraineeRatingSummary.objects.apply(added=[obj], removed=[previous] if previous else [])
 
     def get_readonly_fields(self, request, obj=None):
         """
@@ -229,3 +295,52 @@ class EventAdmin(admin.ModelAdmin):
 @admin.register(GradeDescription)
 class GradeDescriptionAdmin(admin.ModelAdmin):
     list_display = ('name', 'description')
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'status', 'progress', 'attempts', 'created_at', 'started_at', 'finished_at')
+    list_filter = ('status', 'name')
+    readonly_fields = [field.name for field in BackgroundJob._meta.fields]
+    actions = ['retry']
+
+    def progress(self, obj):
+        if obj.progress_total:
+            return f'{obj.progress_done} / {obj.progress_total} ({obj.progress_done * 100 // obj.progress_total}%)'
+        return obj.progress_done
+
+    progress.short_description = "Прогресс"
+
+    def retry(self, request, queryset):
+        """Возвращает в очередь задачи, завершившиеся ошибкой. Импорт, файл которого уже удален, не повторяется"""
+        failed = queryset.filter(status=BackgroundJob.FAILED)
+        missing = [background_job.pk for background_job in failed.filter(name=import_trainees_csv.__name__)
+                   if not upload_storage.exists(background_job.payload['path'])]
+        count = failed.exclude(pk__in=missing).update(
+            status=BackgroundJob.PENDING, attempts=0, run_after=timezone.now(), finished_at=None)
+        self.message_user(request, f"Задач возвращено в очередь: {count}")
+        if missing:
+            self.message_user(request, f"Не повторены задачи импорта без загруженного файла: {len(missing)}, "
+                                       f"загрузите файл заново", messages.WARNING)
+
+    retry.short_description = "Повторить"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(MailDelivery)
+class MailDeliveryAdmin(admin.ModelAdmin):
+    list_display = ('email', 'kind', 'status', 'attempts', 'sent_at')
+    list_filter = ('kind', 'status')
+    search_fields = ('email',)
+    readonly_fields = [field.name for field in MailDelivery._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
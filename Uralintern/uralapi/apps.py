@@ -4,3 +4,28 @@ from django.apps import AppConfig
 class UralapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'uralapi'
+
+    def ready(self):
+        from django.db.models.signals import post_save, post_delete
+        from . import cache, profiles, sync
+        from .backends import invalidate_user_claims
+        from .models import Event, GradeDescription, Stage, User
+
+        # любое изменение справочников делает недействительным их кэш
+        for model in (Event, GradeDescription, Stage):
+            post_save.connect(cache.reference_changed, sender=model, dispatch_uid=f'reference_cache_{model.__name__}')
+            post_delete.connect(cache.reference_changed, sender=model, dispatch_uid=f'reference_cache_delete_{model.__name__}')
+
+        # профиль стажера, куратора или эксперта по роли нового пользователя
+        post_save.connect(profiles.create_profiles, sender=User, dispatch_uid='user_profiles')
+
+        # поля пользователя, закэшированные при аутентификации
+        post_save.connect(invalidate_user_claims, sender=User, dispatch_uid='user_claims')
+        post_delete.connect(invalidate_user_claims, sender=User, dispatch_uid='user_claims_delete')
+
+
+        # журнал изменений для синхронизации мобильного клиента
+        for model in sync.SYNC_MODELS:
+            post_save.connect(sync.record_saved, sender=model, dispatch_uid=f'changelog_{model.__name__}')
+            post_delete.connect(sync.record_deleted, sender=model, dispatch_uid=f'changelog_delete_{model.__name__}')
+        post_save.connect(sync.record_user_saved, sender=User, dispatch_uid='changelog_user')
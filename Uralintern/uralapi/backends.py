@@ -1,10 +1,77 @@
 import jwt
 
 from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
 
 from rest_framework import authentication, exceptions
 
-from .models import User
+from .models import User, bulk_deletion
+
+USER_CLAIMS_KEY = 'uralapi:auth:user:{}'
+
+
+class TokenUser(SimpleLazyObject):
+    """
+    Пользователь, восстановленный из токена без запроса к базе. Поля id, system_role, is_active и is_staff
+    берутся из токена и кэша, полная запись пользователя загружается из базы только при обращении к другим полям.
+    """
+
+    def __init__(self, pk, claims):
+        self.__dict__['_claims'] = dict(claims, id=pk)
+        super().__init__(lambda: User.objects.get(pk=pk))
+
+    @property
+    def pk(self):
+        return self._claims['id']
+
+    id = pk
+
+    @property
+    def system_role(self):
+        return self._claims['system_role']
+
+    @property
+    def is_active(self):
+        return self._claims['is_active']
+
+    @property
+    def is_staff(self):
+        return self._claims['is_staff']
+
+    @property
+    def is_authenticated(self):
+        return True
+
+    @property
+    def is_anonymous(self):
+        return False
+
+    def __bool__(self):
+        return True
+
+
+def get_user_claims(pk):
+    """
+    Поля пользователя, необходимые для аутентификации, из кэша. При отсутствии в кэше загружает их из базы.
+
+    :return: Словарь {'system_role', 'is_active', 'is_staff'} или None, если пользователь не найден
+    """
+    key = USER_CLAIMS_KEY.format(pk)
+    claims = cache.get(key)
+    if claims is None:
+        claims = User.objects.filter(pk=pk).values('system_role', 'is_active', 'is_staff').first()
+        if claims is None:
+            return None
+        cache.set(key, claims, getattr(settings, 'JWT_USER_CACHE_TTL', 60))
+    return claims
+
+
+def invalidate_user_claims(sender, instance, **kwargs):
+    """Обработчик сигнала. Удаляет из кэша поля пользователя при его изменении или удалении."""
+    if bulk_deletion.get():
+        return
+    cache.delete(USER_CLAIMS_KEY.format(instance.pk))
 
 
 class JWTAuthentication(authentication.BaseAuthentication):
@@ -64,6 +131,9 @@ class JWTAuthentication(authentication.BaseAuthentication):
             msg = 'Ошибка аутентификации. Невозможно декодировать токеню'
             raise exceptions.AuthenticationFailed(msg)
 
+        if getattr(settings, 'JWT_STATELESS_AUTH', False) and 'role' in payload:
+            return self._authenticate_claims(payload, token)
+
         try:
             user = User.objects.get(pk=payload['id'])
         except User.DoesNotExist:
@@ -74,4 +144,23 @@ class JWTAuthentication(authentication.BaseAuthentication):
             msg = 'Данный пользователь деактивирован.'
             raise exceptions.AuthenticationFailed(msg)
 
-        return (user, token)
\ No newline at end of file
+        return (user, token)
+
+    def _authenticate_claims(self, payload, token):
+        """
+        Аутентификация без загрузки пользователя: роль берется из токена, активность - из кэша полей пользователя.
+        """
+        claims = get_user_claims(payload['id'])
+        if claims is None:
+            msg = 'Пользователь соответствующий данному токену не найден.'
+            raise exceptions.AuthenticationFailed(msg)
+
+        if not claims['is_active']:
+            msg = 'Данный пользователь деактивирован.'
+            raise exceptions.AuthenticationFailed(msg)
+
+        if claims['system_role'] != payload['role']:
+            msg = 'Ошибка аутентификации. Токен устарел.'
+            raise exceptions.AuthenticationFailed(msg)
+
+        return (TokenUser(payload['id'], claims), token)
@@ -0,0 +1,57 @@
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rollback():
+    """Контекстный менеджер для замеров: все изменения базы внутри блока будут отменены"""
+    try:
+        with transaction.atomic():
+            yield
+            raise _Rollback
+    except _Rollback:
+        pass
+
+
+def measure(func, repeat=5) -> dict:
+    """Замеряет время выполнения функции и количество запросов к базе
+
+    :param func: Функция без аргументов
+    :param repeat: Количество повторов
+
+    :return: {'queries': кол-во запросов за один вызов, 'p50': медиана в мс, 'min': минимум в мс}
+    """
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        queries = len(context.captured_queries)
+    return {'queries': queries, 'p50': statistics.median(timings), 'min': min(timings)}
+
+
+def api_client(user=None) -> Client:
+    """Тестовый клиент для замеров API. Если передан пользователь, запросы подписываются его токеном."""
+    host = next((host for host in settings.ALLOWED_HOSTS if host not in ('*', '') and not host.startswith('.')),
+                'localhost')
+    headers = {'HTTP_HOST': host}
+    if user is not None:
+        headers['HTTP_AUTHORIZATION'] = f'Token {user.token}'
+    return Client(**headers)
+
+
+def quiet_middleware():
+    """Отключает middleware сбора метрик (uralapi/metrics.py), чтобы замеры не включали его накладные расходы"""
+    return override_settings(MIDDLEWARE=[name for name in settings.MIDDLEWARE if name != 'uralapi.metrics.MetricsMiddleware'])
@@ -0,0 +1,113 @@
+"""
+Кэш справочных данных (этапы, мероприятия, описания оценок).
+
+Все записи кэша привязаны к версии справочников. Версия хранится в кэше Django и меняется при любом
+изменении справочных моделей, поэтому после правки в админке старые записи больше не читаются.
+Записи дополнительно хранятся в LRU-кэше процесса, чтобы не обращаться к кэшу Django за данными.
+"""
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+VERSION_KEY = 'uralapi:reference:version'
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Простой потокобезопасный LRU-кэш процесса"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_options = getattr(settings, 'REFERENCE_CACHE', {})
+_local = LRUCache(_options.get('LRU_SIZE', 128))
+
+
+def _backend():
+    return caches[_options.get('ALIAS', 'default')]
+
+
+def get_version() -> str:
+    """Текущая версия справочных данных. Если версии еще нет, создает ее."""
+    backend = _backend()
+    version = backend.get(VERSION_KEY)
+    if version is None:
+        # add не перезапишет версию, если ее одновременно создал другой процесс
+        backend.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = backend.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    """Выставляет новую версию справочных данных, все ранее закэшированные записи становятся недоступны"""
+    _backend().set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def invalidate():
+    """
+    Сбрасывает кэш справочных данных сразу и еще раз после фиксации транзакции, чтобы запрос,
+    прочитавший данные до фиксации, не оставил в кэше устаревшую запись под новой версией.
+    """
+    bump_version()
+    transaction.on_commit(bump_version)
+
+
+def get_or_load(name, loader):
+    """
+    Читает справочные данные из кэша, при отсутствии загружает и сохраняет их.
+
+    :param name: Имя записи
+    :param loader: Функция без аргументов, загружающая данные из базы
+    :return: (данные, версия справочников)
+    """
+    try:
+        version = get_version()
+    except Exception:
+        version = None
+    if version is None:
+        # кэш Django недоступен - без версии нельзя гарантировать актуальность, читаем из базы
+        return loader(), None
+
+    key = f'uralapi:reference:{version}:{name}'
+    value = _local.get(key, _MISSING)
+    if value is not _MISSING:
+        return value, version
+
+    backend = _backend()
+    value = backend.get(key, _MISSING)
+    if value is _MISSING:
+        value = loader()
+        backend.set(key, value, _options.get('TIMEOUT', 60 * 60 * 24))
+    _local.set(key, value)
+    return value, version
+
+
+def reference_changed(sender, **kwargs):
+    """Обработчик сигнала. Сбрасывает кэш при изменении справочной модели."""
+    invalidate()
@@ -0,0 +1,88 @@
+"""
+Массовое удаление пользователей вместе с профилями (Trainee, Curator, Expert) и оценками.
+
+При обычном удалении Django загружает каждую оценку удаляемых пользователей и отправляет по ней сигнал:
+оценка вычитается из сводной таблицы и записывается в журнал синхронизации отдельными запросами,
+а delete_parent удаляет пользователя каждого удаленного профиля отдельным каскадом.
+delete_users выполняет то же самое в одной транзакции несколькими запросами для всего набора:
+эти обработчики отключены флагом bulk_deletion, оценки удаляются одним DELETE.
+"""
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .backends import USER_CLAIMS_KEY
+from .models import ChangeLog, Curator, Expert, Grade, Team, Trainee, TraineeRatingSummary, User, bulk_deletion
+
+
+@contextmanager
+def muted_receivers():
+    """Отключает обработчики удаления отдельных записей, см. models.bulk_deletion"""
+    token = bulk_deletion.set(True)
+    try:
+        yield
+    finally:
+        bulk_deletion.reset(token)
+
+
+def _grades(user_ids):
+    """Оценки, которые поставили или получили пользователи"""
+    return Grade.objects.filter(Q(user_id__in=user_ids) | Q(trainee__user_id__in=user_ids))
+
+
+def deletion_counts(user_ids) -> dict:
+    """
+    Количество записей, которые удалит delete_users, для подтверждения в панели администратора
+
+    :param user_ids: id пользователей
+    :return: {модель: количество}, Team - команды, которые останутся без куратора
+    """
+    user_ids = list(user_ids)
+    counts = {model: model.objects.filter(**{'pk__in' if model is User else 'user_id__in': user_ids}).count()
+              for model in (User, Trainee, Curator, Expert)}
+    counts[Grade] = _grades(user_ids).count()
+    counts[Team] = Team.objects.filter(curator__user_id__in=user_ids).count()
+    return counts
+
+
+def delete_users(user_ids) -> dict:
+    """
+    Удаляет пользователей, их профили и оценки, которые они поставили или получили
+
+    :param user_ids: id пользователей
+    :return: Количество удаленных записей {модель: количество}
+    """
+    user_ids = list(user_ids)
+    with transaction.atomic(), muted_receivers():
+        # оценки удаляемых пользователей оставшимся стажерам вычитаются из сводных таблиц этих стажеров,
+        # сводные таблицы удаляемых стажеров удаляются каскадом
+        TraineeRatingSummary.objects.apply(removed=list(
+            Grade.objects.filter(user_id__in=user_ids).exclude(trainee__user_id__in=user_ids)
+            .select_related('user', 'trainee')))
+        grades = _grades(user_ids)
+        grade_ids = list(grades.values_list('pk', flat=True))
+        trainee_ids = list(Trainee.objects.filter(user_id__in=user_ids).values_list('pk', flat=True))
+        team_ids = list(Team.objects.filter(curator__user_id__in=user_ids).values_list('pk', flat=True))
+
+        # у оценок нет зависимых записей, поэтому они удаляются без загрузки в память
+        grades._raw_delete(grades.db)
+        # куратор команды убирается вместе с датой изменения, чтобы сменился ETag состава команды
+        Team.objects.filter(pk__in=team_ids).update(curator=None, updated_at=timezone.now())
+        _, deleted = User.objects.filter(pk__in=user_ids).delete()
+
+        ChangeLog.objects.record(Grade, grade_ids, deleted=True)
+        ChangeLog.objects.record(Trainee, trainee_ids, deleted=True)
+        ChangeLog.objects.record(Team, team_ids)
+    cache.delete_many([USER_CLAIMS_KEY.format(pk) for pk in user_ids])
+
+    counts = {model: deleted.get(model._meta.label, 0) for model in (User, Trainee, Curator, Expert)}
+    counts[Grade] = len(grade_ids)
+    return counts
+
+
+def describe(counts) -> str:
+    """Количество записей по моделям для сообщения администратору"""
+    return ', '.join(f'{model._meta.verbose_name_plural}: {count}' for model, count in counts.items())
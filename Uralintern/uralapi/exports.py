@@ -0,0 +1,104 @@
+import csv
+import io
+import tempfile
+from itertools import islice
+
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+
+from .functions import COMPETENCES
+from .models import Grade
+
+
+class TableExporter:
+    """
+    Выгрузка таблицы в CSV и XLSX без сборки всего набора данных в памяти.
+    Наследники определяют name, headers и генератор строк rows().
+    """
+    name = 'export'
+    chunk_size = 2000
+    headers = ()
+
+    def rows(self):
+        raise NotImplementedError
+
+    def filename(self, extension):
+        return f'{self.name}-{timezone.localdate():%Y-%m-%d}.{extension}'
+
+    def iter_csv(self):
+        """
+        Генератор CSV по частям из chunk_size строк
+        :return: Строки CSV файла
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # BOM нужен Excel, чтобы распознать кодировку
+        buffer.write('\ufeff')
+        writer.writerow(self.headers)
+        rows = iter(self.rows())
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            writer.writerows(chunk)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    def csv_response(self):
+        response = StreamingHttpResponse(self.iter_csv(), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{self.filename("csv")}"'
+        return response
+
+    def write_xlsx(self, file):
+        """
+        Запись XLSX в режиме write-only: строки сразу сбрасываются во временные файлы openpyxl
+        :param file: Файловый объект для записи книги
+        """
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(self.name)
+        sheet.append(list(self.headers))
+        for row in self.rows():
+            sheet.append(row)
+        workbook.save(file)
+
+    def xlsx_response(self):
+        # книга собирается во временном файле на диске, а не в памяти
+        file = tempfile.TemporaryFile()
+        self.write_xlsx(file)
+        file.seek(0)
+        return FileResponse(file, as_attachment=True, filename=self.filename('xlsx'),
+                            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+
+class GradeExporter(TableExporter):
+    """
+    Потоковая выгрузка оценок. Строки читаются одним запросом с join через values_list
+    и iterator(chunk_size), поэтому память не зависит от количества оценок.
+    Набор колонок совпадает с GradeResource.
+    """
+    name = 'Grade'
+    fields = ('user__username', 'trainee__user__username', 'team__team_name', 'stage__stage_name',
+              *COMPETENCES, 'date')
+
+    def __init__(self, queryset=None):
+        """
+        :param queryset: Оценки для выгрузки, например с учетом фильтров панели администратора
+        """
+        self.queryset = Grade.objects.all() if queryset is None else queryset
+
+    @property
+    def headers(self):
+        """Локализованные заголовки колонок: verbose_name поля модели оценки"""
+        return [Grade._meta.get_field(name.split('__')[0]).verbose_name for name in self.fields]
+
+    def rows(self):
+        """
+        Строки выгрузки. Дата оценки переводится в локальное время без часового пояса, как в GradeResource:
+        XLSX не поддерживает даты с часовым поясом
+        """
+        queryset = self.queryset.order_by('pk').values_list(*self.fields)
+        for row in queryset.iterator(chunk_size=self.chunk_size):
+            yield row[:-1] + (timezone.make_naive(row[-1]).replace(microsecond=0),)
@@ -1,16 +1,26 @@
 import random
 import string
 
+from django.db.models import Avg, Case, F, FloatField, IntegerField, Q, When
+from django.db.models.functions import Coalesce
 
-def serialize_stages(stages):
-    data = []
+
+def index_stages(stages) -> dict:
+    """Группирует этапы по мероприятию
+
+    :param stages: Итерируемый набор этапов (например, QuerySet активных этапов)
+
+    :return: Словарь {id мероприятия: [{'id': ..., 'stage_name': ...}, ...]}
+    """
+    index = {}
     for stage in stages:
-        data.append({
+        index.setdefault(stage.event_id, []).append({
             'id': stage.pk,
             'stage_name': stage.stage_name
         })
 
-    return data
+    return index
+
 
 def generate_password():
     """Созадет случайный пароль размерами от 8 до 12 символов из букв латиницы верхнего и нижнего регистра и цифр"""
@@ -19,22 +29,61 @@ def generate_password():
     return ''.join(random.choice(chars) for x in range(size))
 
 
+COMPETENCES = ('competence1', 'competence2', 'competence3', 'competence4')
+
+# Условия, по которым оценка попадает в ту или иную группу отчета. Условия записаны относительно
+# оцениваемого стажера (trainee), поэтому работают как для одного стажера, так и при группировке по стажерам.
+RATING_BUCKETS = {
+    "general": None,  # все оценки стажера
+    "self": Q(user=F('trainee__user')),  # самооценка
+    # оценки от команды; если стажер без команды, то и оценки сохранены без команды
+    "team": Q(team=F('trainee__team')) | Q(team__isnull=True, trainee__team__isnull=True),
+    "expert": ~Q(user__system_role="TRAINEE"),  # оценки от админа, куратора, экспертов
+}
+
+
+def rating_aggregates() -> dict:
+    """Выражения для подсчета средних оценок по всем группам отчета одним запросом.
+
+    Пустая компетенция считается как 0, оценки не попавшие в группу в среднем не учитываются.
+
+    :return: Словарь вида {'<группа>__<компетенция>': Avg(...)} для aggregate() или annotate()
+    """
+    aggregates = {}
+    for bucket, condition in RATING_BUCKETS.items():
+        for competence in COMPETENCES:
+            value = Coalesce(competence, 0, output_field=IntegerField())
+            if condition is not None:
+                value = Case(When(condition, then=value), default=None)
+            aggregates[f'{bucket}__{competence}'] = Avg(value, output_field=FloatField())
+    return aggregates
+
+
+def build_report(row: dict) -> dict:
+    """Собирает результат rating_aggregates() в формат отчета
+
+    :param row: Словарь, полученный из aggregate() или строки values().annotate()
+
+    :return: {'general': {...}, 'self': {...}, 'team': {...}, 'expert': {...}}
+    """
+    report = {}
+    for bucket in RATING_BUCKETS:
+        report[bucket] = {}
+        for competence in COMPETENCES:
+            value = row.get(f'{bucket}__{competence}')
+            report[bucket][competence] = round(float(value), 2) if value is not None else 0
+    return report
+
+
 def get_report(trainee, grades):
-    general_rating_query = grades.filter(trainee=trainee)
-    self_rating_query = grades.filter(user=trainee.user)
-    team_rating_query = grades.filter(team=trainee.team)
-    expert_rating_query = grades.exclude(user__system_role="TRAINEE")
+    """Подсчет отчета по оценкам стажера одним запросом к базе
 
-    general_rating = get_rating(general_rating_query)
-    self_rating = get_rating(self_rating_query)
-    team_rating = get_rating(team_rating_query)
-    expert_rating = get_rating(expert_rating_query)
+    :param trainee: Стажер, для которого формируется отчет
+    :param grades: QuerySet объектов модели Grade
 
-    return {
-        "general": general_rating,
-        "self": self_rating,
-        "team": team_rating,
-        "expert": expert_rating}
+    :return: Словарь со средними оценками по группам general, self, team, expert
+    """
+    return build_report(grades.filter(trainee=trainee).aggregate(**rating_aggregates()))
 
 
 def get_rating(grades):
@@ -44,18 +93,10 @@ def get_rating(grades):
 
     :return: Словарь со средними оценками по компетенциям.
     """
-    rating_list = [[], [], [], []]
-    average = lambda grades: round(sum(grades) / len(grades), 2) if len(grades) > 0 else 0
-    for grade in grades:
-        rating_list[0].append(grade.competence1 if grade.competence1 != None else 0)
-        rating_list[1].append(grade.competence2 if grade.competence2 != None else 0)
-        rating_list[2].append(grade.competence3 if grade.competence3 != None else 0)
-        rating_list[3].append(grade.competence4 if grade.competence4 != None else 0)
-
-    return {"competence1": average(rating_list[0]),
-            "competence2": average(rating_list[1]),
-            "competence3": average(rating_list[2]),
-            "competence4": average(rating_list[3])}
+    row = grades.aggregate(**{
+        f'general__{competence}': Avg(Coalesce(competence, 0, output_field=IntegerField()), output_field=FloatField())
+        for competence in COMPETENCES})
+    return build_report(row)["general"]
 
 
 def upload_to(instance, filename: str):
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class TunablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 с количеством итераций из настройки PASSWORD_HASH_ITERATIONS.
+
+    Алгоритм совпадает со стандартным pbkdf2_sha256, поэтому уже сохраненные пароли проверяются этим же
+    хэшером. Если количество итераций в хэше отличается от настройки, при следующем входе Django
+    перехэширует пароль с новым количеством итераций.
+    """
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_HASH_ITERATIONS', PBKDF2PasswordHasher.iterations)
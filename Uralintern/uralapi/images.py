@@ -0,0 +1,108 @@
+"""
+Обработка изображений стажеров: поворот по EXIF и удаление метаданных, уменьшение оригинала,
+квадратные миниатюры в WebP (JPEG, если Pillow собран без WebP).
+
+Обработка выполняется фоновой задачей tasks.process_trainee_image после загрузки изображения,
+пока миниатюр нет, клиенты получают оригинал. Размеры и формат задаются в settings.TRAINEE_IMAGE.
+"""
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps, features
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .storage import HASHED_NAME
+
+# форматы, в которых пересохраняется оригинал, по расширению файла
+ORIGINAL_FORMATS = {'jpg': 'JPEG', 'jpeg': 'JPEG', 'png': 'PNG'}
+
+
+def thumbnail_format() -> str:
+    """Формат миниатюр из настроек, JPEG - если Pillow не поддерживает WebP"""
+    image_format = settings.TRAINEE_IMAGE['FORMAT'].upper()
+    if image_format == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return image_format
+
+
+def thumbnail_name(name, size, image_format) -> str:
+    """
+    Имя файла миниатюры. Содержит имя оригинала, поэтому новое изображение получает новые адреса миниатюр
+
+    :param name: Имя оригинала в хранилище, например images/1.jpg
+    :param size: Название размера из settings.TRAINEE_IMAGE['THUMBNAILS']
+    :param image_format: Формат миниатюры
+    """
+    directory, filename = os.path.split(HASHED_NAME.sub('', name))
+    stem = os.path.splitext(filename)[0]
+    ext = 'jpg' if image_format == 'JPEG' else image_format.lower()
+    return f'{directory}/thumbnails/{stem}_{size}.{ext}'
+
+
+def thumbnail_urls(storage, thumbnails) -> dict:
+    """
+    Адреса миниатюр для ответа API
+
+    :param storage: Хранилище поля Trainee.image
+    :param thumbnails: Значение Trainee.thumbnails {размер: имя файла}
+    :return: {размер: адрес}, пустой словарь, если изображение еще не обработано
+    """
+    return {size: storage.url(name) for size, name in (thumbnails or {}).items()}
+
+
+def delete_thumbnails(storage, thumbnails):
+    """Удаляет файлы миниатюр из хранилища"""
+    for name in (thumbnails or {}).values():
+        storage.delete(name)
+
+
+def _open(file, max_size):
+    image = Image.open(file)
+    if image.format == 'JPEG':
+        # JPEG декодируется сразу в уменьшенном масштабе, это в разы быстрее для фотографий с телефона
+        image.draft('RGB', (max_size, max_size))
+    # EXIF Orientation применяется к пикселям, потому что сами метаданные не сохраняются
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    return image
+
+
+def _encode(image, image_format) -> bytes:
+    """Сохраняет изображение без метаданных (exif, icc, комментарии не передаются)"""
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    options = {'optimize': True} if image_format in ('JPEG', 'PNG') else {'method': 4}
+    if image_format != 'PNG':
+        options['quality'] = settings.TRAINEE_IMAGE['QUALITY']
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def process_image(storage, name):
+    """
+    Сохраняет оригинал без метаданных, уменьшая его до MAX_SIZE по большей стороне, и создает миниатюры.
+    Прежний файл не удаляется: его удаляет django_cleanup, когда стажеру будет присвоен новый
+
+    :param storage: Хранилище поля Trainee.image
+    :param name: Имя оригинала в хранилище
+    :return: (имя обработанного оригинала, {размер: имя файла миниатюры})
+    """
+    options = settings.TRAINEE_IMAGE
+    max_size = options['MAX_SIZE']
+    with storage.open(name, 'rb') as file:
+        image = _open(file, max_size)
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+
+    original_format = ORIGINAL_FORMATS.get(name.rsplit('.', 1)[-1].lower(), 'JPEG')
+    original = storage.save(name, ContentFile(_encode(image, original_format)))
+
+    image_format = thumbnail_format()
+    thumbnails = {}
+    for size, pixels in options['THUMBNAILS'].items():
+        thumbnail = ImageOps.fit(image, (pixels, pixels), Image.LANCZOS)
+        thumbnails[size] = storage.save(thumbnail_name(original, size, image_format),
+                                        ContentFile(_encode(thumbnail, image_format)))
+    return original, thumbnails
@@ -0,0 +1,183 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from .functions import generate_password
+from .models import Event, Team, Trainee, User
+from .profiles import bulk_provision
+
+
+def hash_workers_setting() -> int:
+    """Количество процессов для хэширования паролей из CSV_IMPORT_HASH_WORKERS, по умолчанию по числу ядер"""
+    return getattr(settings, 'CSV_IMPORT_HASH_WORKERS', None) or os.cpu_count() or 1
+
+
+def hashing_executor(workers):
+    """Пул процессов для хэширования паролей, при одном процессе пароли хэшируются в текущем"""
+    if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        # fork сохраняет настройки Django в дочерних процессах
+        return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+    return _SerialExecutor()
+
+
+def hash_passwords(executor, passwords, workers) -> list:
+    """
+    Хэширует пароли make_password в пуле hashing_executor
+
+    :param executor: Пул из hashing_executor(workers)
+    :param passwords: Список паролей
+    :param workers: Количество процессов пула, пароли делятся между ними поровну
+    :return: Хэши в порядке паролей
+    """
+    return list(executor.map(make_password, passwords, chunksize=max(len(passwords) // workers, 1)))
+
+
+class ImportResult:
+    """Результат импорта: количество обработанных и созданных записей и ошибки по строкам"""
+
+    def __init__(self):
+        self.processed = 0
+        self.created = 0
+        self.errors = []  # (номер строки, сообщение)
+
+    def add_error(self, line, message):
+        self.errors.append((line, message))
+
+    def __str__(self):
+        return f'Обработано строк: {self.processed}, создано стажеров: {self.created}, ошибок: {len(self.errors)}'
+
+
+class TraineeCsvImporter:
+    """
+    Импорт стажеров из CSV. Строки читаются порциями по chunk_size, поэтому память не зависит от размера файла.
+    Команды и мероприятия загружаются один раз, пароли хэшируются в пуле процессов, пользователи
+    создаются через bulk_create, стажеры - через bulk_provision (uralapi/profiles.py).
+    Созданные пользователи сопоставляются со строками по почте.
+    """
+    chunk_size = 500
+
+    def __init__(self, hash_workers=None, progress=None):
+        """
+        :param hash_workers: Количество процессов для хэширования паролей (по умолчанию CSV_IMPORT_HASH_WORKERS)
+        :param progress: Функция progress(result), вызывается после каждой порции
+        """
+        if hash_workers is None:
+            hash_workers = hash_workers_setting()
+        self.hash_workers = hash_workers
+        self.progress = progress
+        self.teams = {}
+        self.events = {}
+        self.seen_emails = set()
+
+    def run(self, rows) -> ImportResult:
+        """
+        :param rows: Итерируемый набор строк CSV в виде словарей (например, csv.DictReader)
+        :return: ImportResult
+        """
+        result = ImportResult()
+        self.teams = dict(Team.objects.values_list('team_name', 'pk'))
+        self.events = dict(Event.objects.values_list('event_name', 'pk'))
+
+        with hashing_executor(self.hash_workers) as executor:
+            # первая строка файла - заголовок
+            numbered = enumerate(rows, start=2)
+            while True:
+                chunk = list(islice(numbered, self.chunk_size))
+                if not chunk:
+                    break
+                self._import_chunk(chunk, executor, result)
+                result.processed += len(chunk)
+                if self.progress:
+                    self.progress(result)
+        return result
+
+    def _import_chunk(self, chunk, executor, result):
+        parsed = {}
+        for line, data in chunk:
+            try:
+                row = self._parse(data)
+            except ValueError as error:
+                result.add_error(line, str(error))
+                continue
+            if row['email'].lower() in self.seen_emails:
+                result.add_error(line, f'Почта {row["email"]} повторяется в файле')
+                continue
+            self.seen_emails.add(row['email'].lower())
+            parsed[row['email']] = (line, row)
+
+        # почта сравнивается без учета регистра, как и повторы внутри файла
+        existing = set(User.objects.annotate(email_lower=Lower('email'))
+                       .filter(email_lower__in=[email.lower() for email in parsed])
+                       .values_list('email_lower', flat=True))
+        for email in [email for email in parsed if email.lower() in existing]:
+            line, _ = parsed.pop(email)
+            result.add_error(line, f'Пользователь с почтой {email} уже существует')
+        if not parsed:
+            return
+
+        passwords = [generate_password() for _ in parsed]
+        hashes = hash_passwords(executor, passwords, self.hash_workers)
+        users = [User(username=row['username'], email=email, social_url=row['social_url'],
+                      password=password_hash, unhashed_password=password)
+                 for (email, (_, row)), password, password_hash in zip(parsed.items(), passwords, hashes)]
+
+        with transaction.atomic():
+            User.objects.bulk_create(users, ignore_conflicts=True)
+            # только записи, вставленные этим вызовом: хэши паролей с солью уникальны. Пользователя с той же
+            # почтой, которого одновременно создал другой запрос, bulk_create пропустил, он не импортируется
+            created = {user.email: user for user in User.objects.filter(
+                email__in=list(parsed), password__in=[user.password for user in users])
+                .only('pk', 'email', 'system_role')}
+            fields = {}
+            for email, (line, row) in parsed.items():
+                if email not in created:
+                    result.add_error(line, f'Пользователь с почтой {email} уже существует')
+                    continue
+                fields[created[email].pk] = {
+                    'internship': row['internship'], 'course': row['course'], 'speciality': row['speciality'],
+                    'institution': row['institution'], 'team_id': self.teams.get(row['team']),
+                    'event_id': self.events.get(row['event'])}
+            trainees = bulk_provision(created.values(), fields).get(Trainee, [])
+        result.created += len(trainees)
+
+    def _parse(self, data) -> dict:
+        """Проверяет строку CSV и приводит ее к полям модели, при ошибке бросает ValueError"""
+        email = (data.get("Частный e-mail") or '').strip()
+        username = (data.get("ФИО") or '').strip()
+        if not email:
+            raise ValueError('Не указана почта')
+        if not username:
+            raise ValueError('Не указано ФИО')
+        course = (data.get("Курс") or '').strip()
+        if course and not course.isdigit():
+            raise ValueError(f'Некорректный курс: {course}')
+        return {
+            'email': User.objects.normalize_email(email),
+            'username': username,
+            'social_url': (data.get("Личная страница") or '').strip() or None,
+            'internship': data.get("Направление стажировки") or '',
+            'course': int(course) if course else None,
+            'speciality': data.get("Учебная специальность") or '',
+            'institution': data.get("Учебное заведение") or '',
+            'team': data.get("Команда"),
+            'event': data.get("Мероприятие"),
+        }
+
+
+class _SerialExecutor:
+    """Заменяет пул процессов, когда хэширование выполняется в текущем процессе"""
+
+    def map(self, func, *iterables, chunksize=1):
+        return map(func, *iterables)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
@@ -0,0 +1,109 @@
+"""
+Очередь фоновых задач в базе данных, без внешнего брокера.
+
+Задача регистрируется декоратором @job и ставится в очередь вызовом <функция>.delay(**параметры).
+Обработчик получает объект BackgroundJob и параметры задачи, через job.set_progress() сообщает прогресс.
+Задачи выполняет воркер: manage.py run_jobs. При ошибке задача повторяется с растущей задержкой,
+пока не исчерпаны попытки.
+"""
+import logging
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def job(name=None, max_attempts=3):
+    """Декоратор, регистрирует функцию как фоновую задачу и добавляет ей метод delay() для постановки в очередь"""
+    def decorator(func):
+        job_name = name or func.__name__
+        _registry[job_name] = func
+        func.delay = lambda **payload: enqueue(job_name, max_attempts=max_attempts, **payload)
+        return func
+    return decorator
+
+
+def enqueue(name, max_attempts=3, **payload) -> BackgroundJob:
+    """Ставит задачу в очередь, параметры должны сериализоваться в JSON"""
+    if name not in _registry:
+        raise KeyError(f'Неизвестная фоновая задача: {name}')
+    return BackgroundJob.objects.create(name=name, payload=payload, max_attempts=max_attempts)
+
+
+def claim_next():
+    """
+    Забирает следующую задачу из очереди. Захват выполняется условным update, поэтому одну задачу
+    не возьмут два воркера, в том числе на SQLite, где нет select_for_update.
+
+    :return: BackgroundJob или None, если очередь пуста
+    """
+    while True:
+        pk = BackgroundJob.objects.filter(status=BackgroundJob.PENDING, run_after__lte=timezone.now()) \
+            .order_by('run_after', 'pk').values_list('pk', flat=True).first()
+        if pk is None:
+            return None
+        claimed = BackgroundJob.objects.filter(pk=pk, status=BackgroundJob.PENDING).update(
+            status=BackgroundJob.RUNNING, started_at=timezone.now(), attempts=F('attempts') + 1)
+        if claimed:
+            return BackgroundJob.objects.get(pk=pk)
+
+
+def run(background_job):
+    """Выполняет задачу и сохраняет ее итоговый статус"""
+    handler = _registry.get(background_job.name)
+    try:
+        if handler is None:
+            raise KeyError(f'Неизвестная фоновая задача: {background_job.name}')
+        result = handler(background_job, **background_job.payload)
+    except Exception:
+        logger.exception('Ошибка фоновой задачи %s', background_job)
+        background_job.error = traceback.format_exc()
+        if handler is not None and background_job.attempts < background_job.max_attempts:
+            # повтор с экспоненциальной задержкой: 1, 2, 4... минуты
+            background_job.status = BackgroundJob.PENDING
+            background_job.run_after = timezone.now() + timedelta(minutes=2 ** (background_job.attempts - 1))
+        else:
+            background_job.status = BackgroundJob.FAILED
+            background_job.finished_at = timezone.now()
+    else:
+        background_job.status = BackgroundJob.DONE
+        background_job.result = '' if result is None else str(result)
+        background_job.error = ''
+        background_job.finished_at = timezone.now()
+    background_job.save(update_fields=['status', 'result', 'error', 'run_after', 'finished_at'])
+
+
+def recover_stale():
+    """Возвращает в очередь задачи, которые остались в статусе RUNNING после остановки воркера"""
+    timeout = getattr(settings, 'BACKGROUND_JOB_STALE_TIMEOUT', 60 * 60)
+    return BackgroundJob.objects.filter(status=BackgroundJob.RUNNING,
+                                        started_at__lt=timezone.now() - timedelta(seconds=timeout)) \
+        .update(status=BackgroundJob.PENDING)
+
+
+def run_worker(poll_interval=2.0, once=False):
+    """
+    Цикл воркера: выполняет задачи, пока они есть, затем ждет poll_interval секунд.
+
+    :param once: Выполнить все задачи из очереди и завершиться
+    """
+    recover_stale()
+    while True:
+        close_old_connections()
+        background_job = claim_next()
+        if background_job is not None:
+            run(background_job)
+            continue
+        if once:
+            return
+        time.sleep(poll_interval)
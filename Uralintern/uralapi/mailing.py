@@ -0,0 +1,170 @@
+"""
+Доставка писем через небольшой пул переиспользуемых SMTP соединений.
+
+Каждое соединение обслуживает отдельный поток, общий ограничитель задает максимальную скорость отправки.
+Письмо, которое не удалось отправить, повторяется с растущей задержкой. Результаты доставки передаются
+в вызывающий поток, поэтому работа с базой (журнал доставки) выполняется только в нем.
+"""
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+
+class RateLimiter:
+    """Ограничитель скорости: не больше rate событий в секунду на все потоки"""
+
+    def __init__(self, rate=None):
+        self.interval = 1 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class MailDispatcher:
+    """
+    Отправляет письма через connections соединений со скоростью не больше rate писем в секунду.
+
+    Пример::
+
+        for key, sent, attempts, error in MailDispatcher().send((user.pk, message) for ...):
+            ...
+    """
+    poll_interval = 0.1  # как часто send проверяет, что потоки отправки живы, пока ждет результатов
+
+    def __init__(self, connections=None, rate=None, max_attempts=None, backoff=None, connection_factory=None):
+        """
+        :param connections: Количество соединений (потоков)
+        :param rate: Максимум писем в секунду, None - без ограничения
+        :param max_attempts: Количество попыток отправки одного письма
+        :param backoff: Задержка перед повтором в секундах, удваивается с каждой попыткой
+        :param connection_factory: Функция, создающая соединение (по умолчанию get_connection)
+        """
+        options = getattr(settings, 'MAIL_DELIVERY', {})
+        self.connections = connections or options.get('CONNECTIONS', 1)
+        self.limiter = RateLimiter(rate if rate is not None else options.get('RATE_LIMIT'))
+        self.max_attempts = max_attempts or options.get('MAX_ATTEMPTS', 3)
+        self.backoff = backoff if backoff is not None else options.get('BACKOFF', 1.0)
+        self.connection_factory = connection_factory or get_connection
+
+    def send(self, messages):
+        """
+        Отправляет письма и возвращает результаты по мере отправки.
+        Если вызывающий код перестал читать результаты, неотправленные письма отбрасываются, а потоки завершаются.
+
+        :param messages: Итерируемый набор пар (ключ, EmailMessage)
+        :return: Генератор кортежей (ключ, отправлено, количество попыток, текст ошибки)
+        """
+        tasks = queue.Queue(maxsize=self.connections * 10)
+        results = queue.Queue()
+        workers = [threading.Thread(target=self._work, args=(tasks, results), daemon=True)
+                   for _ in range(self.connections)]
+        for worker in workers:
+            worker.start()
+
+        pending = 0
+        try:
+            for item in messages:
+                # пока очередь заполнена, отдаем уже готовые результаты
+                while True:
+                    try:
+                        tasks.put(item, timeout=self.poll_interval)
+                        break
+                    except queue.Full:
+                        self._check_alive(workers)
+                        while not results.empty():
+                            pending -= 1
+                            yield results.get()
+                pending += 1
+                while not results.empty():
+                    pending -= 1
+                    yield results.get()
+
+            while pending:
+                try:
+                    result = results.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    self._check_alive(workers)
+                    continue
+                pending -= 1
+                yield result
+        finally:
+            # неотправленные письма отбрасываются, чтобы в очереди хватило места для сигналов завершения
+            while True:
+                try:
+                    tasks.get_nowait()
+                except queue.Empty:
+                    break
+            for _ in workers:
+                tasks.put(None)
+            for worker in workers:
+                worker.join()
+
+    @staticmethod
+    def _check_alive(workers):
+        if not any(worker.is_alive() for worker in workers):
+            raise RuntimeError('Потоки отправки писем завершились')
+
+    def _work(self, tasks, results):
+        # ошибки не должны завершать поток: каждое письмо получает результат, иначе send ждал бы его вечно
+        try:
+            connection, connection_error = self.connection_factory(), None
+        except Exception as exc:
+            connection, connection_error = None, _describe(exc)
+        try:
+            while True:
+                item = tasks.get()
+                if item is None:
+                    return
+                key, message = item
+                if connection is None:
+                    results.put((key, False, 0, connection_error))
+                    continue
+                try:
+                    results.put(self._deliver(connection, key, message))
+                except Exception as exc:
+                    results.put((key, False, 1, _describe(exc)))
+        finally:
+            if connection is not None:
+                _close(connection)
+
+    def _deliver(self, connection, key, message):
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            self.limiter.wait()
+            try:
+                # открывает соединение при первом письме или после обрыва, дальше переиспользует его
+                connection.open()
+                message.connection = connection
+                connection.send_messages([message])
+                return key, True, attempt, None
+            except Exception as exc:
+                error = _describe(exc)
+                # после ошибки соединение могло остаться в неопределенном состоянии
+                _close(connection)
+                if attempt < self.max_attempts:
+                    time.sleep(self.backoff * 2 ** (attempt - 1))
+        return key, False, self.max_attempts, error
+
+
+def _describe(exc) -> str:
+    return f'{exc.__class__.__name__}: {exc}'
+
+
+def _close(connection):
+    """Закрывает соединение, ошибка закрытия (например, оборванного SMTP соединения) не важна"""
+    try:
+        connection.close()
+    except Exception:
+        pass
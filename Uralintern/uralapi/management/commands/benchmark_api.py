@@ -0,0 +1,207 @@
+import json
+import math
+import re
+import shutil
+import tempfile
+import time
+from io import BytesIO
+from itertools import count
+
+from PIL import Image
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from uralapi.benchmark import api_client, quiet_middleware, rollback
+from uralapi.functions import COMPETENCES
+from uralapi.models import Event, Grade, Stage, Trainee, User
+from uralapi.seeding import CohortGenerator
+from uralapi.urls import urlpatterns
+
+PASSWORD = 'benchmark'
+
+
+def _avatar():
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), 'red').save(buffer, 'PNG')
+    return encode_multipart(BOUNDARY, {'image': ContentFile(buffer.getvalue(), name='avatar.png')})
+
+
+# новые адреса для каждого запроса к user/bulk
+_bulk_emails = count()
+
+# сценарий замера для каждого маршрута uralapi/urls.py: метод, роль пользователя и параметры запроса,
+# которые строятся по созданным данным (словарь data из _seed). Тело json, заданное функцией,
+# строится заново для каждого запроса
+SCENARIOS = {
+    'stages/<int:pk>': ('get', 'trainee', lambda data: {'kwargs': {'pk': data['event'].pk}}),
+    'grade/description': ('get', 'trainee', lambda data: {}),
+    'grade/get/to': ('get', 'trainee', lambda data: {}),
+    'grade/get/from': ('get', 'trainee', lambda data: {}),
+    'grade/get/report': ('get', 'trainee', lambda data: {}),
+    'grade/report/bulk': ('get', 'curator', lambda data: {}),
+    'grade/pivot': ('get', 'curator', lambda data: {}),
+    'grade/create-update': ('post', 'trainee', lambda data: {'json': {'grade': {
+        'trainee': data['teammate'].pk, 'stage': data['stage'].pk, **{competence: 1 for competence in COMPETENCES}}}}),
+    'grade/create-update/batch': ('post', 'trainee', lambda data: {'json': {'grades': [
+        {'trainee': trainee.pk, 'stage': data['stage'].pk, **{competence: 2 for competence in COMPETENCES}}
+        for trainee in data['team']]}}),
+    'trainee/team': ('get', 'trainee', lambda data: {}),
+    'trainee/image-upload': ('patch', 'trainee', lambda data: {'body': _avatar(), 'content_type': MULTIPART_CONTENT}),
+    'trainee': ('get', 'trainee', lambda data: {}),
+    'sync': ('get', 'trainee', lambda data: {}),
+    '_metrics': ('get', 'admin', lambda data: {}),
+    'user': ('get', 'trainee', lambda data: {}),
+    'user/login': ('post', None, lambda data: {'json': {'user': {'email': data['users']['trainee'].email,
+                                                                 'password': PASSWORD}}}),
+    'user/bulk': ('post', 'admin', lambda data: {'json': lambda: {'users': [
+        {'username': 'Benchmark Bulk', 'email': f'benchmark.bulk{next(_bulk_emails)}@uralintern.local',
+         'system_role': 'TRAINEE', 'password': PASSWORD} for _ in range(10)]}}),
+    'expert/teams': ('get', 'curator', lambda data: {}),
+}
+
+
+def percentile(values, fraction):
+    """Значение по рангу (nearest-rank) из отсортированного списка"""
+    return values[min(max(math.ceil(fraction * len(values)) - 1, 0), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Замер всех маршрутов uralapi/urls.py через тестовый клиент на синтетических данных: ' \
+           'p50/p95 времени ответа и количество запросов к базе. Результат можно сохранить как базовый ' \
+           '(--save-baseline) и сравнивать с ним (--baseline): команда завершится с ошибкой, если время ' \
+           'выросло больше порога или увеличилось количество запросов. ' \
+           'Данные создаются во временной транзакции и откатываются после замера.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=2, help='Количество мероприятий')
+        parser.add_argument('--stages', type=int, default=5, help='Количество этапов мероприятия')
+        parser.add_argument('--trainees', type=int, default=2000, help='Количество стажеров')
+        parser.add_argument('--team-size', type=int, default=8, help='Количество стажеров в команде')
+        parser.add_argument('--experts', type=int, default=5, help='Количество экспертов')
+        parser.add_argument('--grades-per-trainee', type=int, default=50,
+                            help='Количество оценок стажера, не больше (команда + куратор + эксперты) x этапы')
+        parser.add_argument('--repeat', type=int, default=20, help='Количество замеров каждого маршрута')
+        parser.add_argument('--route', nargs='+', help='Замерить только эти маршруты')
+        parser.add_argument('--baseline', help='JSON файл с базовыми результатами для сравнения')
+        parser.add_argument('--save-baseline', help='Сохранить результаты в JSON файл')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Допустимый рост p50 относительно базового, доля')
+        parser.add_argument('--min-delta', type=float, default=2.0,
+                            help='Рост p50 меньше этого значения в мс не считается регрессией')
+
+    def handle(self, *args, **options):
+        routes = [str(pattern.pattern) for pattern in urlpatterns]
+        missing = sorted(set(routes) - set(SCENARIOS))
+        if missing:
+            raise CommandError(f'Нет сценария замера для маршрутов: {", ".join(missing)}')
+        if options['route']:
+            routes = [route for route in routes if route in options['route']]
+        dataset = {key: options[key] for key in ('events', 'stages', 'trainees', 'team_size', 'experts',
+                                                 'grades_per_trainee')}
+        baseline = self._load_baseline(options['baseline'], dataset)
+
+        media_root = tempfile.mkdtemp()
+        try:
+            with rollback(), quiet_middleware(), override_settings(MEDIA_ROOT=media_root):
+                start = time.perf_counter()
+                data = self._seed(**dataset)
+                self.stdout.write(f'Данные созданы за {time.perf_counter() - start:.1f} с: '
+                                  f'{Grade.objects.count()} оценок')
+                results = {route: self._measure(route, data, options['repeat']) for route in routes}
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        failures = self._report(results, baseline, options['threshold'], options['min_delta'])
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w', encoding='utf-8') as file:
+                json.dump({'dataset': dataset, 'routes': results}, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Результаты сохранены в {options['save_baseline']}")
+        if failures:
+            raise CommandError('Регрессии:\n' + '\n'.join(failures))
+
+    def _load_baseline(self, path, dataset):
+        if not path:
+            return None
+        with open(path, encoding='utf-8') as file:
+            baseline = json.load(file)
+        if baseline['dataset'] != dataset:
+            raise CommandError(f"Базовые результаты сняты на других данных: {baseline['dataset']}")
+        return baseline['routes']
+
+    def _measure(self, route, data, repeat):
+        method, role, build = SCENARIOS[route]
+        params = build(data)
+        url = '/api/' + re.sub(r'<(?:\w+:)?(\w+)>', lambda match: str(params['kwargs'][match.group(1)]), route)
+        client = api_client(data['users'][role] if role else None)
+        if 'json' in params:
+            payload = params['json']
+            request = lambda: getattr(client, method)(url, payload() if callable(payload) else payload,
+                                                      content_type='application/json')
+        elif 'body' in params:
+            request = lambda: getattr(client, method)(url, params['body'], content_type=params['content_type'])
+        else:
+            request = lambda: getattr(client, method)(url)
+
+        def run():
+            response = request()
+            if response.streaming:
+                # потоковый ответ формируется при чтении, его время и запросы тоже замеряются
+                b''.join(response.streaming_content)
+            return response
+
+        run()  # прогрев кэшей
+        timings = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = run()
+                timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return {'method': method.upper(), 'status': response.status_code, 'queries': len(context.captured_queries),
+                'p50': round(percentile(timings, 0.5), 2), 'p95': round(percentile(timings, 0.95), 2)}
+
+    def _report(self, results, baseline, threshold, min_delta):
+        """Печатает таблицу результатов и возвращает список регрессий и ошибок"""
+        failures = []
+        self.stdout.write(f"{'route':>28} {'method':>6} {'status':>6} {'queries':>8} {'p50, ms':>9} "
+                          f"{'p95, ms':>9}" + (f" {'base p50':>9} {'change':>7}" if baseline else ''))
+        for route, result in results.items():
+            line = f"{route:>28} {result['method']:>6} {result['status']:>6} {result['queries']:>8} " \
+                   f"{result['p50']:>9.1f} {result['p95']:>9.1f}"
+            if result['status'] >= 400:
+                failures.append(f"{route}: статус ответа {result['status']}")
+            base = baseline.get(route) if baseline else None
+            if base:
+                change = (result['p50'] - base['p50']) / base['p50'] if base['p50'] else 0
+                line += f" {base['p50']:>9.1f} {change:>+7.0%}"
+                if result['queries'] > base['queries']:
+                    failures.append(f"{route}: запросов к базе {result['queries']}, было {base['queries']}")
+                if change > threshold and result['p50'] - base['p50'] > min_delta:
+                    failures.append(f"{route}: p50 {result['p50']:.1f} мс, было {base['p50']:.1f} мс")
+            self.stdout.write(line)
+        return failures
+
+    def _seed(self, events, stages, trainees, team_size, experts, grades_per_trainee):
+        """
+        Создает данные генератором seed_uralintern: команды ровно по team_size стажеров, куратора на каждые
+        две команды и по grades_per_trainee оценок каждому стажеру
+
+        :return: Словарь с объектами, от имени которых выполняются запросы
+        """
+        cohort = CohortGenerator(prefix='benchmark', events=events, stages=stages, trainees=trainees,
+                                 team_size=(team_size, team_size), experts=experts,
+                                 grades_per_trainee=(grades_per_trainee, grades_per_trainee),
+                                 password=PASSWORD).run()
+        team = cohort['teams'][0]
+        members = list(Trainee.objects.filter(pk__in=team['trainees']).select_related('user').order_by('pk'))
+        return {
+            'event': Event.objects.get(pk=team['event']),
+            'stage': Stage.objects.get(pk=cohort['stages'][team['event']][0]),
+            'teammate': members[1],
+            'team': members[1:],
+            'users': {'trainee': members[0].user, 'curator': User.objects.get(pk=team['curator_user']),
+                      'admin': User.objects.get(pk=cohort['admin'])},
+        }
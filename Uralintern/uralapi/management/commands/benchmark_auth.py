@@ -0,0 +1,50 @@
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from uralapi.backends import USER_CLAIMS_KEY
+from uralapi.benchmark import api_client, measure, quiet_middleware, rollback
+from uralapi.models import Event, Grade, Stage, Team, Trainee, User
+
+
+class Command(BaseCommand):
+    help = 'Замер пропускной способности эндпоинтов user и grade/get/to с JWT_STATELESS_AUTH и без него. ' \
+           'Данные создаются во временной транзакции и откатываются после замера.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Количество запросов на каждый замер')
+        parser.add_argument('--grades', type=int, default=20, help='Количество оценок у стажера')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'endpoint':>16} {'stateless':>10} {'queries':>8} {'req/s':>10}")
+        with rollback(), quiet_middleware():
+            trainee = self._seed(options['grades'])
+            for url in ('/api/user', '/api/grade/get/to'):
+                for stateless in (False, True):
+                    with override_settings(JWT_STATELESS_AUTH=stateless):
+                        cache.delete(USER_CLAIMS_KEY.format(trainee.user_id))
+                        client = api_client(trainee.user)
+                        queries = measure(lambda: client.get(url), repeat=2)['queries']
+                        start = time.perf_counter()
+                        for _ in range(options['requests']):
+                            client.get(url)
+                        rate = options['requests'] / (time.perf_counter() - start)
+                    self.stdout.write(f'{url[4:]:>16} {str(stateless):>10} {queries:>8} {rate:>10.0f}')
+
+    def _seed(self, grades_count):
+        password = make_password(None)
+        event = Event.objects.create(event_name='benchmark', date=timezone.localdate(), is_active=True)
+        team = Team.objects.create(team_name='benchmark')
+        stage = Stage.objects.create(stage_name='benchmark', event=event, date=event.date, is_active=True)
+        User.objects.bulk_create([
+            User(username=f'Benchmark User{index}', email=f'benchmark{index}@uralintern.local', password=password)
+            for index in range(grades_count + 1)])
+        users = list(User.objects.filter(email__startswith='benchmark').order_by('pk'))
+        trainee = Trainee.objects.create(user=users[0], team=team, event=event, date_start=event.date)
+        Grade.objects.bulk_create([Grade(user=user, trainee=trainee, team=team, stage=stage, competence1=1)
+                                   for user in users[1:]])
+        return trainee
@@ -0,0 +1,101 @@
+import shutil
+import tempfile
+from io import BytesIO
+
+from PIL import Image
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from uralapi.benchmark import api_client, measure, quiet_middleware, rollback
+from uralapi.models import Event, Team, Trainee, User
+from uralapi.tasks import process_trainee_image
+
+
+class Command(BaseCommand):
+    help = 'Замер загрузки изображения стажера: ответ API, когда обработка выполняется в фоне и в самом запросе, ' \
+           'и объем изображений, которые клиент получает по списку участников команды, до и после обработки. ' \
+           'Данные создаются во временной транзакции, файлы - во временном MEDIA_ROOT.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=10, help='Количество участников команды')
+        parser.add_argument('--repeat', type=int, default=5, help='Количество повторов замера')
+        parser.add_argument('--width', type=int, default=4032, help='Ширина фотографии')
+        parser.add_argument('--height', type=int, default=3024, help='Высота фотографии')
+
+    def handle(self, *args, **options):
+        photo = self._photo(options['width'], options['height'])
+        self.stdout.write(f"Фотография {options['width']}x{options['height']}, {len(photo) / 1024:.0f} KB")
+        media_root = tempfile.mkdtemp()
+        try:
+            with rollback(), quiet_middleware(), override_settings(MEDIA_ROOT=media_root):
+                trainees = self._seed(options['members'])
+                self._upload(trainees[0], photo, options['repeat'])
+                self._listing(trainees, photo)
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+    def _upload(self, trainee, photo, repeat):
+        client = api_client(trainee.user)
+        body = encode_multipart(BOUNDARY, {'image': ContentFile(photo, name='photo.jpg')})
+
+        def upload():
+            client.patch('/api/trainee/image-upload', body, content_type=MULTIPART_CONTENT)
+
+        def upload_and_process():
+            # так загрузка работала бы, если обрабатывать изображение в запросе
+            upload()
+            process_trainee_image(None, trainee_id=trainee.pk)
+
+        self.stdout.write(f"\n{'upload':>16} {'p50, ms':>10} {'min, ms':>10}")
+        for name, func in (('background', upload), ('in request', upload_and_process)):
+            result = measure(func, repeat)
+            self.stdout.write(f"{name:>16} {result['p50']:>10.1f} {result['min']:>10.1f}")
+
+    def _listing(self, trainees, photo):
+        """Объем изображений участников команды, которые загружает клиент по ответу trainee/team"""
+        for trainee in trainees:
+            trainee.image.save('photo.jpg', ContentFile(photo))
+        storage = trainees[0].image.storage
+        rows = [('original', sum(storage.size(trainee.image.name) for trainee in trainees))]
+        for trainee in trainees:
+            process_trainee_image(None, trainee_id=trainee.pk)
+            trainee.refresh_from_db()
+        rows.append(('processed', sum(storage.size(trainee.image.name) for trainee in trainees)))
+        for size in trainees[0].thumbnails:
+            rows.append((size, sum(storage.size(trainee.thumbnails[size]) for trainee in trainees)))
+        response = api_client(trainees[0].user).get('/api/trainee/team')
+
+        self.stdout.write(f"\nСписок участников команды: {len(response.content) / 1024:.1f} KB JSON, "
+                          f"{len(trainees) - 1} участников")
+        self.stdout.write(f"{'image':>16} {'per member, KB':>16} {'per listing, KB':>16}")
+        for name, total in rows:
+            per_member = total / len(trainees)
+            listing = per_member * (len(trainees) - 1)
+            self.stdout.write(f"{name:>16} {per_member / 1024:>16.1f} {listing / 1024:>16.1f}")
+
+    def _photo(self, width, height) -> bytes:
+        """JPEG, похожий на фотографию с телефона: шум не дает сжать его сильнее реального снимка"""
+        noise = Image.effect_noise((width, height), 48)
+        gradient = Image.linear_gradient('L').resize((width, height))
+        image = Image.merge('RGB', (noise, gradient, Image.blend(noise, gradient, 0.5)))
+        exif = Image.Exif()
+        exif[0x0110] = 'Phone camera'
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', quality=92, exif=exif)
+        return buffer.getvalue()
+
+    def _seed(self, size):
+        password = make_password(None)
+        event = Event.objects.create(event_name='benchmark', date=timezone.localdate(), is_active=True)
+        team = Team.objects.create(team_name='benchmark')
+        User.objects.bulk_create([
+            User(username=f'Benchmark User{index}', email=f'benchmark{index}@uralintern.local', password=password)
+            for index in range(size)])
+        users = User.objects.filter(email__startswith='benchmark').order_by('pk')
+        Trainee.objects.bulk_create([Trainee(user=user, team=team, event=event, date_start=event.date)
+                                     for user in users])
+        return list(Trainee.objects.filter(user__in=users).select_related('user').order_by('pk'))
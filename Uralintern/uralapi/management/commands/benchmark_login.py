@@ -0,0 +1,56 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from uralapi.benchmark import api_client, quiet_middleware
+from uralapi.models import User
+
+EMAIL_TEMPLATE = 'benchmark-login{}@uralintern.local'
+PASSWORD = 'benchmark-password'
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест авторизации (user/login): количество входов в секунду при разном числе потоков. ' \
+           'Создает временных пользователей в базе и удаляет их после замера.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Количество потоков')
+        parser.add_argument('--logins', type=int, default=200, help='Количество входов на каждый замер')
+        parser.add_argument('--users', type=int, default=50, help='Количество пользователей')
+        parser.add_argument('--iterations', type=int, default=None,
+                            help='Количество итераций PBKDF2 (по умолчанию PASSWORD_HASH_ITERATIONS)')
+
+    def handle(self, *args, **options):
+        overrides = {}
+        if options['iterations']:
+            overrides['PASSWORD_HASH_ITERATIONS'] = options['iterations']
+
+        with quiet_middleware(), override_settings(**overrides):
+            emails = [EMAIL_TEMPLATE.format(index) for index in range(options['users'])]
+            password = make_password(PASSWORD)
+            User.objects.bulk_create([User(username=f'Benchmark User{index}', email=email, password=password)
+                                      for index, email in enumerate(emails)])
+            try:
+                self.stdout.write(f"{'workers':>8} {'logins':>8} {'errors':>8} {'logins/s':>10}")
+                for workers in options['workers']:
+                    logins = [emails[index % len(emails)] for index in range(options['logins'])]
+                    start = time.perf_counter()
+                    with ThreadPoolExecutor(max_workers=workers) as executor:
+                        statuses = list(executor.map(self._login, logins))
+                    rate = len(logins) / (time.perf_counter() - start)
+                    errors = sum(1 for code in statuses if code != 200)
+                    self.stdout.write(f'{workers:>8} {len(logins):>8} {errors:>8} {rate:>10.1f}')
+            finally:
+                User.objects.filter(email__in=emails).delete()
+
+    def _login(self, email):
+        try:
+            response = api_client().post('/api/user/login', {'user': {'email': email, 'password': PASSWORD}},
+                                         content_type='application/json')
+            return response.status_code
+        finally:
+            connection.close()
@@ -0,0 +1,40 @@
+import time
+
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+
+from uralapi.mailing import MailDispatcher
+
+
+class Command(BaseCommand):
+    help = 'Замер скорости рассылки (писем в секунду) через MailDispatcher. По умолчанию письма ' \
+           'отправляются в locmem backend, с --port - на локальный SMTP сервер, например ' \
+           '"python -m aiosmtpd -n -l localhost:8025".'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000, help='Количество писем на каждый замер')
+        parser.add_argument('--connections', type=int, nargs='+', default=[1, 2, 4], help='Количество соединений')
+        parser.add_argument('--rate', type=float, default=None, help='Ограничение писем в секунду (по умолчанию без ограничения)')
+        parser.add_argument('--host', default='localhost', help='Адрес SMTP сервера')
+        parser.add_argument('--port', type=int, default=None, help='Порт SMTP сервера')
+
+    def handle(self, *args, **options):
+        if options['port']:
+            def factory():
+                return get_connection('django.core.mail.backends.smtp.EmailBackend', host=options['host'],
+                                      port=options['port'], username='', password='', use_tls=False, use_ssl=False)
+        else:
+            def factory():
+                return get_connection('django.core.mail.backends.locmem.EmailBackend')
+
+        self.stdout.write(f"{'connections':>12} {'messages':>9} {'failed':>7} {'msg/s':>10}")
+        for connections in options['connections']:
+            dispatcher = MailDispatcher(connections=connections, rate=options['rate'] or 0, max_attempts=1,
+                                        connection_factory=factory)
+            messages = ((index, EmailMessage('Benchmark', 'Benchmark message', 'benchmark@uralintern.local',
+                                             [f'benchmark{index}@uralintern.local']))
+                        for index in range(options['messages']))
+            start = time.perf_counter()
+            failed = sum(1 for _, sent, _, _ in dispatcher.send(messages) if not sent)
+            rate = options['messages'] / (time.perf_counter() - start)
+            self.stdout.write(f"{connections:>12} {options['messages']:>9} {failed:>7} {rate:>10.0f}")
@@ -0,0 +1,82 @@
+import math
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from uralapi.benchmark import measure, rollback
+from uralapi.functions import get_report
+from uralapi.models import Event, Grade, Stage, Team, Trainee, User
+
+
+def _legacy_rating(grades):
+    """Прежний подсчет отчета: выборка всех оценок и усреднение в Python"""
+    rating_list = [[], [], [], []]
+    average = lambda grades: round(sum(grades) / len(grades), 2) if len(grades) > 0 else 0
+    for grade in grades:
+        rating_list[0].append(grade.competence1 if grade.competence1 != None else 0)
+        rating_list[1].append(grade.competence2 if grade.competence2 != None else 0)
+        rating_list[2].append(grade.competence3 if grade.competence3 != None else 0)
+        rating_list[3].append(grade.competence4 if grade.competence4 != None else 0)
+    return [average(values) for values in rating_list]
+
+
+def _legacy_report(trainee):
+    grades_query = Grade.objects.select_related('user').filter(trainee=trainee)
+    return [_legacy_rating(list(grades_query)),
+            _legacy_rating(grades_query.filter(user=trainee.user)),
+            _legacy_rating(grades_query.filter(team=trainee.team)),
+            _legacy_rating(grades_query.exclude(user__system_role="TRAINEE"))]
+
+
+class Command(BaseCommand):
+    help = 'Замер времени и количества запросов при формировании отчета (grade/get/report). ' \
+           'Данные создаются во временной транзакции и откатываются после замера.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grades', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                            help='Количество оценок стажера для замеров')
+        parser.add_argument('--stages', type=int, default=10, help='Количество этапов')
+        parser.add_argument('--repeat', type=int, default=5, help='Количество повторов замера')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'grades':>10} {'engine':>8} {'queries':>8} {'p50, ms':>10} {'min, ms':>10}")
+        for size in options['grades']:
+            with rollback():
+                trainee = self._seed(size, options['stages'])
+                for name, func in (('legacy', lambda: _legacy_report(trainee)),
+                                   ('sql', lambda: get_report(trainee, Grade.objects.all()))):
+                    result = measure(func, options['repeat'])
+                    self.stdout.write(f"{size:>10} {name:>8} {result['queries']:>8} "
+                                      f"{result['p50']:>10.1f} {result['min']:>10.1f}")
+
+    def _seed(self, size, stages_count):
+        """Создает стажера и size оценок для него от разных пользователей по stages_count этапам"""
+        password = make_password(None)
+        event = Event.objects.create(event_name='benchmark', date=timezone.localdate(), is_active=True)
+        team = Team.objects.create(team_name='benchmark')
+        Stage.objects.bulk_create([
+            Stage(stage_name=f'benchmark {index}', event=event, date=event.date, is_active=True)
+            for index in range(stages_count)])
+        stages = list(Stage.objects.filter(event=event))
+
+        graders_count = math.ceil(size / stages_count)
+        roles = ('TRAINEE', 'TRAINEE', 'CURATOR', 'EXPERT')
+        User.objects.bulk_create([
+            User(username=f'Benchmark User{index}', email=f'benchmark{index}@uralintern.local',
+                 password=password, system_role=roles[index % len(roles)])
+            for index in range(graders_count + 1)], batch_size=5000)
+        users = list(User.objects.filter(email__startswith='benchmark').order_by('pk'))
+
+        trainee = Trainee.objects.create(user=users[0], team=team, event=event, date_start=event.date)
+        grades = []
+        for index in range(size):
+            grader = users[index // stages_count]
+            grades.append(Grade(user=grader, trainee=trainee, team=team, stage=stages[index % stages_count],
+                                competence1=index % 4 - 1, competence2=None if index % 7 == 0 else 1,
+                                competence3=index % 3 - 1, competence4=2))
+            if len(grades) == 10_000:
+                Grade.objects.bulk_create(grades)
+                grades = []
+        Grade.objects.bulk_create(grades)
+        return Trainee.objects.select_related('user', 'team').get(pk=trainee.pk)
@@ -0,0 +1,77 @@
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from uralapi.benchmark import measure, rollback
+from uralapi.functions import index_stages
+from uralapi.models import Event, Grade, Stage, Team, Trainee, User
+from uralapi.serializers import ListGradeSerializer, TeamMemberValuesSerializer, TraineeTeamSerializer
+
+
+def legacy_team_members(trainees, stages_index):
+    """Прежняя сериализация участников команды: вложенные сериализаторы DRF и пересборка словаря"""
+    data = []
+    for trainee in TraineeTeamSerializer(trainees.select_related('user', 'team', 'event'), many=True).data:
+        data.append({
+            'id': trainee['id'],
+            'username': trainee['user']['username'],
+            'team_name': trainee['team']['team_name'] if trainee['team'] else None,
+            'internship': trainee['internship'],
+            'image': trainee['image'],
+            'thumbnails': trainee['thumbnails'],
+            'social_url': trainee['user']['social_url'],
+            'event': trainee['event']['id'] if trainee['event'] else None,
+            'stages': stages_index.get(trainee['event']['id'], []) if trainee['event'] else [],
+        })
+    return data
+
+
+class Command(BaseCommand):
+    help = 'Замер сериализации участников команд (trainee/team, expert/teams) и списка оценок: ' \
+           'сериализаторы DRF против сборки ответа из values_list. ' \
+           'Данные создаются во временной транзакции и откатываются после замера.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trainees', type=int, default=5000, help='Количество стажеров')
+        parser.add_argument('--repeat', type=int, default=5, help='Количество повторов замера')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'data':>8} {'engine':>8} {'queries':>8} {'p50, ms':>10} {'min, ms':>10}")
+        with rollback():
+            self._seed(options['trainees'])
+            # QuerySet создается заново на каждый замер, чтобы не использовать кэш результатов
+            trainees = Trainee.objects.all
+            grades = Grade.objects.all
+            fields = ListGradeSerializer.Meta.fields
+            stages_index = index_stages(Stage.objects.filter(is_active=True))
+            cases = (
+                ('team', 'drf', lambda: legacy_team_members(trainees(), stages_index)),
+                ('team', 'values', lambda: TeamMemberValuesSerializer(trainees(), stages_index).data),
+                ('grades', 'drf', lambda: ListGradeSerializer(grades(), many=True).data),
+                ('grades', 'values', lambda: [dict(zip(fields, row)) for row in grades().values_list(*fields)]),
+            )
+            for data, engine, func in cases:
+                result = measure(func, options['repeat'])
+                self.stdout.write(f"{data:>8} {engine:>8} {result['queries']:>8} "
+                                  f"{result['p50']:>10.1f} {result['min']:>10.1f}")
+
+    def _seed(self, size):
+        """Создает size стажеров в командах по 10 человек и по одной оценке на каждого"""
+        password = make_password(None)
+        event = Event.objects.create(event_name='benchmark', date=timezone.localdate(), is_active=True)
+        stage = Stage.objects.create(stage_name='benchmark', event=event, date=event.date, is_active=True)
+        Team.objects.bulk_create([Team(team_name=f'benchmark {index}') for index in range(size // 10 + 1)])
+        teams = list(Team.objects.filter(team_name__startswith='benchmark'))
+        User.objects.bulk_create([
+            User(username=f'Benchmark User{index}', email=f'benchmark{index}@uralintern.local', password=password,
+                 social_url='https://example.com')
+            for index in range(size)], batch_size=5000)
+        users = list(User.objects.filter(email__startswith='benchmark').order_by('pk'))
+        Trainee.objects.bulk_create([
+            Trainee(user=user, team=teams[index // 10], event=event, date_start=event.date, internship='backend',
+                    image='images/benchmark.png' if index % 2 else '')
+            for index, user in enumerate(users)], batch_size=5000)
+        trainees = list(Trainee.objects.filter(user__in=users).order_by('pk'))
+        Grade.objects.bulk_create([Grade(user=users[index - 1], trainee=trainee, team=trainee.team, stage=stage,
+                                         competence1=1)
+                                   for index, trainee in enumerate(trainees)], batch_size=5000)
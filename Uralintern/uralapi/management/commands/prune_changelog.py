@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from uralapi.models import ChangeLog
+
+
+class Command(BaseCommand):
+    help = 'Удаляет старые записи журнала изменений, по которому синхронизируется мобильный клиент'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.SYNC_CHANGELOG_RETENTION_DAYS,
+                            help='Сколько дней хранить записи журнала')
+
+    def handle(self, *args, **options):
+        border = timezone.now() - timedelta(days=options['days'])
+        deleted, _ = ChangeLog.objects.filter(created_at__lt=border).delete()
+        self.stdout.write(f'Удалено записей журнала: {deleted}')
@@ -0,0 +1,89 @@
+from itertools import groupby
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from uralapi.functions import COMPETENCES
+from uralapi.models import Grade, TraineeRatingSummary
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает сводные таблицы оценок стажеров по таблице оценок и исправляет расхождения. ' \
+           'Оценки и сводки читаются потоково, за один проход, в порядке id стажера.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только проверить сводки, ничего не изменяя')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Размер порции чтения из базы')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        mismatched = 0
+        checked = 0
+        # исправления применяются после прохода, чтобы не менять таблицу сводок под открытым курсором
+        self.fixes = {}
+        with transaction.atomic():
+            actual = self._actual(chunk_size)
+            current = next(actual, None)
+            for trainee_id, expected in self._expected(chunk_size):
+                # сводки стажеров, у которых оценок больше нет
+                while current is not None and current[0] < trainee_id:
+                    mismatched += self._fix(current[0], {}, current[1], options['check'])
+                    current = next(actual, None)
+                rows = {}
+                if current is not None and current[0] == trainee_id:
+                    rows = current[1]
+                    current = next(actual, None)
+                mismatched += self._fix(trainee_id, expected, rows, options['check'])
+                checked += 1
+            while current is not None:
+                mismatched += self._fix(current[0], {}, current[1], options['check'])
+                current = next(actual, None)
+
+            if not options['check']:
+                self._apply_fixes()
+
+        self.stdout.write(f'Проверено стажеров: {checked}, расхождений: {mismatched}')
+        if mismatched and options['check']:
+            raise CommandError('Сводные таблицы оценок не совпадают с оценками')
+
+    def _expected(self, chunk_size):
+        """Суммы, посчитанные по оценкам: (id стажера, {(этап, группа, команда): [count, sum1..sum4]})"""
+        grades = Grade.objects.order_by('trainee_id').values_list(
+            'trainee_id', 'trainee__user_id', 'user_id', 'user__system_role', 'stage_id', 'team_id',
+            *COMPETENCES).iterator(chunk_size=chunk_size)
+        for trainee_id, rows in groupby(grades, key=lambda row: row[0]):
+            sums = {}
+            for _, trainee_user_id, grader_id, grader_role, stage_id, team_id, *competences in rows:
+                values = [1] + [value or 0 for value in competences]
+                for bucket, bucket_team_id in TraineeRatingSummary.objects.grade_buckets(
+                        trainee_user_id, grader_id, grader_role, team_id):
+                    current = sums.setdefault((stage_id, bucket, bucket_team_id), [0] * len(values))
+                    for index, value in enumerate(values):
+                        current[index] += value
+            yield trainee_id, sums
+
+    def _actual(self, chunk_size):
+        """Сохраненные сводки: (id стажера, {(этап, группа, команда): [count, sum1..sum4]})"""
+        rows = TraineeRatingSummary.objects.order_by('trainee_id').values_list(
+            'trainee_id', 'stage_id', 'bucket', 'team_id', *TraineeRatingSummary.SUM_FIELDS
+        ).iterator(chunk_size=chunk_size)
+        for trainee_id, group in groupby(rows, key=lambda row: row[0]):
+            yield trainee_id, {(stage_id, bucket, team_id): list(values)
+                               for _, stage_id, bucket, team_id, *values in group}
+
+    def _fix(self, trainee_id, expected, actual, check_only) -> int:
+        if expected == actual:
+            return 0
+        self.stdout.write(f'Стажер {trainee_id}: сводка не совпадает с оценками')
+        if not check_only:
+            self.fixes[trainee_id] = expected
+        return 1
+
+    def _apply_fixes(self):
+        TraineeRatingSummary.objects.filter(trainee_id__in=list(self.fixes)).delete()
+        TraineeRatingSummary.objects.bulk_create([
+            TraineeRatingSummary(trainee_id=trainee_id, stage_id=stage_id, bucket=bucket, team_id=team_id,
+                                 **dict(zip(TraineeRatingSummary.SUM_FIELDS, values)))
+            for trainee_id, expected in self.fixes.items()
+            for (stage_id, bucket, team_id), values in expected.items()], batch_size=5000)
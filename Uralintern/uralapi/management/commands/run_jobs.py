@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from uralapi import tasks  # noqa: F401 регистрирует фоновые задачи
+from uralapi.jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Воркер очереди фоновых задач (рассылки, импорт стажеров)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Выполнить задачи из очереди и завершиться')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Пауза между проверками очереди, в секундах')
+
+    def handle(self, *args, **options):
+        try:
+            run_worker(poll_interval=options['poll_interval'], once=options['once'])
+        except KeyboardInterrupt:
+            pass
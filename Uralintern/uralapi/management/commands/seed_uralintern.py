@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from uralapi.seeding import CohortGenerator
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими данными для нагрузочного тестирования: мероприятия, этапы, команды, ' \
+           'стажеры, кураторы, эксперты и оценки. Записи создаются через bulk_create, хэш пароля вычисляется ' \
+           'один раз, при одинаковых параметрах и --seed данные совпадают.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='seed',
+                            help='Префикс названий и почты: <prefix>.<номер>@uralintern.local')
+        parser.add_argument('--seed', type=int, default=0, help='Seed генератора случайных чисел')
+        parser.add_argument('--events', type=int, default=1, help='Количество мероприятий')
+        parser.add_argument('--stages', type=int, default=5, help='Количество этапов мероприятия')
+        parser.add_argument('--trainees', type=int, default=1000, help='Количество стажеров')
+        parser.add_argument('--team-size', type=int, nargs=2, default=(6, 10), metavar=('MIN', 'MAX'),
+                            help='Диапазон размера команды')
+        parser.add_argument('--team-skew', type=float, default=1.0,
+                            help='Перекос размера команд: 1 - равномерно, больше 1 - больше маленьких команд')
+        parser.add_argument('--teams-per-curator', type=int, default=2, help='Количество команд у куратора')
+        parser.add_argument('--experts', type=int, default=5, help='Количество экспертов')
+        parser.add_argument('--grades-per-trainee', type=int, nargs=2, default=(10, 50), metavar=('MIN', 'MAX'),
+                            help='Диапазон количества оценок, которые получает стажер')
+        parser.add_argument('--grades-skew', type=float, default=1.0,
+                            help='Перекос количества оценок: 1 - равномерно, больше 1 - у большинства мало оценок')
+        parser.add_argument('--password', default='uralintern', help='Пароль всех пользователей')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Размер порции bulk_create')
+        parser.add_argument('--skip-summaries', action='store_true',
+                            help='Не заполнять сводные таблицы оценок (rebuild_rating_summaries)')
+
+    def handle(self, *args, **options):
+        for name in ('team_size', 'grades_per_trainee'):
+            low, high = options[name]
+            if not 0 < low <= high if name == 'team_size' else not 0 <= low <= high:
+                raise CommandError(f"Неверный диапазон --{name.replace('_', '-')}: {low} {high}")
+        generator = CohortGenerator(
+            prefix=options['prefix'], seed=options['seed'], events=options['events'], stages=options['stages'],
+            trainees=options['trainees'], team_size=tuple(options['team_size']), team_skew=options['team_skew'],
+            teams_per_curator=options['teams_per_curator'], experts=options['experts'],
+            grades_per_trainee=tuple(options['grades_per_trainee']), grades_skew=options['grades_skew'],
+            password=options['password'], batch_size=options['batch_size'],
+            rebuild_summaries=not options['skip_summaries'], log=self.stdout.write)
+        if generator.exists():
+            raise CommandError(f"В базе уже есть данные с префиксом {options['prefix']}, укажите другой --prefix")
+        cohort = generator.run()
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано: мероприятий {len(cohort['events'])}, команд {len(cohort['teams'])}, "
+            f"стажеров {sum(len(team['trainees']) for team in cohort['teams'])}, оценок {cohort['grades']}. "
+            f"Администратор {options['prefix']}.0@uralintern.local, пароль {options['password']}"))
@@ -0,0 +1,147 @@
+"""
+Отдача медиа и статических файлов вместо django.views.static.serve.
+
+- Файлы с хэшем содержимого в имени (uralapi/storage.py) кэшируются клиентом без срока, остальные -
+  на MEDIA_SERVING['MAX_AGE'] секунд с проверкой по ETag/Last-Modified.
+- Поддерживаются условные запросы (If-None-Match, If-Modified-Since) и запрос части файла (Range, If-Range).
+- В режиме MEDIA_SERVING['SENDFILE'] приложение отдает только заголовки, а содержимое файла передает
+  фронтенд прокси: X-Sendfile (Apache, lighttpd) или X-Accel-Redirect (nginx). Для nginx адрес запроса
+  передается с префиксом MEDIA_SERVING['ACCEL_PREFIX'], например /protected/media/images/1.jpg, этот префикс
+  настраивается как internal location с alias на MEDIA_ROOT и STATIC_ROOT.
+"""
+import mimetypes
+import posixpath
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from .storage import is_hashed
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def file_etag(stat) -> str:
+    return quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+
+
+def parse_range(header, size):
+    """
+    Разбирает заголовок Range с одним диапазоном
+
+    :param header: Значение заголовка, например bytes=0-1023
+    :param size: Размер файла
+    :return: (начало, конец включительно), None - отдать файл целиком, ValueError - диапазон за пределами файла
+    """
+    match = RANGE.match(header.strip())
+    if match is None or match.groups() == ('', ''):
+        # несколько диапазонов или неизвестные единицы: по RFC 7233 можно отдать весь файл
+        return None
+    start, end = match.groups()
+    if not start:
+        # последние end байт файла
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def _read_range(file, start, length):
+    with file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _sendfile_response(request, fullpath):
+    options = settings.MEDIA_SERVING
+    response = HttpResponse()
+    if options['SENDFILE'] == 'X-Accel-Redirect':
+        response['X-Accel-Redirect'] = options['ACCEL_PREFIX'].rstrip('/') + request.path
+    else:
+        response['X-Sendfile'] = str(fullpath)
+    # тип содержимого задает прокси по расширению файла
+    del response['Content-Type']
+    return response
+
+
+def serve(request, path, document_root=None):
+    """
+    Отдает файл из document_root. Подключается в urls.py так же, как django.views.static.serve
+
+    :param path: Путь к файлу относительно document_root
+    :param document_root: MEDIA_ROOT или STATIC_ROOT
+    """
+    path = posixpath.normpath(path).lstrip('/')
+    fullpath = Path(safe_join(document_root, path))
+    try:
+        stat = fullpath.stat()
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('Файл не найден')
+    if fullpath.is_dir():
+        raise Http404('Файл не найден')
+
+    etag = file_etag(stat)
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        if settings.MEDIA_SERVING['SENDFILE']:
+            # прокси сам обрабатывает Range
+            response = _sendfile_response(request, fullpath)
+        else:
+            response = _file_response(request, fullpath, stat, etag)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    if is_hashed(path):
+        patch_cache_control(response, public=True, max_age=60 * 60 * 24 * 365, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=settings.MEDIA_SERVING['MAX_AGE'])
+    return response
+
+
+def _file_response(request, fullpath, stat, etag):
+    content_type, encoding = mimetypes.guess_type(str(fullpath))
+    content_type = content_type or 'application/octet-stream'
+    byte_range = None
+    if 'HTTP_RANGE' in request.META and _if_range_matches(request, etag, stat):
+        try:
+            byte_range = parse_range(request.META['HTTP_RANGE'], stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+    if byte_range is None:
+        response = FileResponse(fullpath.open('rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(_read_range(fullpath.open('rb'), start, length), status=206,
+                                         content_type=content_type)
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    response['Accept-Ranges'] = 'bytes'
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
+
+
+def _if_range_matches(request, etag, stat) -> bool:
+    """If-Range: часть файла отдается, только если файл не изменился, иначе отдается целиком"""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    modified = parse_http_date_safe(if_range)
+    return modified is not None and int(stat.st_mtime) <= modified
@@ -0,0 +1,205 @@
+"""
+Метрики запросов к API: количество SQL запросов, время SQL, сериализации и рендеринга по представлениям.
+
+MetricsMiddleware собирает метрики каждого запроса и складывает их в кольцевой буфер процесса
+(последние API_METRICS['BUFFER_SIZE'] запросов). Представление api/_metrics отдает по буферу квантили
+и суммы в текстовом формате Prometheus, накопительные счетчики считаются с запуска процесса.
+
+Представление может объявить бюджет запросов к базе атрибутом query_budget. Превышение бюджета
+пишется в лог и в счетчик uralapi_query_budget_exceeded_total, а при API_METRICS['ENFORCE_BUDGETS']
+(включает uralapi.testing.TestRunner) вызывает QueryBudgetExceeded, и тест падает.
+
+Время сериализации и рендеринга замеряют сами представления и рендереры блоком timer().
+"""
+import logging
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# поля замера, которые отдаются как summary
+SUMMARIES = (
+    ('duration', 'Время обработки запроса, секунды'),
+    ('queries', 'Количество SQL запросов'),
+    ('sql', 'Время выполнения SQL запросов, секунды'),
+    ('serializer', 'Время сериализации ответа, секунды'),
+    ('render', 'Время рендеринга ответа, секунды'),
+)
+QUANTILES = (0.5, 0.95, 0.99)
+
+_current = ContextVar('uralapi_metrics_sample', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Представление выполнило больше запросов к базе, чем объявлено в query_budget"""
+
+
+class Sample:
+    """Метрики одного запроса"""
+    __slots__ = ('view', 'method', 'status', 'duration', 'queries', 'sql', 'serializer', 'render', '_timers')
+
+    def __init__(self, method):
+        self.view = ''
+        self.method = method
+        self.status = 0
+        self.duration = self.sql = self.serializer = self.render = 0.0
+        self.queries = 0
+        self._timers = set()
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql += time.perf_counter() - start
+
+
+@contextmanager
+def timer(name):
+    """
+    Добавляет время выполнения блока к метрике текущего запроса. Вложенные замеры одной метрики
+    (например, сериализатор внутри сериализатора) не суммируются
+
+    :param name: serializer или render
+    """
+    sample = _current.get()
+    if sample is None or name in sample._timers:
+        yield
+        return
+    sample._timers.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(sample, name, getattr(sample, name) + time.perf_counter() - start)
+        sample._timers.discard(name)
+
+
+class MetricsRegistry:
+    """Кольцевой буфер последних запросов и накопительные счетчики по представлениям"""
+
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+        self.totals = defaultdict(lambda: {'requests': 0, 'queries': 0, 'budget_exceeded': 0})
+        self.lock = threading.Lock()
+
+    def add(self, sample, budget_exceeded=False):
+        with self.lock:
+            self.samples.append(sample)
+            totals = self.totals[(sample.view, sample.method)]
+            totals['requests'] += 1
+            totals['queries'] += sample.queries
+            totals['budget_exceeded'] += budget_exceeded
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+            self.totals.clear()
+
+    def prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        with self.lock:
+            samples = list(self.samples)
+            totals = {key: dict(value) for key, value in self.totals.items()}
+        groups = defaultdict(list)
+        for sample in samples:
+            groups[(sample.view, sample.method)].append(sample)
+
+        lines = []
+        for name, help_text in (('requests', 'Количество запросов с запуска процесса'),
+                                ('queries', 'Количество SQL запросов с запуска процесса'),
+                                ('query_budget_exceeded', 'Количество запросов с превышением query_budget')):
+            lines += [f'# HELP uralapi_{name}_total {help_text}', f'# TYPE uralapi_{name}_total counter']
+            key = 'budget_exceeded' if name == 'query_budget_exceeded' else name
+            for (view, method), values in sorted(totals.items()):
+                lines.append(f'uralapi_{name}_total{_labels(view, method)} {values[key]}')
+
+        for field, help_text in SUMMARIES:
+            metric = f'uralapi_request_{field}'
+            lines += [f'# HELP {metric} {help_text}, последние {self.samples.maxlen} запросов',
+                      f'# TYPE {metric} summary']
+            for (view, method), group in sorted(groups.items()):
+                values = sorted(getattr(sample, field) for sample in group)
+                for quantile in QUANTILES:
+                    value = values[min(int(quantile * len(values)), len(values) - 1)]
+                    lines.append(f'{metric}{_labels(view, method, quantile=quantile)} {_number(value)}')
+                lines.append(f'{metric}_sum{_labels(view, method)} {_number(sum(values))}')
+                lines.append(f'{metric}_count{_labels(view, method)} {len(values)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(view, method, **extra) -> str:
+    labels = {'view': view, 'method': method, **extra}
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value) -> str:
+    return repr(round(value, 6)) if isinstance(value, float) else str(value)
+
+
+registry = MetricsRegistry(settings.API_METRICS['BUFFER_SIZE'])
+
+
+def view_name(request) -> str:
+    """Имя класса представления или путь к функции представления"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return ''
+    view_class = getattr(match.func, 'view_class', None) or getattr(match.func, 'cls', None)
+    return view_class.__name__ if view_class is not None else match._func_path
+
+
+def query_budget(request):
+    match = getattr(request, 'resolver_match', None)
+    view_class = getattr(match.func, 'view_class', None) if match is not None else None
+    return getattr(view_class, 'query_budget', None)
+
+
+class MetricsMiddleware:
+    """Собирает метрики запросов в registry, см. описание модуля"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.ignore = [re.compile(pattern) for pattern in settings.API_METRICS['IGNORE_REQUEST_PATTERNS']]
+
+    def __call__(self, request):
+        if any(pattern.search(request.path) for pattern in self.ignore):
+            return self.get_response(request)
+        sample = Sample(request.method)
+        token = _current.set(sample)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(sample.execute_wrapper))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        sample.duration = time.perf_counter() - start
+        sample.view = view_name(request)
+        sample.status = response.status_code
+        budget = query_budget(request)
+        exceeded = budget is not None and sample.queries > budget
+        registry.add(sample, budget_exceeded=exceeded)
+        if settings.API_METRICS['RESPONSE_HEADER']:
+            response[settings.API_METRICS['RESPONSE_HEADER']] = str(sample.queries)
+        if exceeded:
+            message = f'{sample.view}: {sample.queries} запросов к базе, бюджет {budget} ({request.method} ' \
+                      f'{request.get_full_path()})'
+            if settings.API_METRICS['ENFORCE_BUDGETS']:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
@@ -1,16 +1,34 @@
 import os
 
 import jwt
+from contextvars import ContextVar
 from datetime import datetime, timedelta
 from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.core.validators import MaxValueValidator, MinValueValidator, FileExtensionValidator
-from django.db import models
-from django.db.models.signals import post_save, post_delete
+from django.db import models, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, pre_delete
 from django.dispatch import receiver
+from django.utils import timezone
 from django.core.exceptions import ValidationError
-from .functions import upload_to
+from . import cache as reference_cache
+from .functions import COMPETENCES, upload_to
+from .images import delete_thumbnails
+from .storage import HashedFileSystemStorage
+
+
+# роль входит в ключ: после смены роли выдается новый токен, иначе его отклонит _authenticate_claims
+TOKEN_CACHE_KEY = 'uralapi:auth:token:{}:{}'
+
+# включается при массовом удалении пользователей (uralapi/deletion.py): обработчики удаления отдельных записей,
+# которые выполняют запросы к базе, ничего не делают, их работу delete_users выполняет для всего набора сразу
+bulk_deletion = ContextVar('uralapi_bulk_deletion', default=False)
+
+# оценки, для которых пришел pre_delete, но сводные таблицы еще не пересчитаны, см. remove_grade_from_summary
+deleted_grades = ContextVar('uralapi_deleted_grades', default=None)
 
 
 class UserManager(BaseUserManager):
@@ -71,11 +89,28 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.username
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'system_role' in field_names:
+            instance._saved_role = values[field_names.index('system_role')]
+        return instance
+
     def save(self, *args, **kwargs):
         if self.system_role == 'ADMIN':
             self.is_staff = True
             self.is_superuser = True
-        super(User, self).save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        previous_role = getattr(self, '_saved_role', None)
+        if previous_role in (None, self.system_role) or (update_fields is not None and 'system_role' not in update_fields):
+            super(User, self).save(*args, **kwargs)
+        else:
+            # оценки пользователя переходят в группу expert или выходят из нее вместе со сменой роли
+            with transaction.atomic():
+                super(User, self).save(*args, **kwargs)
+                TraineeRatingSummary.objects.change_grader_role(self.pk, previous_role, self.system_role)
+        if update_fields is None or 'system_role' in update_fields:
+            self._saved_role = self.system_role
 
     def set_password(self, raw_password):
         self.password = make_password(raw_password)
@@ -84,7 +119,20 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     @property
     def token(self):
-        return self._generate_jwt_token()
+        """JWT пользователя. Выданный токен переиспользуется, пока до его истечения не останется
+        меньше JWT_TOKEN_REFRESH_MARGIN"""
+        if self.pk is None:
+            return self._generate_jwt_token()
+        token = getattr(self, '_token', None)
+        if token is None:
+            key = TOKEN_CACHE_KEY.format(self.pk, self.system_role)
+            token = cache.get(key)
+            if token is None:
+                token = self._generate_jwt_token()
+                timeout = (settings.JWT_TOKEN_LIFETIME - settings.JWT_TOKEN_REFRESH_MARGIN).total_seconds()
+                cache.set(key, token, max(timeout, 0))
+            self._token = token
+        return token
 
     def get_full_name(self):
         return self.username
@@ -93,10 +141,11 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.username
 
     def _generate_jwt_token(self) -> str:
-        dt = datetime.now() + timedelta(days=30) # время жизни токена
+        dt = datetime.now() + settings.JWT_TOKEN_LIFETIME # время жизни токена
 
         token = jwt.encode({
             'id': self.pk,
+            'role': self.system_role,
             'exp': dt.utcfromtimestamp(dt.timestamp())
         }, settings.SECRET_KEY, algorithm='HS256')
 
@@ -116,10 +165,14 @@ class Trainee(models.Model):
     speciality = models.CharField(max_length=150, blank=True, verbose_name="Специальность")
     institution = models.CharField(max_length=150, blank=True, verbose_name="Учебное заведение")
     team = models.ForeignKey('Team', on_delete=models.SET_NULL, blank=True, null=True, verbose_name="Команда")
-    image = models.ImageField(upload_to=upload_to, blank=True, null=True,
+    # имя файла содержит хэш содержимого, такие файлы кэшируются клиентом без срока (uralapi/media.py)
+    image = models.ImageField(upload_to=upload_to, storage=HashedFileSystemStorage(), blank=True, null=True,
                               validators=[FileExtensionValidator(['png', 'jpg', 'jpeg'])])
+    # миниатюры изображения {размер: имя файла}, создаются фоновой задачей (uralapi/images.py)
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False, verbose_name="Миниатюры")
     event = models.ForeignKey('Event', on_delete=models.SET_NULL, blank=True, null=True, verbose_name="Мероприятие")
     date_start = models.DateField(auto_created=True, verbose_name="Дата старта")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата изменения")
 
     def __str__(self):
         return self.user.__str__()
@@ -164,6 +217,7 @@ class Expert(models.Model):
 class Team(models.Model):
     team_name = models.CharField(max_length=90, verbose_name="Название команды", unique=True)
     curator = models.ForeignKey('Curator', blank=True, null=True, on_delete=models.SET_NULL, verbose_name="Куратор")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата изменения")
 
     def __str__(self):
         return self.team_name
@@ -208,7 +262,11 @@ class Event(models.Model):
         super(Event, self).save(*args, **kwargs)
         # Закроет все этапы, которые относятся к этому мероприятию
         if not self.is_active:
-            Stage.objects.filter(event=self.pk).update(is_active=False)
+            stages = list(Stage.objects.filter(event=self.pk, is_active=True).values_list('pk', flat=True))
+            Stage.objects.filter(pk__in=stages).update(is_active=False)
+            # update не отправляет сигналы этапов, поэтому кэш справочников и журнал изменений обновляются явно
+            reference_cache.invalidate()
+            ChangeLog.objects.record(Stage, stages)
 
 class Grade(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name="Имя оценщика")
@@ -225,14 +283,20 @@ class Grade(models.Model):
     competence4 = models.SmallIntegerField(blank=True, null=True, verbose_name="Командность",
                                            validators=[MinValueValidator(-1), MaxValueValidator(2)])
     date = models.DateTimeField(auto_created=True, auto_now_add=True, verbose_name="Дата оценки")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата изменения")
 
     class Meta:
         verbose_name = "Оценка"
         verbose_name_plural = "Оценки"
         unique_together = ("user", "trainee", "stage")
+        # постраничный вывод оценок стажера по ключу (date, id), см. views.BaseGradeListAPIView
+        indexes = [
+            models.Index(fields=['trainee', 'date', 'id'], name='grade_trainee_date_idx'),
+            models.Index(fields=['user', 'date', 'id'], name='grade_user_date_idx'),
+        ]
 
     def save(self, *args, **kwargs):
-        self.team = self.trainee.team
+        self.team_id = self.trainee.team_id
         super(Grade, self).save(*args, **kwargs)
 
 
@@ -245,23 +309,375 @@ class GradeDescription(models.Model):
         verbose_name_plural = "Описания оценки"
 
 
-@receiver(post_save, sender=User)
-def create_profiles(sender, instance: User, created, **kwargs):
-    """Обработчик сигнала. При создании пользователя создает запись о
-    нем в таблице Trainee или Curator(в зависимости от выбранной роли пользователя)"""
-    if created:
-        role = instance.system_role
-        if role == "CURATOR":
-            Curator.objects.create(user=instance)
-        elif role == "TRAINEE":
-            Trainee.objects.create(user=instance, date_start=datetime.now())
+class BackgroundJob(models.Model):
+    """Задача для фонового выполнения (uralapi/jobs.py), запускается командой manage.py run_jobs"""
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка')
+    )
+
+    name = models.CharField(max_length=100, verbose_name="Задача")
+    payload = models.JSONField(default=dict, blank=True, verbose_name="Параметры")
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING, db_index=True, verbose_name="Статус")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Попыток")
+    max_attempts = models.PositiveSmallIntegerField(default=3, verbose_name="Максимум попыток")
+    progress_done = models.PositiveIntegerField(default=0, verbose_name="Выполнено")
+    progress_total = models.PositiveIntegerField(blank=True, null=True, verbose_name="Всего")
+    result = models.TextField(blank=True, verbose_name="Результат")
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создана")
+    run_after = models.DateTimeField(default=timezone.now, verbose_name="Запустить после")
+    started_at = models.DateTimeField(blank=True, null=True, verbose_name="Запущена")
+    finished_at = models.DateTimeField(blank=True, null=True, verbose_name="Завершена")
+
+    def __str__(self):
+        return f'{self.name} #{self.pk}'
+
+    def set_progress(self, done, total=None):
+        """Сохраняет прогресс выполнения, не затрагивая остальные поля"""
+        self.progress_done = done
+        fields = {'progress_done': done}
+        if total is not None:
+            self.progress_total = fields['progress_total'] = total
+        BackgroundJob.objects.filter(pk=self.pk).update(**fields)
+
+    class Meta:
+        verbose_name = "Фоновая задача"
+        verbose_name_plural = "Фоновые задачи"
+        ordering = ('-created_at',)
+
+
+class MailDelivery(models.Model):
+    """Журнал доставки писем. Отправленное письмо одного вида повторно пользователю не отправляется."""
+    PENDING = 'PENDING'
+    SENT = 'SENT'
+    FAILED = 'FAILED'
+    STATUSES = (
+        (PENDING, 'Ожидает отправки'),
+        (SENT, 'Отправлено'),
+        (FAILED, 'Ошибка')
+    )
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name="Пользователь")
+    kind = models.CharField(max_length=50, verbose_name="Вид письма")
+    email = models.EmailField(verbose_name="Почта")
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING, verbose_name="Статус")
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Попыток")
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    sent_at = models.DateTimeField(blank=True, null=True, verbose_name="Отправлено")
+
+    def __str__(self):
+        return f'{self.kind}: {self.email}'
+
+    class Meta:
+        verbose_name = "Доставка письма"
+        verbose_name_plural = "Журнал рассылок"
+        unique_together = ("user", "kind")
+
+
+class RatingSummaryManager(models.Manager):
+    @staticmethod
+    def grade_buckets(trainee_user_id, grader_id, grader_role, team_id):
+        """
+        Группы отчета, в которые попадает оценка. Для группы team запоминается команда оценки,
+        принадлежность к текущей команде стажера проверяется при чтении отчета.
+
+        :return: Список пар (группа, команда)
+        """
+        buckets = [('general', None), ('team', team_id)]
+        if grader_id == trainee_user_id:
+            buckets.append(('self', None))
+        if grader_role != 'TRAINEE':
+            buckets.append(('expert', None))
+        return buckets
+
+    @staticmethod
+    def _grade_relations(grades, roles):
+        """
+        Роли оценщиков и пользователи оцениваемых стажеров. Берутся из roles и уже загруженных связей оценок,
+        остальные загружаются одним запросом на модель, а не отдельным запросом на каждую оценку.
+
+        :return: ({id пользователя: роль}, {id стажера: id пользователя})
+        """
+        roles = dict(roles)
+        trainee_users = {}
+        for grade in grades:
+            if grade.user_id not in roles and Grade.user.is_cached(grade):
+                roles[grade.user_id] = grade.user.system_role
+            if Grade.trainee.is_cached(grade):
+                trainee_users[grade.trainee_id] = grade.trainee.user_id
+        missing = {grade.user_id for grade in grades} - roles.keys()
+        if missing:
+            roles.update(User.objects.filter(pk__in=missing).values_list('pk', 'system_role'))
+        missing = {grade.trainee_id for grade in grades} - trainee_users.keys()
+        if missing:
+            trainee_users.update(Trainee.objects.filter(pk__in=missing).values_list('pk', 'user_id'))
+        return roles, trainee_users
+
+    def _grade_deltas(self, grades, sign, deltas, roles, trainee_users):
+        for grade in grades:
+            # стажер или оценщик уже удален, сводки стажера удалены вместе с ним
+            if grade.user_id not in roles or grade.trainee_id not in trainee_users:
+                continue
+            values = [sign] + [sign * (getattr(grade, name) or 0) for name in COMPETENCES]
+            buckets = self.grade_buckets(trainee_users[grade.trainee_id], grade.user_id, roles[grade.user_id],
+                                         grade.team_id)
+            for bucket, team_id in buckets:
+                key = (grade.trainee_id, grade.stage_id, bucket, team_id)
+                current = deltas.setdefault(key, [0] * len(values))
+                for index, value in enumerate(values):
+                    current[index] += value
+
+    def apply(self, added=(), removed=(), roles=None):
+        """
+        Инкрементально обновляет сводные таблицы после изменения оценок.
+        Количество запросов не зависит от количества оценок.
+
+        :param added: Оценки, которые нужно учесть (созданные или новое состояние измененных)
+        :param removed: Оценки, которые нужно вычесть (удаленные или прежнее состояние измененных)
+        :param roles: Известные роли оценщиков {id пользователя: роль}, чтобы не загружать их из базы
+        """
+        added, removed = list(added), list(removed)
+        roles, trainee_users = self._grade_relations(added + removed, roles or {})
+        deltas = {}
+        self._grade_deltas(added, 1, deltas, roles, trainee_users)
+        self._grade_deltas(removed, -1, deltas, roles, trainee_users)
+        self._write(deltas)
+
+    def change_grader_role(self, user_id, previous_role, role):
+        """
+        Пересчитывает сводные таблицы после смены роли оценщика: от роли зависит, попадают ли
+        его оценки в группу expert. Остальные группы не меняются.
+
+        :param user_id: id пользователя, сменившего роль
+        :param previous_role: Прежняя роль
+        :param role: Новая роль
+        """
+        grades = list(Grade.objects.filter(user_id=user_id).select_related('trainee'))
+        _, trainee_users = self._grade_relations(grades, {})
+        deltas = {}
+        self._grade_deltas(grades, -1, deltas, {user_id: previous_role}, trainee_users)
+        self._grade_deltas(grades, 1, deltas, {user_id: role}, trainee_users)
+        self._write(deltas)
+
+    def _write(self, deltas):
+        """Прибавляет к сводным таблицам изменения {(стажер, этап, группа, команда): [count, sum1..sum4]}"""
+        deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+        if not deltas:
+            return
+
+        with transaction.atomic():
+            rows = self.select_for_update().filter(trainee_id__in={key[0] for key in deltas},
+                                                   stage_id__in={key[1] for key in deltas})
+            existing = {(row.trainee_id, row.stage_id, row.bucket, row.team_id): row for row in rows}
+            to_create, to_update, to_delete = [], [], []
+            for key, delta in deltas.items():
+                row = existing.get(key)
+                if row is None:
+                    # вычитать нечего, например запись уже удалена каскадом вместе со стажером
+                    if delta[0] <= 0:
+                        continue
+                    row = TraineeRatingSummary(trainee_id=key[0], stage_id=key[1], bucket=key[2], team_id=key[3])
+                    to_create.append(row)
+                else:
+                    to_update.append(row)
+                for name, value in zip(TraineeRatingSummary.SUM_FIELDS, delta):
+                    setattr(row, name, getattr(row, name) + value)
+                if row.count <= 0 and row.pk:
+                    to_update.remove(row)
+                    to_delete.append(row.pk)
+
+            if to_delete:
+                self.filter(pk__in=to_delete).delete()
+            if to_update:
+                self.bulk_update(to_update, TraineeRatingSummary.SUM_FIELDS)
+            if to_create:
+                self.bulk_create(to_create)
+
+    def report(self, trainee_user_id) -> dict:
+        """
+        Отчет стажера по сводной таблице одним запросом.
+
+        :param trainee_user_id: id пользователя-стажера
+        :return: Словарь со средними оценками по группам general, self, team, expert
+        """
+        totals = {bucket: [0] * len(TraineeRatingSummary.SUM_FIELDS) for bucket, _ in TraineeRatingSummary.BUCKETS}
+        rows = self.filter(trainee__user_id=trainee_user_id).values_list(
+            'bucket', 'team_id', 'trainee__team_id', *TraineeRatingSummary.SUM_FIELDS)
+        for bucket, team_id, trainee_team_id, *values in rows:
+            if bucket == 'team' and team_id != trainee_team_id:
+                continue
+            for index, value in enumerate(values):
+                totals[bucket][index] += value
+        return self.build_report(totals)
+
+    def iter_reports(self, trainees):
+        """
+        Отчеты для набора стажеров. Стажеры и их сводки читаются двумя потоковыми запросами,
+        упорядоченными по id стажера, и объединяются слиянием, поэтому память не зависит от размера выборки.
+
+        :param trainees: QuerySet стажеров
+        :return: Генератор пар (строка стажера из values(), отчет)
+        """
+        rows = trainees.order_by('pk').values('id', 'user__username', 'team_id', 'team__team_name', 'event_id') \
+            .iterator(chunk_size=2000)
+        summaries = self.filter(trainee__in=trainees.values('pk')).order_by('trainee_id').values_list(
+            'trainee_id', 'bucket', 'team_id', *TraineeRatingSummary.SUM_FIELDS).iterator(chunk_size=2000)
+        summary = next(summaries, None)
+        for row in rows:
+            totals = {bucket: [0] * len(TraineeRatingSummary.SUM_FIELDS) for bucket, _ in TraineeRatingSummary.BUCKETS}
+            while summary is not None and summary[0] <= row['id']:
+                trainee_id, bucket, team_id, *values = summary
+                if trainee_id == row['id'] and (bucket != 'team' or team_id == row['team_id']):
+                    for index, value in enumerate(values):
+                        totals[bucket][index] += value
+                summary = next(summaries, None)
+            yield row, self.build_report(totals)
+
+    @staticmethod
+    def build_report(totals) -> dict:
+        """Переводит суммы по группам {группа: [count, sum1..sum4]} в средние оценки"""
+        report = {}
+        for bucket, (count, *sums) in totals.items():
+            report[bucket] = {f'competence{index}': round(value / count, 2) if count else 0
+                              for index, value in enumerate(sums, start=1)}
+        return report
+
+
+class TraineeRatingSummary(models.Model):
+    """Накопленные суммы оценок стажера по этапу и группе отчета. Обновляется при изменении оценок."""
+    BUCKETS = (
+        ('general', 'Общая'),
+        ('self', 'Самооценка'),
+        ('team', 'Команда'),
+        ('expert', 'Эксперты')
+    )
+    SUM_FIELDS = ('count', 'sum1', 'sum2', 'sum3', 'sum4')
+
+    trainee = models.ForeignKey('Trainee', on_delete=models.CASCADE, verbose_name="Стажер")
+    stage = models.ForeignKey('Stage', on_delete=models.CASCADE, verbose_name="Этап")
+    bucket = models.CharField(max_length=10, choices=BUCKETS, verbose_name="Группа")
+    # команда, в которой был стажер на момент оценки, заполняется только для группы team
+    team = models.ForeignKey('Team', on_delete=models.CASCADE, null=True, blank=True, verbose_name="Команда")
+    count = models.PositiveIntegerField(default=0, verbose_name="Количество оценок")
+    sum1 = models.IntegerField(default=0, verbose_name="Вовлеченность")
+    sum2 = models.IntegerField(default=0, verbose_name="Организованность")
+    sum3 = models.IntegerField(default=0, verbose_name="Обучаемость")
+    sum4 = models.IntegerField(default=0, verbose_name="Командность")
+
+    objects = RatingSummaryManager()
+
+    class Meta:
+        verbose_name = "Сводка оценок"
+        verbose_name_plural = "Сводки оценок"
+        # в unique_together строки без команды (general, self, expert) не уникальны: NULL не равен NULL
+        constraints = [
+            models.UniqueConstraint(fields=['trainee', 'stage', 'bucket', 'team'], condition=Q(team__isnull=False),
+                                    name='rating_summary_team_unique'),
+            models.UniqueConstraint(fields=['trainee', 'stage', 'bucket'], condition=Q(team__isnull=True),
+                                    name='rating_summary_unique'),
+        ]
+
+
+class ChangeLogManager(models.Manager):
+    def record(self, model, ids, deleted=False):
+        """
+        Записывает изменение объектов в журнал. Нужен там, где объекты меняются
+        в обход сигналов: bulk_create, bulk_update, update
+
+        :param model: Класс модели
+        :param ids: id измененных или удаленных объектов
+        :param deleted: True, если объекты удалены
+        """
+        name = model._meta.model_name
+        self.bulk_create([ChangeLog(model=name, object_id=pk, deleted=deleted) for pk in ids], batch_size=500)
+
+    def last_token(self):
+        return self.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+    def stable_token(self):
+        """
+        Токен, который выдается клиенту: id последней записи старше SYNC_TOKEN_MARGIN секунд.
+        Запись с меньшим id может быть зафиксирована позже записи с большим, поэтому токен по последней
+        записи пропустил бы ее навсегда. Записи после stable_token клиент получит еще раз при следующем запросе.
+        """
+        border = timezone.now() - timedelta(seconds=settings.SYNC_TOKEN_MARGIN)
+        return self.filter(created_at__lt=border).order_by('-pk').values_list('pk', flat=True).first() or 0
+
+
+class ChangeLog(models.Model):
+    """
+    Журнал изменений стажеров, команд, этапов и оценок для синхронизации мобильного клиента.
+    id записи служит токеном изменений, удаленные объекты остаются в журнале как записи с deleted=True.
+    """
+    model = models.CharField(max_length=30, verbose_name="Модель")
+    object_id = models.PositiveBigIntegerField(verbose_name="id объекта")
+    deleted = models.BooleanField(default=False, verbose_name="Удален")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Дата изменения")
+
+    objects = ChangeLogManager()
+
+    def __str__(self):
+        return f'{self.model} #{self.object_id}'
+
+    class Meta:
+        verbose_name = "Изменение"
+        verbose_name_plural = "Журнал изменений"
 
 
 def delete_parent(sender, instance, **kwargs):
     """Обработчик сигнала. Удаляет родителя при удалении дочерней записи."""
+    if bulk_deletion.get():
+        return
     if instance.user:
         instance.user.delete()
 
 post_delete.connect(delete_parent, sender=Trainee)
 post_delete.connect(delete_parent, sender=Curator)
-post_delete.connect(delete_parent, sender=Expert)
\ No newline at end of file
+post_delete.connect(delete_parent, sender=Expert)
+
+
+@receiver(post_delete, sender=Trainee)
+def delete_trainee_thumbnails(sender, instance: Trainee, **kwargs):
+    """Обработчик сигнала. Удаляет файлы миниатюр удаленного стажера, оригинал удаляет django_cleanup."""
+    if instance.thumbnails:
+        storage = instance.image.storage
+        thumbnails = instance.thumbnails
+        transaction.on_commit(lambda: delete_thumbnails(storage, thumbnails))
+
+
+@receiver(pre_delete, sender=Grade)
+def collect_deleted_grade(sender, instance: Grade, **kwargs):
+    """Обработчик сигнала. Запоминает удаляемую оценку, см. remove_grade_from_summary."""
+    if bulk_deletion.get():
+        return
+    pending = deleted_grades.get()
+    if pending is None:
+        pending = {}
+        deleted_grades.set(pending)
+    pending[instance.pk] = instance
+
+
+@receiver(post_delete, sender=Grade)
+def remove_grade_from_summary(sender, instance: Grade, **kwargs):
+    """
+    Обработчик сигнала. Вычитает удаленные оценки из сводных таблиц стажеров.
+    Django отправляет pre_delete для всех удаляемых записей до удаления, а post_delete - после удаления
+    всех оценок, поэтому первая post_delete вычитает весь набор (например, каскад при удалении этапа
+    или оценщика) одним apply(), остальные ничего не делают.
+    """
+    if bulk_deletion.get():
+        return
+    pending = deleted_grades.get()
+    if not pending or instance.pk not in pending:
+        return
+    deleted_grades.set(None)
+    # оценки, удаление которых откатила транзакция, остались в базе и не вычитаются
+    kept = set(Grade.objects.filter(pk__in=list(pending)).values_list('pk', flat=True))
+    TraineeRatingSummary.objects.apply(removed=[grade for pk, grade in pending.items() if pk not in kept])
\ No newline at end of file
@@ -0,0 +1,69 @@
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework import exceptions
+
+
+class KeysetPagination:
+    """
+    Постраничный вывод по ключу (date, id): следующая страница начинается после последней записи
+    предыдущей, поэтому запрос не использует OFFSET, а новые записи не сдвигают страницы.
+
+    Курсор - base64 от "<дата в ISO>|<id>" последней отданной записи.
+    """
+    default_limit = 100
+    max_limit = 500
+
+    def __init__(self, request):
+        """
+        :param request: Запрос с параметрами ?limit= и ?cursor=
+        """
+        params = request.query_params
+        self.enabled = 'limit' in params or 'cursor' in params
+        self.limit = self._parse_limit(params.get('limit'))
+        self.position = self.decode(params['cursor']) if 'cursor' in params else None
+
+    def _parse_limit(self, value):
+        if value is None:
+            return self.default_limit
+        if not value.isdigit() or int(value) == 0:
+            raise exceptions.ValidationError({'limit': 'Ожидается положительное число'})
+        return min(int(value), self.max_limit)
+
+    @staticmethod
+    def encode(date, pk):
+        return base64.urlsafe_b64encode(f'{date.isoformat()}|{pk}'.encode()).decode()
+
+    @staticmethod
+    def decode(cursor):
+        try:
+            date, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            date = parse_datetime(date)
+            pk = int(pk)
+        except (binascii.Error, UnicodeError, ValueError):
+            date = None
+        if date is None:
+            raise exceptions.ValidationError({'cursor': 'Неверный курсор'})
+        return date, pk
+
+    def paginate(self, queryset):
+        """
+        Упорядочивает записи по (date, id) и, если запрошена страница, обрезает их по курсору и limit
+
+        :param queryset: QuerySet словарей values(), в которые входят date и id
+        :return: (записи страницы, курсор следующей страницы или None)
+        """
+        queryset = queryset.order_by('date', 'id')
+        if not self.enabled:
+            return list(queryset), None
+        if self.position is not None:
+            date, pk = self.position
+            queryset = queryset.filter(Q(date__gt=date) | Q(date=date, id__gt=pk))
+        # одна лишняя запись показывает, есть ли следующая страница
+        page = list(queryset[:self.limit + 1])
+        if len(page) <= self.limit:
+            return page, None
+        page = page[:self.limit]
+        return page, self.encode(page[-1]['date'], page[-1]['id'])
@@ -0,0 +1,151 @@
+import numpy as np
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.functions import Coalesce
+
+from .exports import TableExporter
+from .functions import COMPETENCES, RATING_BUCKETS
+from .models import Grade, Stage, Trainee
+
+
+class GradePivot:
+    """
+    Сводная таблица средних оценок стажер x этап x компетенция с разбивкой на группы
+    general/self/team/expert, как в functions.get_report.
+
+    Оценки загружаются одним запросом в виде столбцов целых чисел: принадлежность оценки к группам
+    вычисляется в базе условиями RATING_BUCKETS, пустая компетенция считается как 0.
+    Средние считаются в NumPy через bincount по номеру пары (стажер, этап), без создания объектов ORM.
+    """
+    chunk_size = 50000
+    buckets = tuple(RATING_BUCKETS)
+
+    def __init__(self, grades=None):
+        """
+        :param grades: QuerySet оценок, по которым строится таблица
+        """
+        self.grades = Grade.objects.all() if grades is None else grades
+        self.trainee_ids = np.empty(0, dtype=np.int64)
+        self.stage_ids = np.empty(0, dtype=np.int64)
+        # количество оценок и средние: [пара (стажер, этап), группа] и [пара, группа, компетенция]
+        self.counts = np.zeros((0, len(self.buckets)), dtype=np.int64)
+        self.averages = np.zeros((0, len(self.buckets), len(COMPETENCES)))
+
+    def _columns(self):
+        """
+        Столбцы оценок одним запросом: trainee_id, stage_id, компетенции, затем по флагу на каждую группу
+        :return: Массив numpy формы (количество оценок, 2 + компетенции + группы)
+        """
+        annotations = {}
+        for competence in COMPETENCES:
+            annotations[f'value_{competence}'] = Coalesce(competence, 0, output_field=IntegerField())
+        for bucket, condition in RATING_BUCKETS.items():
+            if condition is None:
+                annotations[f'in_{bucket}'] = Value(1, output_field=IntegerField())
+            else:
+                annotations[f'in_{bucket}'] = Case(When(condition, then=Value(1)), default=Value(0),
+                                                   output_field=IntegerField())
+        queryset = self.grades.order_by().annotate(**annotations).values_list('trainee_id', 'stage_id',
+                                                                              *annotations)
+        width = 2 + len(annotations)
+        chunks = []
+        chunk = []
+        for row in queryset.iterator(chunk_size=self.chunk_size):
+            chunk.append(row)
+            if len(chunk) == self.chunk_size:
+                chunks.append(np.array(chunk, dtype=np.int64))
+                chunk = []
+        if chunk:
+            chunks.append(np.array(chunk, dtype=np.int64))
+        return np.concatenate(chunks) if chunks else np.empty((0, width), dtype=np.int64)
+
+    def compute(self):
+        columns = self._columns()
+        competences = len(COMPETENCES)
+        values = columns[:, 2:2 + competences]
+        flags = columns[:, 2 + competences:]
+
+        # номер пары (стажер, этап) для каждой оценки, пара кодируется одним числом
+        keys, group = np.unique((columns[:, 0] << 32) | columns[:, 1], return_inverse=True)
+        size = len(keys)
+
+        counts = np.zeros((size, len(self.buckets)), dtype=np.int64)
+        sums = np.zeros((size, len(self.buckets), competences))
+        for bucket in range(len(self.buckets)):
+            mask = flags[:, bucket]
+            counts[:, bucket] = np.bincount(group, weights=mask, minlength=size)
+            for competence in range(competences):
+                sums[:, bucket, competence] = np.bincount(group, weights=values[:, competence] * mask,
+                                                          minlength=size)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            averages = sums / counts[:, :, np.newaxis]
+        self.trainee_ids = keys >> 32
+        self.stage_ids = keys & 0xFFFFFFFF
+        self.counts = counts
+        self.averages = averages
+        return self
+
+    def _names(self):
+        """Имена стажеров, команды и названия этапов, которые есть в таблице"""
+        trainees = {pk: (username, team_name) for pk, username, team_name in
+                    Trainee.objects.filter(pk__in=set(self.trainee_ids.tolist()))
+                    .values_list('id', 'user__username', 'team__team_name').iterator()}
+        stages = dict(Stage.objects.filter(pk__in=set(self.stage_ids.tolist())).values_list('id', 'stage_name'))
+        return trainees, stages
+
+    def records(self):
+        """
+        Строки таблицы для API. Если в группе нет оценок, средние по ней равны None
+        :return: Генератор словарей по парам (стажер, этап)
+        """
+        trainees, stages = self._names()
+        counts = self.counts.tolist()
+        averages = self.averages.tolist()
+        for index, (trainee_id, stage_id) in enumerate(zip(self.trainee_ids.tolist(), self.stage_ids.tolist())):
+            username, team_name = trainees.get(trainee_id, (None, None))
+            record = {
+                'trainee': trainee_id,
+                'username': username,
+                'team_name': team_name,
+                'stage': stage_id,
+                'stage_name': stages.get(stage_id),
+            }
+            for bucket_index, bucket in enumerate(self.buckets):
+                count = counts[index][bucket_index]
+                record[bucket] = {
+                    'count': count,
+                    # округление как в functions.build_report
+                    **{competence: round(value, 2) if count else None
+                       for competence, value in zip(COMPETENCES, averages[index][bucket_index])}
+                }
+            yield record
+
+
+class GradePivotExporter(TableExporter):
+    """Выгрузка сводной таблицы: строка на пару (стажер, этап), колонки группа x компетенция"""
+    name = 'GradePivot'
+    bucket_names = {'general': 'Общая', 'self': 'Самооценка', 'team': 'Команда', 'expert': 'Эксперты'}
+
+    def __init__(self, pivot):
+        """
+        :param pivot: Посчитанная сводная таблица GradePivot
+        """
+        self.pivot = pivot
+
+    @property
+    def headers(self):
+        headers = [Grade._meta.get_field('trainee').verbose_name, Grade._meta.get_field('team').verbose_name,
+                   Grade._meta.get_field('stage').verbose_name]
+        for bucket in self.pivot.buckets:
+            headers.append(f'{self.bucket_names[bucket]}: количество')
+            headers += [f'{self.bucket_names[bucket]}: {Grade._meta.get_field(competence).verbose_name}'
+                        for competence in COMPETENCES]
+        return headers
+
+    def rows(self):
+        for record in self.pivot.records():
+            row = [record['username'], record['team_name'], record['stage_name']]
+            for bucket in self.pivot.buckets:
+                row.append(record[bucket]['count'])
+                row += [record[bucket][competence] for competence in COMPETENCES]
+            yield row
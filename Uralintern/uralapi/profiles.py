@@ -0,0 +1,69 @@
+"""
+Профили пользователей: запись Trainee, Curator или Expert по роли пользователя (User.system_role),
+у администратора профиля нет.
+
+Профили создаются только через bulk_provision: и обработчиком сигнала при создании одного пользователя
+(create_user, панель администратора), и при массовом создании пользователей через bulk_create
+(импорт CSV, api/user/bulk, seed_uralintern), поэтому записи не зависят от способа создания.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ChangeLog, Curator, Expert, Trainee
+
+PROFILE_MODELS = {'TRAINEE': Trainee, 'CURATOR': Curator, 'EXPERT': Expert}
+
+
+def build_profile(user, **fields):
+    """
+    Несохраненный профиль пользователя
+
+    :param user: Пользователь, нужны pk и system_role
+    :param fields: Поля профиля, например команда и мероприятие стажера
+    :return: Trainee, Curator, Expert или None, если у роли нет профиля
+    """
+    model = PROFILE_MODELS.get(user.system_role)
+    if model is None:
+        return None
+    if model is Trainee:
+        fields.setdefault('date_start', timezone.localdate())
+    return model(user_id=user.pk, **fields)
+
+
+def bulk_provision(users, fields=None, batch_size=None) -> dict:
+    """
+    Создает профили пользователей одним INSERT на роль (при batch_size - на каждую порцию)
+
+    :param users: Сохраненные пользователи без профилей, нужны pk и system_role
+    :param fields: Поля профилей {id пользователя: {поле: значение}}
+    :param batch_size: Размер порции bulk_create
+    :return: Созданные профили {модель: [профили]}
+    """
+    fields = fields or {}
+    profiles = defaultdict(list)
+    for user in users:
+        profile = build_profile(user, **fields.get(user.pk, {}))
+        if profile is not None:
+            profiles[type(profile)].append(profile)
+
+    with transaction.atomic():
+        for model, objects in profiles.items():
+            model.objects.bulk_create(objects, batch_size=batch_size)
+        trainees = profiles.get(Trainee)
+        if trainees:
+            # bulk_create не отправляет сигналы, новые стажеры записываются в журнал синхронизации явно.
+            # id созданных записей возвращает только PostgreSQL
+            ids = [trainee.pk for trainee in trainees]
+            if None in ids:
+                ids = Trainee.objects.filter(user_id__in=[trainee.user_id for trainee in trainees]) \
+                    .values_list('pk', flat=True)
+            ChangeLog.objects.record(Trainee, ids)
+    return dict(profiles)
+
+
+def create_profiles(sender, instance, created, **kwargs):
+    """Обработчик сигнала. При создании пользователя создает его профиль по роли"""
+    if created:
+        bulk_provision([instance])
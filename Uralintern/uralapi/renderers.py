@@ -1,9 +1,37 @@
-import json
+try:
+    import orjson
+except ImportError:  # orjson не обязателен, без него используется стандартный json
+    orjson = None
 
 from rest_framework.renderers import JSONRenderer
 
-
-class UserJSONRenderer(JSONRenderer):
+from .metrics import timer
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на orjson. Вывод совпадает с JSONRenderer: типы, которых нет в JSON (даты, Decimal,
+    ленивые строки перевода и т.д.), преобразуются кодировщиком DRF. Если orjson не установлен
+    или запрошен вывод с отступами, рендеринг выполняет стандартный JSONRenderer.
+    Подключается в REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].
+    """
+    # даты передаются кодировщику DRF, чтобы формат совпадал с JSONRenderer (например, 'Z' вместо '+00:00')
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        with timer('render'):
+            if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+                return super().render(data, accepted_media_type, renderer_context)
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+        # как и JSONRenderer, экранируем разделители строк, которые ломают JavaScript
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class UserJSONRenderer(FastJSONRenderer):
     charset = 'utf-8'
 
     def render(self, data, media_type=None, renderer_context=None):
@@ -27,6 +55,6 @@ class UserJSONRenderer(JSONRenderer):
             data['token'] = token.decode('utf-8')
 
         # Наконец, мы можем отобразить наши данные в простанстве имен 'user'.
-        return json.dumps({
+        return super(UserJSONRenderer, self).render({
             'user': data
-        })
\ No newline at end of file
+        })
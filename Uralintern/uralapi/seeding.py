@@ -0,0 +1,185 @@
+"""
+Генератор синтетических данных для нагрузочного тестирования (manage.py seed_uralintern, benchmark_api).
+
+Все записи создаются через bulk_create порциями, без create_user: хэш пароля вычисляется один раз
+и используется для всех пользователей, профили (Trainee, Curator, Expert) создаются через bulk_provision,
+потому что bulk_create не вызывает сигналы. Данные зависят только от параметров и seed генератора случайных чисел.
+"""
+import random
+import time
+from datetime import timedelta
+from io import StringIO
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.db import transaction
+from django.utils import timezone
+
+from .functions import COMPETENCES
+from .models import Curator, Event, Grade, Stage, Team, Trainee, User
+from .profiles import bulk_provision
+
+FIRST_NAMES = ('Иван', 'Мария', 'Алексей', 'Анна', 'Дмитрий', 'Елена', 'Сергей', 'Ольга', 'Никита', 'Дарья')
+LAST_NAMES = ('Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев', 'Козлов', 'Новиков', 'Морозов',
+              'Волков')
+INTERNSHIPS = ('backend', 'frontend', 'analytics', 'design', 'testing', 'management')
+
+
+class CohortGenerator:
+    """
+    Создает мероприятия с этапами, команды стажеров с кураторами, экспертов, администратора и оценки.
+
+    Размер команды (кроме последней, в нее попадает остаток) и количество оценок стажера выбираются
+    из диапазона [min, max] как min + (max - min) * u ** skew, где u равномерно на [0, 1):
+    skew = 1 - равномерное распределение, skew > 1 - большинство значений близко к min и немного больших,
+    skew < 1 - наоборот.
+    Оценки стажеру ставят участники его команды (в том числе он сам), куратор команды и эксперты
+    по этапам мероприятия стажера, не больше одной оценки от пользователя за этап.
+    """
+
+    def __init__(self, prefix='seed', seed=0, events=1, stages=5, trainees=1000, team_size=(6, 10), team_skew=1.0,
+                 teams_per_curator=2, experts=5, grades_per_trainee=(10, 50), grades_skew=1.0,
+                 password='uralintern', batch_size=5000, rebuild_summaries=True, log=None):
+        """
+        :param prefix: Префикс имен мероприятий, команд и почты пользователей: <prefix>.<номер>@uralintern.local
+        :param seed: Seed генератора случайных чисел
+        :param team_size: Диапазон (min, max) размера команды
+        :param grades_per_trainee: Диапазон (min, max) количества оценок, которые получает стажер
+        :param rebuild_summaries: Заполнить сводные таблицы оценок (manage.py rebuild_rating_summaries)
+        :param log: Функция для вывода прогресса
+        """
+        self.prefix = prefix
+        self.random = random.Random(seed)
+        self.events = events
+        self.stages = stages
+        self.trainees = trainees
+        self.team_size = team_size
+        self.team_skew = team_skew
+        self.teams_per_curator = teams_per_curator
+        self.experts = experts
+        self.grades_per_trainee = grades_per_trainee
+        self.grades_skew = grades_skew
+        self.password = password
+        self.batch_size = batch_size
+        self.rebuild_summaries = rebuild_summaries
+        self.log = log or (lambda message: None)
+        self._started = None
+
+    def exists(self) -> bool:
+        """Есть ли в базе данные с этим префиксом"""
+        return User.objects.filter(email__startswith=f'{self.prefix}.').exists() or \
+            Event.objects.filter(event_name__startswith=f'{self.prefix} ').exists()
+
+    def skewed(self, bounds, skew) -> int:
+        low, high = bounds
+        return min(low + int((high - low + 1) * self.random.random() ** skew), high)
+
+    def _progress(self, message):
+        self.log(f'{time.perf_counter() - self._started:7.1f} с  {message}')
+
+    def run(self) -> dict:
+        """
+        Создает данные в одной транзакции
+
+        :return: Словарь id созданных объектов: events, stages ({id мероприятия: [id этапов]}),
+                 teams ([{'id', 'curator_user', 'trainees': [id стажеров]}]), experts, admin, grades (количество)
+        """
+        self._started = time.perf_counter()
+        with transaction.atomic():
+            cohort = self._create()
+        if self.rebuild_summaries:
+            # сводные таблицы для отчетов заполняются сигналами, которые bulk_create не вызывает
+            call_command('rebuild_rating_summaries', stdout=StringIO())
+            self._progress('сводные таблицы оценок заполнены')
+        return cohort
+
+    def _create(self):
+        today = timezone.localdate()
+        prefix = self.prefix
+        Event.objects.bulk_create([Event(event_name=f'{prefix} {index}', date=today, is_active=True)
+                                   for index in range(self.events)])
+        events = list(Event.objects.filter(event_name__startswith=f'{prefix} ').order_by('pk')
+                      .values_list('pk', flat=True))
+        Stage.objects.bulk_create([
+            Stage(stage_name=f'{prefix} {event}.{index}', event_id=event, date=today + timedelta(weeks=index),
+                  is_active=True)
+            for event in events for index in range(self.stages)])
+        stages = {event: [] for event in events}
+        for pk, event in Stage.objects.filter(event_id__in=events).order_by('pk').values_list('pk', 'event_id'):
+            stages[event].append(pk)
+
+        sizes = []
+        while sum(sizes) < self.trainees:
+            sizes.append(self.skewed(self.team_size, self.team_skew))
+        sizes[-1] -= sum(sizes) - self.trainees
+        curators_count = -(-len(sizes) // self.teams_per_curator)
+        roles = ['ADMIN'] + ['CURATOR'] * curators_count + ['EXPERT'] * self.experts + ['TRAINEE'] * self.trainees
+        password = make_password(self.password)
+        self._bulk(User, (
+            User(username=f'{self.random.choice(LAST_NAMES)} {self.random.choice(FIRST_NAMES)}',
+                 email=f'{prefix}.{index}@uralintern.local', password=password, system_role=role,
+                 is_staff=role == 'ADMIN', is_superuser=role == 'ADMIN')
+            for index, role in enumerate(roles)))
+        users = list(User.objects.filter(email__startswith=f'{prefix}.').order_by('pk').values_list('pk', flat=True))
+        admin, curator_users = users[0], users[1:1 + curators_count]
+        expert_users = users[1 + curators_count:1 + curators_count + self.experts]
+        trainee_users = users[1 + curators_count + self.experts:]
+        self._progress(f'пользователей: {len(users)}')
+
+        bulk_provision([User(pk=user, system_role='CURATOR') for user in curator_users] +
+                       [User(pk=user, system_role='EXPERT') for user in expert_users])
+        curators = dict(Curator.objects.filter(user_id__in=curator_users).values_list('user_id', 'pk'))
+        self._bulk(Team, (Team(team_name=f'{prefix} {index}',
+                               curator_id=curators[curator_users[index // self.teams_per_curator]])
+                          for index in range(len(sizes))))
+        team_ids = list(Team.objects.filter(team_name__startswith=f'{prefix} ').order_by('pk')
+                        .values_list('pk', flat=True))
+
+        teams = []
+        fields = {}
+        position = 0
+        for index, (team, size) in enumerate(zip(team_ids, sizes)):
+            event = events[index % len(events)]
+            for user in trainee_users[position:position + size]:
+                fields[user] = {'team_id': team, 'event_id': event, 'internship': self.random.choice(INTERNSHIPS)}
+            teams.append({'id': team, 'event': event, 'curator_user': curator_users[index // self.teams_per_curator],
+                          'users': trainee_users[position:position + size]})
+            position += size
+        bulk_provision([User(pk=user, system_role='TRAINEE') for user in trainee_users], fields,
+                       batch_size=self.batch_size)
+        trainee_ids = dict(Trainee.objects.filter(user_id__in=trainee_users).values_list('user_id', 'pk'))
+        for team in teams:
+            team['trainees'] = [trainee_ids[user] for user in team['users']]
+        self._progress(f'команд: {len(teams)}, стажеров: {len(trainee_ids)}')
+
+        grades = self._bulk(Grade, self._grades(teams, stages, expert_users), log_every=100_000)
+        self._progress(f'оценок: {grades}')
+        return {'events': events, 'stages': stages, 'teams': teams, 'experts': expert_users, 'admin': admin,
+                'grades': grades}
+
+    def _grades(self, teams, stages, expert_users):
+        rng = self.random
+        values = (-1, 0, 1, 2, 2, 1, None)
+        for team in teams:
+            graders = team['users'] + [team['curator_user']] + expert_users
+            pairs = [(grader, stage) for stage in stages[team['event']] for grader in graders]
+            for trainee in team['trainees']:
+                count = min(self.skewed(self.grades_per_trainee, self.grades_skew), len(pairs))
+                for grader, stage in rng.sample(pairs, count):
+                    yield Grade(user_id=grader, trainee_id=trainee, team_id=team['id'], stage_id=stage,
+                                **{competence: rng.choice(values) for competence in COMPETENCES})
+
+    def _bulk(self, model, objects, log_every=None) -> int:
+        """Сохраняет объекты порциями по batch_size, возвращает количество"""
+        objects = iter(objects)
+        total = 0
+        while True:
+            batch = list(islice(objects, self.batch_size))
+            if not batch:
+                return total
+            model.objects.bulk_create(batch)
+            total += len(batch)
+            if log_every and total % log_every < self.batch_size:
+                self._progress(f'{str(model._meta.verbose_name_plural).lower()}: {total}')
+
@@ -1,6 +1,11 @@
+from copy import copy
+
 from django.contrib.auth import authenticate
 from rest_framework import serializers
+from .images import thumbnail_urls
+from .metrics import timer
 from .models import *
+from .tasks import replace_trainee_image
 
 
 class LoginSerializer(serializers.Serializer):
@@ -128,10 +133,11 @@ class TraineeSerializer(serializers.ModelSerializer):
     user = UserNameSerializer()
     team = TeamForTraineeSerializer()
     event = EventSerializer()
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Trainee
-        fields = "__all__"
+        exclude = ('updated_at',)
         read_only_fields = ('user',
                             'internship',
                             'course',
@@ -142,14 +148,17 @@ class TraineeSerializer(serializers.ModelSerializer):
                             'event',
                             'date_start')
 
+    def get_thumbnails(self, trainee) -> dict:
+        return thumbnail_urls(trainee.image.storage, trainee.thumbnails)
+
 
 class TraineeImageSerializer(serializers.Serializer):
     image = serializers.ImageField(use_url=True, validators=[FileExtensionValidator(['png', 'jpg', 'jpeg'])])
 
     def update(self, instance: Trainee, validated_data):
         # Если в словаре есть такой ключ, перепишет данные в базе, либо оствит то, что было
-        instance.image = validated_data.get('image', instance.image)
-        instance.save()
+        # миниатюры создаются фоновой задачей, оригинал сохраняется как есть
+        replace_trainee_image(instance, validated_data.get('image', instance.image))
         return instance
 
 
@@ -160,10 +169,14 @@ class TraineeTeamSerializer(serializers.Serializer):
     team = TeamForTeamMembersSerializer(required=True)
     internship = serializers.CharField(max_length=100, allow_blank=True)
     image = serializers.ImageField(use_url=True)
+    thumbnails = serializers.SerializerMethodField()
     event = EventSerializer()
 
     class Meta:
-        read_only_fields = ('id', 'user', 'team', 'internship', 'image', 'event')
+        read_only_fields = ('id', 'user', 'team', 'internship', 'image', 'thumbnails', 'event')
+
+    def get_thumbnails(self, trainee) -> dict:
+        return thumbnail_urls(trainee.image.storage, trainee.thumbnails)
 
 
 class ListGradeSerializer(serializers.ModelSerializer):
@@ -182,16 +195,23 @@ class ListGradeSerializer(serializers.ModelSerializer):
 
 class UpdateGradeSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
-        return Grade.objects.create(**validated_data)
+        with transaction.atomic():
+            grade = Grade.objects.create(**validated_data)
+            TraineeRatingSummary.objects.apply(added=[grade])
+        return grade
 
     def update(self, instance: Grade, validated_data):
+        # прежнее состояние оценки, чтобы вычесть его из сводной таблицы
+        previous = copy(instance)
         # Далее, если в словаре есть такой ключ, перепишет данные в базе, либо оствит то, что было
         instance.competence1 = validated_data.get('competence1', instance.competence1)
         instance.competence2 = validated_data.get('competence2', instance.competence2)
         instance.competence3 = validated_data.get('competence3', instance.competence3)
         instance.competence4 = validated_data.get('competence4', instance.competence4)
         instance.date = datetime.now()
-        instance.save()
+        with transaction.atomic():
+            instance.save()
+            TraineeRatingSummary.objects.apply(added=[instance], removed=[previous])
         return instance
 
     def validate(self, grade):
@@ -216,7 +236,84 @@ class UpdateGradeSerializer(serializers.ModelSerializer):
                   'competence4',)
 
 
+class BatchGradeItemSerializer(serializers.Serializer):
+    """Одна оценка из пакета. Стажер и этап проверяются в представлении для всего пакета сразу"""
+    trainee = serializers.IntegerField()
+    stage = serializers.IntegerField()
+    competence1 = serializers.IntegerField(min_value=-1, max_value=2, allow_null=True, required=False)
+    competence2 = serializers.IntegerField(min_value=-1, max_value=2, allow_null=True, required=False)
+    competence3 = serializers.IntegerField(min_value=-1, max_value=2, allow_null=True, required=False)
+    competence4 = serializers.IntegerField(min_value=-1, max_value=2, allow_null=True, required=False)
+
+
+class BulkUserItemSerializer(serializers.Serializer):
+    """Один пользователь из пакета. Занятость почты проверяется в представлении для всего пакета сразу"""
+    username = serializers.CharField(max_length=255)
+    email = serializers.EmailField(max_length=254)
+    system_role = serializers.ChoiceField(choices=User.ROLES, default='TRAINEE')
+    # без пароля создается случайный, его можно разослать действием в панели администратора
+    password = serializers.CharField(max_length=128, required=False, write_only=True)
+    social_url = serializers.URLField(max_length=200, required=False, allow_null=True)
+
+    def validate_username(self, username):
+        if len(username.split()) < 2:
+            raise serializers.ValidationError('ФИО должно содержать фамилию и имя')
+        return username
+
+    def validate_email(self, email):
+        return User.objects.normalize_email(email)
+
+
 class GradeDescriptionSerializer(serializers.ModelSerializer):
     class Meta:
         model = GradeDescription
         fields = "__all__"
+
+
+class ValuesSerializer:
+    """
+    Сериализация для часто запрашиваемых списков: словари ответа собираются напрямую из кортежей
+    values_list, без объектов моделей и полей DRF. Вывод должен совпадать с соответствующим
+    сериализатором DRF, это проверяется в tests.py.
+    """
+    fields = ()
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+    def to_representation(self, row) -> dict:
+        raise NotImplementedError
+
+    @property
+    def data(self):
+        with timer('serializer'):
+            return [self.to_representation(row) for row in self.queryset.values_list(*self.fields)]
+
+
+class TeamMemberValuesSerializer(ValuesSerializer):
+    """Участник команды в формате ответов trainee/team и expert/teams (поля TraineeTeamSerializer)"""
+    fields = ('id', 'user__username', 'team__team_name', 'internship', 'image', 'thumbnails', 'user__social_url',
+              'event_id')
+
+    def __init__(self, queryset, stages_index):
+        """
+        :param queryset: QuerySet стажеров
+        :param stages_index: Активные этапы по id мероприятия, см. functions.index_stages
+        """
+        super().__init__(queryset)
+        self.stages_index = stages_index
+        self.storage = Trainee._meta.get_field('image').storage
+
+    def to_representation(self, row) -> dict:
+        pk, username, team_name, internship, image, thumbnails, social_url, event = row
+        return {
+            'id': pk,
+            'username': username,
+            'team_name': team_name,
+            'internship': internship,
+            'image': self.storage.url(image) if image else None,
+            'thumbnails': thumbnail_urls(self.storage, thumbnails),
+            'social_url': social_url,
+            'event': event,
+            'stages': self.stages_index.get(event, []) if event else [],
+        }
@@ -0,0 +1,69 @@
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.crypto import get_random_string
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import cached_property
+
+# имя файла с хэшем содержимого: images/1.3f2a9c1b7d4e.jpg
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+
+
+def is_hashed(name) -> bool:
+    """Имя содержит хэш содержимого, значит файл по этому адресу никогда не изменится"""
+    return bool(HASHED_NAME.search(name))
+
+
+@deconstructible
+class HashedFileSystemStorage(FileSystemStorage):
+    """
+    Хранилище, которое добавляет к имени файла хэш содержимого. Новое содержимое всегда получает
+    новый адрес, поэтому такие файлы отдаются с бессрочным кэшированием (uralapi/media.py).
+    """
+    hash_length = 12
+
+    def file_hash(self, content) -> str:
+        md5 = hashlib.md5()
+        for chunk in content.chunks():
+            md5.update(chunk)
+        return md5.hexdigest()[:self.hash_length]
+
+    def _save(self, name, content):
+        if not is_hashed(name):
+            root, ext = os.path.splitext(name)
+            name = f'{root}.{self.file_hash(content)}{ext}'
+        return super()._save(name, content)
+
+    def get_alternative_name(self, file_root, file_ext):
+        # случайный суффикс ставится перед хэшем, чтобы имя оставалось хэшированным
+        root, file_hash = os.path.splitext(file_root)
+        if is_hashed(file_root + file_ext):
+            return f'{root}_{get_random_string(7)}{file_hash}{file_ext}'
+        return super().get_alternative_name(file_root, file_ext)
+
+
+@deconstructible
+class PrivateFileSystemStorage(FileSystemStorage):
+    """
+    Хранилище загруженных файлов, которые не должны быть доступны по ссылке (например, CSV для импорта
+    со списком стажеров). Каталог PRIVATE_UPLOAD_ROOT находится вне MEDIA_ROOT и не отдается по /media/.
+    """
+
+    @cached_property
+    def base_location(self):
+        return self._value_or_setting(self._location, settings.PRIVATE_UPLOAD_ROOT)
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting == 'PRIVATE_UPLOAD_ROOT':
+            self.__dict__.pop('base_location', None)
+            self.__dict__.pop('location', None)
+
+    def url(self, name):
+        raise ValueError('Файлы закрытого хранилища не имеют публичного адреса')
+
+
+upload_storage = PrivateFileSystemStorage()
@@ -0,0 +1,136 @@
+from django.db.models import F, Q
+
+from .functions import COMPETENCES
+from .images import thumbnail_urls
+from .models import ChangeLog, Grade, Stage, Team, Trainee, bulk_deletion
+
+SYNC_MODELS = (Trainee, Team, Stage, Grade)
+
+
+def record_saved(sender, instance, **kwargs):
+    """Обработчик сигнала. Записывает в журнал изменение объекта"""
+    ChangeLog.objects.record(sender, [instance.pk])
+
+
+def record_deleted(sender, instance, **kwargs):
+    """Обработчик сигнала. Оставляет в журнале запись об удаленном объекте"""
+    if bulk_deletion.get():
+        return
+    ChangeLog.objects.record(sender, [instance.pk], deleted=True)
+
+
+def record_user_saved(sender, instance, created, **kwargs):
+    """Обработчик сигнала. Имя пользователя входит в данные стажера, поэтому его изменение - изменение стажера"""
+    if not created:
+        ChangeLog.objects.record(Trainee, Trainee.objects.filter(user_id=instance.pk).values_list('pk', flat=True))
+
+
+class TraineeSync:
+    """
+    Данные, которые видит стажер в мобильном клиенте: стажеры его команды, его команда,
+    этапы его мероприятия, оценки, которые он поставил или получил.
+
+    Изменения выбираются из журнала ChangeLog после токена клиента. Токен отстает от последних записей
+    (ChangeLogManager.stable_token), поэтому недавние изменения клиент получает повторно. Объекты, которые изменились,
+    но не видны стажеру, и удаленные объекты возвращаются в deleted, клиент удаляет их у себя, если они есть.
+    Полный набор данных (full) отдается без токена, при устаревшем токене, при большом количестве
+    изменений и при изменении самого стажера, потому что могла смениться команда или мероприятие.
+    """
+    max_changes = 500
+
+    fields = {
+        'trainee': ('id', 'user', 'internship', 'course', 'speciality', 'institution', 'image', 'thumbnails', 'team',
+                    'event', 'date_start'),
+        'team': ('id', 'team_name'),
+        'stage': ('id', 'stage_name', 'event', 'date', 'is_active'),
+        'grade': ('id', 'user', 'trainee', 'team', 'stage', *COMPETENCES, 'date'),
+    }
+    # поля связанных моделей
+    related_fields = {
+        'trainee': {'username': F('user__username'), 'social_url': F('user__social_url')},
+        'team': {'curator_name': F('curator__user__username')},
+    }
+
+    def __init__(self, trainee, request=None):
+        """
+        :param trainee: Стажер, для которого собираются данные
+        :param request: Запрос, нужен для полного адреса изображения
+        """
+        self.trainee = trainee
+        self.request = request
+
+    def querysets(self):
+        """Объекты, которые видны стажеру, по моделям"""
+        trainee = self.trainee
+        return {
+            'trainee': Trainee.objects.filter(team_id=trainee.team_id) if trainee.team_id
+            else Trainee.objects.filter(pk=trainee.pk),
+            'team': Team.objects.filter(pk=trainee.team_id),
+            'stage': Stage.objects.filter(event_id=trainee.event_id),
+            'grade': Grade.objects.filter(Q(user_id=trainee.user_id) | Q(trainee_id=trainee.pk)),
+        }
+
+    def _rows(self, name, queryset):
+        rows = list(queryset.order_by('pk').values(*self.fields[name], **self.related_fields.get(name, {})))
+        if name == 'trainee':
+            storage = Trainee._meta.get_field('image').storage
+            absolute = self.request.build_absolute_uri if self.request else str
+            for row in rows:
+                if row['image']:
+                    row['image'] = absolute(storage.url(row['image']))
+                row['thumbnails'] = {size: absolute(url)
+                                     for size, url in thumbnail_urls(storage, row['thumbnails']).items()}
+        return rows
+
+    def changes_since(self, since):
+        """
+        Изменения после токена
+
+        :param since: Токен клиента, None - полный набор данных
+        :return: Словарь {'token', 'full', 'changes': {модель: [строки]}, 'deleted': {модель: [id]}}
+        """
+        # токен читается до данных: все, что зафиксировано до него, войдет в ответ
+        token = ChangeLog.objects.stable_token()
+        last = ChangeLog.objects.last_token()
+        changed = self._changed(since, last) if since is not None else None
+        querysets = self.querysets()
+        data = {'token': str(token), 'full': changed is None, 'changes': {}, 'deleted': {}}
+        for name, queryset in querysets.items():
+            if changed is None:
+                data['changes'][name] = self._rows(name, queryset)
+                data['deleted'][name] = []
+                continue
+            ids, deleted = changed.get(name, (set(), set()))
+            rows = self._rows(name, queryset.filter(pk__in=ids)) if ids else []
+            data['changes'][name] = rows
+            data['deleted'][name] = sorted(deleted | (ids - {row['id'] for row in rows}))
+        return data
+
+    def _changed(self, since, last):
+        """
+        id измененных и удаленных объектов по моделям
+
+        :param since: Токен клиента
+        :param last: id последней записи журнала
+
+        :return: {модель: (измененные id, удаленные id)} или None, если нужен полный набор данных
+        """
+        if since > last or (since and not ChangeLog.objects.filter(pk=since).exists()):
+            # токен не выдавался или записи журнала до него уже удалены
+            return None
+        entries = ChangeLog.objects.filter(pk__gt=since, pk__lte=last).order_by('pk') \
+            .values_list('model', 'object_id', 'deleted')[:self.max_changes + 1]
+        entries = list(entries)
+        if len(entries) > self.max_changes:
+            return None
+        changed = {}
+        for model, object_id, deleted in entries:
+            ids, removed = changed.setdefault(model, (set(), set()))
+            if deleted:
+                ids.discard(object_id)
+                removed.add(object_id)
+            else:
+                ids.add(object_id)
+        if self.trainee.pk in changed.get('trainee', ((), ()))[0]:
+            return None
+        return changed
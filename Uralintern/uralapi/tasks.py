@@ -0,0 +1,128 @@
+"""Фоновые задачи панели администратора"""
+import codecs
+import csv
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.utils import timezone
+
+from .images import delete_thumbnails, process_image
+from .importers import TraineeCsvImporter
+from .jobs import job
+from .mailing import MailDispatcher
+from .models import MailDelivery, Trainee, User
+from .storage import upload_storage
+
+EMAIL_BATCH_SIZE = 100 # через сколько писем сохранять прогресс задачи
+
+CREDENTIALS = 'credentials'
+
+
+def credentials_message(user):
+    """Письмо с данными для входа в личный кабинет"""
+    subject = "Вход в личный кабинет Uralintern"
+    message = f"Привет!\nВот твои логин и пароль для входа в личный кабинет для оценки по стажёрским компетециям." \
+              f"\nЛогин -  {user.email}" \
+              f"\nПароль - {user.unhashed_password}" \
+              f"\nОценки можно давать через веб-приложение pa-uralintern.herokuapp.com" \
+              f" и мобильное приложение drive.google.com/drive/folders/10kfrNJ5FTeJHMkG1pdri1tyDOi8uo0oT"
+    return subject, message, settings.EMAIL_HOST_USER, [user.email]
+
+
+@job()
+def send_credentials(background_job, user_ids, force=False):
+    """
+    Рассылка данных для входа выбранным пользователям через пул SMTP соединений (uralapi/mailing.py).
+    Результат по каждому получателю сохраняется в журнал сразу после отправки, поэтому при повторе
+    прерванной задачи пользователи, которым письмо уже отправлено, пропускаются.
+    С force письмо с текущим паролем (User.unhashed_password) отправляется еще раз и им, новый пароль не создается.
+    """
+    existing = set(MailDelivery.objects.filter(kind=CREDENTIALS, user_id__in=user_ids)
+                   .values_list('user_id', flat=True))
+    MailDelivery.objects.bulk_create([
+        MailDelivery(user_id=pk, kind=CREDENTIALS, email=email)
+        for pk, email in User.objects.filter(pk__in=user_ids).exclude(pk__in=existing).values_list('pk', 'email')])
+
+    deliveries = MailDelivery.objects.filter(kind=CREDENTIALS, user_id__in=user_ids)
+    if not force:
+        deliveries = deliveries.exclude(status=MailDelivery.SENT)
+    deliveries = {delivery.user_id: delivery for delivery in deliveries}
+    background_job.set_progress(0, len(deliveries))
+
+    users = User.objects.filter(pk__in=list(deliveries)).only('email', 'unhashed_password').order_by('pk')
+    messages = ((user.pk, EmailMessage(*credentials_message(user))) for user in users.iterator())
+    done, sent = 0, 0
+    for user_id, is_sent, attempts, error in MailDispatcher().send(messages):
+        delivery = deliveries[user_id]
+        delivery.attempts += attempts
+        delivery.status = MailDelivery.SENT if is_sent else MailDelivery.FAILED
+        delivery.error = error or ''
+        delivery.sent_at = timezone.now() if is_sent else delivery.sent_at
+        # письмо уже ушло, поэтому запись сохраняется до отправки следующего
+        delivery.save(update_fields=['attempts', 'status', 'error', 'sent_at'])
+        done += 1
+        sent += is_sent
+        if done % EMAIL_BATCH_SIZE == 0:
+            background_job.set_progress(done)
+    background_job.set_progress(done)
+    return f'Отправлено писем: {sent}, с ошибкой: {done - sent}'
+
+
+@job(max_attempts=1)
+def import_trainees_csv(background_job, path, delimiter):
+    """
+    Импорт стажеров из CSV файла, сохраненного в закрытом хранилище (storage.upload_storage).
+    Файл удаляется только после успешного импорта, чтобы задачу с ошибкой можно было повторить
+    из панели администратора. Уже созданные при прошлой попытке стажеры попадут в ошибки как существующие.
+    """
+    with upload_storage.open(path, 'rb') as file:
+        rows = csv.DictReader(codecs.iterdecode(file, encoding='utf-8-sig'), delimiter=delimiter)
+        result = TraineeCsvImporter(progress=lambda result: background_job.set_progress(result.processed)) \
+            .run(rows)
+    upload_storage.delete(path)
+    errors = '\n'.join(f'Строка {line}: {error}' for line, error in result.errors)
+    return f'{result}\n{errors}'.strip()
+
+
+def replace_trainee_image(trainee, image):
+    """
+    Заменяет изображение стажера: сохраняет стажера, после фиксации транзакции удаляет миниатюры
+    прежнего изображения и ставит обработку нового изображения в очередь
+
+    :param trainee: Стажер
+    :param image: Загруженный файл, None - удалить изображение
+    """
+    storage, thumbnails = trainee.image.storage, trainee.thumbnails
+    trainee.image = image
+    trainee.thumbnails = {}
+    trainee.save()
+    # файлы удаляются только после фиксации: при откате запись стажера ссылается на прежние миниатюры
+    if thumbnails:
+        transaction.on_commit(lambda: delete_thumbnails(storage, thumbnails))
+    if trainee.image:
+        transaction.on_commit(lambda: process_trainee_image.delay(trainee_id=trainee.pk))
+
+
+@job()
+def process_trainee_image(background_job, trainee_id):
+    """Обработка загруженного изображения стажера: удаление метаданных, уменьшение, миниатюры (uralapi/images.py)"""
+    trainee = Trainee.objects.filter(pk=trainee_id).first()
+    if trainee is None or not trainee.image:
+        return 'Изображение удалено'
+    storage = trainee.image.storage
+    name = trainee.image.name
+    if not storage.exists(name):
+        return 'Файл изображения не найден'
+    original, thumbnails = process_image(storage, name)
+    with transaction.atomic():
+        trainee = Trainee.objects.select_for_update().filter(pk=trainee_id).first()
+        if trainee is None or trainee.image.name != name:
+            # пока шла обработка, изображение заменили или стажера удалили
+            delete_thumbnails(storage, {'original': original, **thumbnails})
+            return 'Изображение заменено во время обработки'
+        # прежний файл удалит django_cleanup после сохранения
+        trainee.image = original
+        trainee.thumbnails = thumbnails
+        trainee.save(update_fields=['image', 'thumbnails', 'updated_at'])
+    return f'Миниатюры: {", ".join(thumbnails)}'
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Запуск тестов (TEST_RUNNER): превышение query_budget представления роняет тест
+    (API_METRICS['ENFORCE_BUDGETS']), кэш - в памяти процесса, чтобы записи не переходили между запусками
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_settings = override_settings(
+            API_METRICS={**settings.API_METRICS, 'ENFORCE_BUDGETS': True},
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        )
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,1211 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from smtplib import SMTPServerDisconnected
+from unittest import mock
 
-# Create your tests here.
+from openpyxl import load_workbook
+from PIL import Image
+
+from django.contrib.admin import helpers
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends import locmem
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone as django_timezone
+from django.utils.timezone import now
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+
+from .functions import COMPETENCES, get_report, index_stages
+from .management.commands.benchmark_api import SCENARIOS
+from .management.commands.benchmark_report import _legacy_report
+from .management.commands.benchmark_serialization import legacy_team_members
+from .models import BackgroundJob, ChangeLog, Curator, Event, Grade, MailDelivery, Stage, Team, Trainee, \
+    TraineeRatingSummary, User
+from . import jobs, media, renderers
+from .deletion import delete_users
+from .exports import GradeExporter
+from .importers import TraineeCsvImporter
+from .mailing import MailDispatcher, RateLimiter
+from .pivot import GradePivot
+from .metrics import QueryBudgetExceeded, registry
+from .profiles import PROFILE_MODELS, bulk_provision
+from .storage import HashedFileSystemStorage
+from .seeding import CohortGenerator
+from .serializers import ListGradeSerializer, TeamMemberValuesSerializer
+from .tasks import replace_trainee_image, send_credentials
+from .urls import urlpatterns
+from .views import BatchUpdateCreateGradeAPIView, BulkReportAPIView, ListStagesAPIView
+
+
+class ReportTest(TestCase):
+    """Отчет одним запросом (get_report) совпадает с прежним подсчетом в Python"""
+
+    def setUp(self):
+        event = Event.objects.create(event_name='Мероприятие', date=date.today(), is_active=True)
+        stages = [Stage.objects.create(stage_name=f'Этап {index}', event=event, date=date.today(), is_active=True)
+                  for index in range(2)]
+        teams = [Team.objects.create(team_name=f'Команда {index}') for index in range(2)]
+        users = [User.objects.create_user(f'Стажер {index}', f'trainee{index}@test.ru', 'password')
+                 for index in range(4)]
+        graders = users + [User.objects.create_user('Эксперт Экспертов', 'expert@test.ru', 'password', role='EXPERT'),
+                           User.objects.create_user('Куратор Кураторов', 'curator@test.ru', 'password',
+                                                    role='CURATOR')]
+        # третий и четвертый стажеры без команды
+        Trainee.objects.filter(user__in=users[:2]).update(team=teams[0], event=event)
+        self.trainees = list(Trainee.objects.filter(user__in=users).order_by('pk'))
+        values = (-1, 0, 1, 2, None)
+        for index, (grader, trainee, stage) in enumerate(
+                (grader, trainee, stage) for grader in graders for trainee in self.trainees for stage in stages):
+            Grade.objects.create(user=grader, trainee=trainee, stage=stage,
+                                 competence1=values[index % 5], competence2=values[(index * 3) % 5],
+                                 competence3=None if index % 4 == 0 else 1, competence4=values[(index * 7 + 2) % 5])
+        # первый стажер перешел в другую команду: прежние оценки остаются с прежней командой
+        Trainee.objects.filter(pk=self.trainees[0].pk).update(team=teams[1])
+        self.trainees[0].refresh_from_db()
+        Grade.objects.create(user=graders[1], trainee=self.trainees[0], stage=Stage.objects.create(
+            stage_name='Этап 2', event=event, date=date.today(), is_active=True), competence1=2)
+
+    def test_matches_legacy(self):
+        for trainee in self.trainees:
+            report = get_report(trainee, Grade.objects.all())
+            self.assertEqual([[report[bucket][competence] for competence in COMPETENCES] for bucket in report],
+                             _legacy_report(trainee))
+            self.assertEqual(list(report), ['general', 'self', 'team', 'expert'])
+
+
+class BulkReportTest(TestCase):
+    """api/grade/report/bulk: потоковый JSON, доступ по роли, фильтры, количество запросов"""
+    url = '/api/grade/report/bulk'
+
+    def setUp(self):
+        self.cohort = CohortGenerator(prefix='report', events=2, stages=2, trainees=12, team_size=(3, 3),
+                                      teams_per_curator=2, experts=1, grades_per_trainee=(2, 6), batch_size=100).run()
+        self.expert = User.objects.get(pk=self.cohort['experts'][0])
+
+    def reports(self, user, **params):
+        response = self.client.get(self.url, params, HTTP_AUTHORIZATION=f'Token {user.token}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return json.loads(b''.join(response.streaming_content))['reports']
+
+    def test_stream(self):
+        with mock.patch.object(BulkReportAPIView, 'chunk_size', 5):
+            response = self.client.get(self.url, HTTP_AUTHORIZATION=f'Token {self.expert.token}')
+            chunks = list(response.streaming_content)
+        # начало, три порции по 5, 5 и 2 отчета, конец
+        self.assertEqual(len(chunks), 5)
+        reports = json.loads(b''.join(chunks))['reports']
+        self.assertEqual([report['id'] for report in reports], list(Trainee.objects.order_by('pk')
+                                                                  .values_list('pk', flat=True)))
+        for report in reports:
+            trainee = Trainee.objects.select_related('user', 'team').get(pk=report['id'])
+            self.assertEqual(report, {'id': trainee.pk, 'username': trainee.user.username,
+                                      'team_name': trainee.team.team_name, 'event': trainee.event_id,
+                                      'rating': get_report(trainee, Grade.objects.all())})
+
+    def test_roles(self):
+        teams = self.cohort['teams']
+        curator = User.objects.get(pk=teams[0]['curator_user'])
+        expected = sorted(pk for team in teams if team['curator_user'] == curator.pk for pk in team['trainees'])
+        self.assertEqual(len(expected), 6)
+        self.assertEqual([report['id'] for report in self.reports(curator)], expected)
+
+        trainee = User.objects.get(pk=teams[0]['users'][0])
+        response = self.client.get(self.url, HTTP_AUTHORIZATION=f'Token {trainee.token}')
+        self.assertEqual(response.status_code, 403)
+
+    def test_filters(self):
+        team = self.cohort['teams'][1]
+        self.assertEqual([report['id'] for report in self.reports(self.expert, team=team['id'])], team['trainees'])
+        event = self.cohort['teams'][-1]['event']
+        self.assertEqual([report['id'] for report in self.reports(self.expert, event=event)],
+                         list(Trainee.objects.filter(event_id=event).order_by('pk').values_list('pk', flat=True)))
+        response = self.client.get(self.url, {'team': 'first'}, HTTP_AUTHORIZATION=f'Token {self.expert.token}')
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_count(self):
+        team = self.cohort['teams'][0]
+        self.reports(self.expert)  # токен и кэш аутентификации
+        with CaptureQueriesContext(connection) as one_team:
+            self.assertEqual(len(self.reports(self.expert, team=team['id'])), 3)
+        with CaptureQueriesContext(connection) as everyone:
+            self.assertEqual(len(self.reports(self.expert)), 12)
+        self.assertEqual(len(one_team.captured_queries), len(everyone.captured_queries))
+
+
+class TeamMembersQueryCountTest(TestCase):
+    """Количество запросов при выводе состава команд не должно зависеть от размера команды"""
+
+    def setUp(self):
+        self.event = Event.objects.create(event_name='Мероприятие', date=date.today(), is_active=True)
+        Stage.objects.create(stage_name='Этап 1', event=self.event, date=date.today(), is_active=True)
+        Stage.objects.create(stage_name='Этап 2', event=self.event, date=date.today(), is_active=False)
+        other_event = Event.objects.create(event_name='Другое мероприятие', date=date.today(), is_active=True)
+        Stage.objects.create(stage_name='Этап 3', event=other_event, date=date.today(), is_active=True)
+
+        curator_user = User.objects.create_user('Куратор Кураторов', 'curator@test.ru', 'password', role='CURATOR')
+        self.team = Team.objects.create(team_name='Команда', curator=Curator.objects.get(user=curator_user))
+        self.trainee_user = self._add_trainee(0)
+        self.curator_user = curator_user
+        self.expert_user = User.objects.create_user('Эксперт Экспертов', 'expert@test.ru', 'password', role='EXPERT')
+
+    def _add_trainee(self, index):
+        user = User.objects.create_user(f'Стажер {index}', f'trainee{index}@test.ru', 'password')
+        Trainee.objects.filter(user=user).update(team=self.team, event=self.event)
+        return user
+
+    def _count_queries(self, url, user):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, HTTP_AUTHORIZATION=f'Token {user.token}')
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.json()
+
+    def _assert_constant(self, url, user):
+        self._add_trainee(1)
+        # первый запрос заполняет кэш справочников
+        self._count_queries(url, user)
+        small, _ = self._count_queries(url, user)
+        for index in range(2, 8):
+            self._add_trainee(index)
+        large, data = self._count_queries(url, user)
+        self.assertEqual(small, large)
+        return data
+
+    def test_trainee_team(self):
+        data = self._assert_constant('/api/trainee/team', self.trainee_user)
+        self.assertEqual(len(data['team']), 7)
+        self.assertEqual([stage['stage_name'] for stage in data['trainee']['stages']], ['Этап 1'])
+        self.assertEqual([stage['stage_name'] for stage in data['team'][0]['stages']], ['Этап 1'])
+
+    def test_expert_teams(self):
+        data = self._assert_constant('/api/expert/teams', self.expert_user)
+        self.assertEqual(len(data['teams']['Команда']), 8)
+
+    def test_curator_teams(self):
+        data = self._assert_constant('/api/expert/teams', self.curator_user)
+        self.assertEqual(len(data['teams']['Команда']), 8)
+
+
+class ReferenceCacheTest(TestCase):
+    """Кэш справочников не должен отдавать устаревшие данные после изменения"""
+
+    def setUp(self):
+        self.event = Event.objects.create(event_name='Мероприятие', date=date.today(), is_active=True)
+        self.stage = Stage.objects.create(stage_name='Этап 1', event=self.event, date=date.today(), is_active=True)
+        user = User.objects.create_user('Стажер Стажеров', 'trainee@test.ru', 'password')
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {user.token}'}
+        self.url = f'/api/stages/{self.event.pk}'
+
+    def test_etag(self):
+        response = self.client.get(self.url, **self.auth)
+        self.assertEqual(len(response.json()['stages']), 1)
+        with self.assertNumQueries(1):
+            # остается только запрос пользователя при аутентификации
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'], **self.auth)
+        self.assertEqual(response.status_code, 304)
+
+    def test_invalidation(self):
+        etag = self.client.get(self.url, **self.auth)['ETag']
+        self.stage.stage_name = 'Новое название'
+        self.stage.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['stages'][0]['stage_name'], 'Новое название')
+
+        # закрытие мероприятия деактивирует этапы через update, без сигналов этапов
+        self.event.is_active = False
+        self.event.save()
+        self.assertEqual(self.client.get(self.url, **self.auth).json()['stages'], [])
+
+
+@override_settings(JWT_STATELESS_AUTH=True)
+class StatelessAuthenticationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('Стажер Стажеров', 'trainee@test.ru', 'password')
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {self.user.token}'}
+
+    def test_without_user_query(self):
+        self.client.get('/api/grade/get/to', **self.auth)
+        with self.assertNumQueries(2):
+            # только валидатор ETag и запрос оценок
+            response = self.client.get('/api/grade/get/to', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        # поля, которых нет в токене, загружаются из базы
+        self.assertEqual(self.client.get('/api/user', **self.auth).json()['user']['email'], 'trainee@test.ru')
+
+    def test_login_after_role_change(self):
+        def login():
+            response = self.client.post('/api/user/login', {'user': {'email': 'trainee@test.ru', 'password': 'password'}},
+                                        content_type='application/json')
+            return response.json()['user']['token']
+
+        self.assertEqual(self.client.get('/api/user', HTTP_AUTHORIZATION=f'Token {login()}').status_code, 200)
+        self.user.system_role = 'CURATOR'
+        self.user.save()
+        # токен с прежней ролью отклоняется, при входе выдается новый
+        self.assertEqual(self.client.get('/api/user', **self.auth).status_code, 403)
+        self.assertEqual(self.client.get('/api/user', HTTP_AUTHORIZATION=f'Token {login()}').status_code, 200)
+
+    def test_deactivated_user(self):
+        self.client.get('/api/grade/get/to', **self.auth)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/grade/get/to', **self.auth).status_code, 403)
+
+
+class GradePivotTest(TestCase):
+    """Сводная таблица должна совпадать с отчетом get_report по каждому этапу"""
+
+    def setUp(self):
+        event = Event.objects.create(event_name='Мероприятие', date=date.today(), is_active=True)
+        self.stages = [Stage.objects.create(stage_name=f'Этап {index}', event=event, date=date.today(), is_active=True)
+                       for index in range(2)]
+        team = Team.objects.create(team_name='Команда')
+        self.trainee_user = User.objects.create_user('Стажер Стажеров', 'trainee@test.ru', 'password')
+        Trainee.objects.filter(user=self.trainee_user).update(team=team, event=event)
+        self.trainee = Trainee.objects.get(user=self.trainee_user)
+        self.expert_user = User.objects.create_user('Эксперт Экспертов', 'expert@test.ru', 'password', role='EXPERT')
+        other = User.objects.create_user('Стажер Другой', 'other@test.ru', 'password')
+        for index, user in enumerate((self.trainee_user, self.expert_user, other)):
+            Grade.objects.create(user=user, trainee=self.trainee, stage=self.stages[0], competence1=index - 1,
+                                 competence2=None, competence3=2, competence4=index % 2)
+        Grade.objects.create(user=self.expert_user, trainee=self.trainee, stage=self.stages[1], competence1=1)
+
+    def test_matches_report(self):
+        response = self.client.get('/api/grade/pivot', HTTP_AUTHORIZATION=f'Token {self.expert_user.token}')
+        records = response.json()['pivot']
+        self.assertEqual(len(records), 2)
+        for record in records:
+            expected = get_report(self.trainee, Grade.objects.filter(stage_id=record['stage']))
+            for bucket, values in expected.items():
+                for competence, value in values.items():
+                    self.assertEqual(record[bucket][competence] or 0, value)
+        self.assertEqual(records[1]['self']['count'], 0)
+        self.assertIsNone(records[1]['self']['competence1'])
+
+    def test_names(self):
+        # имена загружаются только для стажеров и этапов, которые есть в таблице
+        trainees, stages = GradePivot(Grade.objects.filter(stage=self.stages[1])).compute()._names()
+        self.assertEqual(list(trainees), [self.trainee.pk])
+        self.assertEqual(stages, {self.stages[1].pk: 'Этап 1'})
+
+    def test_export(self):
+        auth = {'HTTP_AUTHORIZATION': f'Token {self.expert_user.token}'}
+        response = self.client.get(f'/api/grade/pivot?stage={self.stages[0].pk}&export=csv', **auth)
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith('Стажер Стажеров,Команда,Этап 0,3,'))
+        self.assertEqual(self.client.get('/api/grade/pivot', HTTP_AUTHORIZATION=f'Token {self.trainee_user.token}')
+                         .status_code, 403)
+
+
+class RatingSummaryTest(TestCase):
+    """Отчет по сводной таблице совпадает с отчетом get_report по оценкам после любых изменений оценок"""
+
+    def setUp(self):
+        event = Event.objects.create(event_name='Мероприятие', date=date.today(), is_active=True)
+        self.stages = [Stage.objects.create(stage_name=f'Этап {index}', event=event, date=date.today(), is_active=True)
+                       for index in range(2)]
+        team = Team.objects.create(team_name='Команда')
+        self.users = [User.objects.create_user(f'Стажер {index}', f'trainee{index}@test.ru', 'password')
+                      for index in range(3)]
+        # третий стажер без команды
+        Trainee.objects.filter(user__in=self.users[:2]).update(team=team, event=event)
+        self.expert = User.objects.create_user('Эксперт Экспертов', 'expert@test.ru', 'password', role='EXPERT')
+        self.admin = User.objects.create_superuser('Админ Админов', 'admin@test.ru', 'password')
+
+    def grade(self, user, trainee_user, stage, **competences):
+        grade = {'trainee': trainee_user.trainee.pk, 'stage': stage.pk, **competences}
+        response = self.client.post('/api/grade/create-update', {'grade': grade}, content_type='application/json',
+                                    HTTP_AUTHORIZATION=f'Token {user.token}')
+        self.assertEqual(response.status_code, 200)
+
+    def assertConsistent(self):
+        for user in self.users:
+            self.assertEqual(TraineeRatingSummary.objects.report(user.pk),
+                             get_report(Trainee.objects.get(user=user), Grade.objects.all()))
+
+    def test_consistent(self):
+        for stage in self.stages:
+            for trainee_user in self.users:
+                self.grade(trainee_user, trainee_user, stage, competence1=2, competence2=None, competence3=-1)
+                self.grade(self.users[0], trainee_user, stage, competence1=1, competence4=2)
+                self.grade(self.expert, trainee_user, stage, competence2=-1, competence3=1)
+        self.assertConsistent()
+
+        # обновление через API и в панели администратора
+        self.grade(self.expert, self.users[1], self.stages[0], competence1=2, competence2=2)
+        grade = Grade.objects.get(user=self.users[0], trainee__user=self.users[2], stage=self.stages[1])
+        self.client.force_login(self.admin)
+        response = self.client.post(f'/admin/uralapi/grade/{grade.pk}/change/',
+                                    {'competence1': '-1', 'competence2': '', 'competence3': '0', 'competence4': '1'})
+        self.assertEqual(response.status_code, 302)
+        self.assertConsistent()
+
+        # удаление одной оценки и каскадом вместе с этапом
+        Grade.objects.filter(user=self.users[1], trainee__user=self.users[1], stage=self.stages[0]).get().delete()
+        self.assertConsistent()
+        with CaptureQueriesContext(connection) as context:
+            self.stages[1].delete()
+        # один apply() на все оценки этапа и каскадное удаление сводок этапа
+        self.assertEqual(len([query for query in context.captured_queries
+                              if 'uralapi_traineeratingsummary' in query['sql']]), 2)
+        self.assertConsistent()
+
+    def test_role_change(self):
+        for trainee_user in self.users:
+            self.grade(self.users[0], trainee_user, self.stages[0], competence1=2)
+            self.grade(self.expert, trainee_user, self.stages[0], competence1=-1)
+        for user, role in ((self.users[0], 'CURATOR'), (self.expert, 'TRAINEE'), (self.users[0], 'TRAINEE')):
+            user.system_role = role
+            user.save()
+            self.assertConsistent()
+
+    def test_unique_without_team(self):
+        self.grade(self.expert, self.users[2], self.stages[0], competence1=1)
+        row = TraineeRatingSummary.objects.get(trainee__user=self.users[2], bucket='expert')
+        row.pk = None
+        with self.assertRaises(IntegrityError):
+            row.save()
+
+
+class BatchGradeTest(TestCase):
+    """api/grade/create-update/batch: результат по каждой оценке, сводные таблицы и журнал синхронизации"""
+    url = '/api/grade/create-update/batch'
+
+    def setUp(self):
+        event = Event.objects.create(event_name='Мероприятие', date=date.today(), is_active=True)
+        self.stage = Stage.objects.create(stage_name='Этап', event=event, date=date.today(), is_active=True)
+        self.inactive = Stage.objects.create(stage_name='Закрытый этап', event=event, date=date.today(),
+                                             is_active=False)
+        team = Team.objects.create(team_name='Команда')
+        users = [User.objects.create_user(f'Стажер {index}', f'trainee{index}@test.ru', 'password')
+                 for index in range(2)]
+        Trainee.objects.filter(user__in=users).update(team=team, event=event)
+        self.trainees = list(Trainee.objects.filter(user__in=users).order_by('pk'))
+        self.expert = User.objects.create_user('Эксперт Экспертов', 'expert@test.ru', 'password', role='EXPERT')
+        self.client.post('/api/grade/create-update', {'grade': {
+            'trainee': self.trainees[1].pk, 'stage': self.stage.pk, 'competence1': -1, 'competence2': 1}},
+            content_type='application/json', HTTP_AUTHORIZATION=f'Token {self.expert.token}')
+
+    def post(self, grades):
+        return self.client.post(self.url, {'grades': grades}, content_type='application/json',
+                                HTTP_AUTHORIZATION=f'Token {self.expert.token}')
+
+    def test_statuses(self):
+        first, second = (trainee.pk for trainee in self.trainees)
+        log_token = ChangeLog.objects.last_token()
+        response = self.post([
+            {'trainee': first, 'stage': self.stage.pk, 'competence1': 2, 'competence3': None},
+            {'trainee': second, 'stage': self.stage.pk, 'competence1': 2},
+            {'trainee': first, 'stage': self.stage.pk, 'competence1': 0},
+            {'trainee': first, 'stage': self.inactive.pk, 'competence1': 1},
+            {'trainee': 0, 'stage': self.stage.pk},
+            {'trainee': first, 'stage': 0},
+            {'trainee': first, 'stage': self.stage.pk, 'competence4': 5},
+        ])
+        results = response.json()['results']
+        self.assertEqual([(result['index'], result['status']) for result in results],
+                         list(enumerate(['created', 'updated', 'error', 'error', 'error', 'error', 'error'])))
+        self.assertIn('уже есть в запросе', results[2]['errors']['error'][0])
+        self.assertIn('не активному этапу', results[3]['errors']['error'][0])
+        self.assertEqual(list(results[4]['errors']), ['trainee'])
+        self.assertEqual(list(results[5]['errors']), ['stage'])
+        self.assertEqual(list(results[6]['errors']), ['competence4'])
+
+        created = Grade.objects.get(user=self.expert, trainee_id=first)
+        self.assertEqual((created.competence1, created.competence3, created.team_id),
+                         (2, None, self.trainees[0].team_id))
+        # поля, которых нет в запросе, сохраняют прежние значения
+        updated = Grade.objects.get(user=self.expert, trainee_id=second)
+        self.assertEqual((updated.competence1, updated.competence2), (2, 1))
+        self.assertFalse(Grade.objects.filter(stage=self.inactive).exists())
+
+        for trainee in self.trainees:
+            self.assertEqual(TraineeRatingSummary.objects.report(trainee.user_id),
+                             get_report(trainee, Grade.objects.all()))
+        self.assertEqual(set(ChangeLog.objects.filter(pk__gt=log_token, model='grade')
+                             .values_list('object_id', flat=True)), {created.pk, updated.pk})
+
+    def test_max_batch_size(self):
+        grades = [{'trainee': trainee.pk, 'stage': self.stage.pk, 'competence1': 1} for trainee in self.trainees]
+        with mock.patch.object(BatchUpdateCreateGradeAPIView, 'max_batch_size', 1):
+            self.assertEqual(self.post(grades).status_code, 400)
+        self.assertEqual(Grade.objects.count(), 1)
+        self.assertEqual(self.post({'trainee': self.trainees[0].pk}).status_code, 400)
+
+
+class GradeExportTest(TestCase):
+    """Выгрузка оценок из панели администратора в CSV и XLSX"""
+    headers = ['Имя оценщика', 'Имя оцениваемого', 'Команда', 'Этап', 'Вовлеченность', 'Организованность',
+               'Обучаемость', 'Командность', 'Дата оценки']
+
+    def setUp(self):
+        event = Event.objects.create(event_name='Мероприятие', date=date.today(), is_active=True)
+        self.stages = [Stage.objects.create(stage_name=f'Этап {index}', event=event, date=date.today(), is_active=True)
+                       for index in range(2)]
+        team = Team.objects.create(team_name='Команда')
+        trainee_user = User.objects.create_user('Стажер Стажеров', 'trainee@test.ru', 'password')
+        Trainee.objects.filter(user=trainee_user).update(team=team)
+        self.expert = User.objects.create_user('Эксперт Экспертов', 'expert@test.ru', 'password', role='EXPERT')
+        for stage in self.stages:
+            Grade.objects.create(user=self.expert, trainee=trainee_user.trainee, stage=stage, competence1=2,
+                                 competence3=-1)
+        self.admin = User.objects.create_superuser('Админ Админов', 'admin@test.ru', 'password')
+
+    def expected(self, stage):
+        grade = Grade.objects.get(stage=stage)
+        return ['Эксперт Экспертов', 'Стажер Стажеров', 'Команда', stage.stage_name, 2, None, -1, None,
+                django_timezone.make_naive(grade.date).replace(microsecond=0)]
+
+    def test_csv(self):
+        self.client.force_login(self.admin)
+        with mock.patch.object(GradeExporter, 'chunk_size', 1):
+            response = self.client.get('/admin/uralapi/grade/export-csv/')
+            content = b''.join(response.streaming_content).decode('utf-8-sig')
+        self.assertIn('attachment; filename="Grade-', response['Content-Disposition'])
+        rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(rows[0], self.headers)
+        self.assertEqual(rows[1:], [['' if value is None else str(value) for value in self.expected(stage)]
+                                    for stage in self.stages])
+
+        # учитываются фильтры списка оценок
+        response = self.client.get('/admin/uralapi/grade/export-csv/', {'stage__id__exact': self.stages[1].pk})
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode('utf-8-sig'))))
+        self.assertEqual([row[3] for row in rows[1:]], ['Этап 1'])
+
+    def test_xlsx(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/admin/uralapi/grade/export-xlsx/')
+        sheet = load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True)['Grade']
+        rows = [list(row) for row in sheet.iter_rows(values_only=True)]
+        self.assertEqual(rows, [self.headers] + [self.expected(stage) for stage in self.stages])
+
+    def test_staff_only(self):
+        for user in (None, self.expert):
+            if user:
+                self.client.force_login(user)
+            for url in ('/admin/uralapi/grade/export-csv/', '/admin/uralapi/grade/export-xlsx/'):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 302)
+                self.assertIn('/admin/login/', response['Location'])
+
+
+class GradeCursorPaginationTest(TestCase):
+    """Постраничный вывод по курсору должен отдать каждую оценку ровно один раз"""
+
+    def setUp(self):
+        event = Event.objects.create(event_name='Мероприятие', date=date.today(), is_active=True)
+        stage = Stage.objects.create(stage_name='Этап', event=event, date=date.today(), is_active=True)
+        self.user = User.objects.create_user('Стажер Стажеров', 'trainee@test.ru', 'password')
+        trainee = Trainee.objects.get(user=self.user)
+        for index in range(7):
+            grader = User.objects.create_user(f'Стажер {index}', f'trainee{index}@test.ru', 'password')
+            Grade.objects.create(user=grader, trainee=trainee, stage=stage, competence1=1)
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {self.user.token}'}
+
+    def test_pages(self):
+        ids = []
+        params = {'limit': 3, 'fields': 'id,competence1'}
+        while True:
+            data = self.client.get('/api/grade/get/to', params, **self.auth).json()
+            self.assertTrue(all(set(grade) == {'id', 'competence1'} for grade in data['grades']))
+            ids += [grade['id'] for grade in data['grades']]
+            if data['next'] is None:
+                break
+            params['cursor'] = data['next']
+        self.assertEqual(ids, list(Grade.objects.order_by('date', 'id').values_list('id', flat=True)))
+
+    def test_unpaginated(self):
+        data = self.client.get('/api/grade/get/to', **self.auth).json()
+        self.assertEqual(len(data['grades']), 7)
+        self.assertIsNone(data['next'])
+        self.assertEqual(self.client.get('/api/grade/get/to', {'fields': 'password'}, **self.auth).status_code, 400)
+
+
+class SyncTest(TestCase):
+    """Синхронизация по токену отдает только изменения, удаленные объекты приходят в deleted"""
+
+    def setUp(self):
+        event = Event.objects.create(event_name='Мероприятие', date=date.today(), is_active=True)
+        self.stage = Stage.objects.create(stage_name='Этап', event=event, date=date.today(), is_active=True)
+        team = Team.objects.create(team_name='Команда')
+        self.user = User.objects.create_user('Стажер Стажеров', 'trainee@test.ru', 'password')
+        self.other = User.objects.create_user('Стажер Другой', 'other@test.ru', 'password')
+        Trainee.objects.filter(user__in=[self.user, self.other]).update(team=team, event=event)
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {self.user.token}'}
+
+    @override_settings(SYNC_TOKEN_MARGIN=0)
+    def test_delta(self):
+        data = self.client.get('/api/sync', **self.auth).json()
+        self.assertTrue(data['full'])
+        self.assertEqual(len(data['changes']['trainee']), 2)
+        token = data['token']
+
+        grade = Grade.objects.create(user=self.user, trainee=self.other.trainee, stage=self.stage, competence1=1)
+        data = self.client.get('/api/sync', {'since': token}, **self.auth).json()
+        self.assertFalse(data['full'])
+        self.assertEqual([row['id'] for row in data['changes']['grade']], [grade.pk])
+        self.assertEqual(data['changes']['trainee'], [])
+
+        pk = grade.pk
+        grade.delete()
+        data = self.client.get('/api/sync', {'since': data['token']}, **self.auth).json()
+        self.assertEqual(data['changes']['grade'], [])
+        self.assertEqual(data['deleted']['grade'], [pk])
+
+    def test_late_commit(self):
+        # запись журнала о первой оценке получила id раньше записи о второй, а зафиксирована после выдачи токена
+        grade = Grade.objects.create(user=self.user, trainee=self.other.trainee, stage=self.stage, competence1=1)
+        late = ChangeLog.objects.get(model='grade', object_id=grade.pk)
+        ChangeLog.objects.filter(pk=late.pk).delete()
+        ChangeLog.objects.filter(pk__lt=late.pk).update(created_at=late.created_at - timedelta(hours=1))
+        other = Grade.objects.create(user=self.other, trainee=self.user.trainee, stage=self.stage, competence1=2)
+        token = self.client.get('/api/sync', **self.auth).json()['token']
+        self.assertLess(int(token), late.pk)
+        late.save()
+        data = self.client.get('/api/sync', {'since': token}, **self.auth).json()
+        self.assertFalse(data['full'])
+        self.assertEqual([row['id'] for row in data['changes']['grade']], [grade.pk, other.pk])
+
+
+class ValuesSerializerSchemaTest(TestCase):
+    """Сборка ответа из values_list должна совпадать с выводом сериализаторов DRF"""
+
+    def setUp(self):
+        event = Event.objects.create(event_name='Мероприятие', date=date.today(), is_active=True)
+        stage = Stage.objects.create(stage_name='Этап', event=event, date=date.today(), is_active=True)
+        team = Team.objects.create(team_name='Команда')
+        users = [User.objects.create_user(f'Стажер {index}', f'trainee{index}@test.ru', 'password')
+                 for index in range(3)]
+        # стажер в команде с изображением, стажер без мероприятия и стажер без команды
+        Trainee.objects.filter(user=users[0]).update(team=team, event=event, image='images/trainee.png',
+                                                     internship='backend')
+        Trainee.objects.filter(user=users[1]).update(team=team)
+        User.objects.filter(pk=users[0].pk).update(social_url='https://example.com')
+        for user in users[1:]:
+            Grade.objects.create(user=user, trainee=users[0].trainee, stage=stage, competence1=1, competence3=-1)
+
+    def test_team_members(self):
+        stages_index = index_stages(Stage.objects.filter(is_active=True))
+        trainees = Trainee.objects.order_by('pk')
+        self.assertEqual(TeamMemberValuesSerializer(trainees, stages_index).data,
+                         legacy_team_members(trainees, stages_index))
+
+    def test_grades(self):
+        user = User.objects.get(email='trainee0@test.ru')
+        response = self.client.get('/api/grade/get/to', HTTP_AUTHORIZATION=f'Token {user.token}')
+        expected = ListGradeSerializer(Grade.objects.order_by('date', 'id'), many=True).data
+        self.assertEqual(response.json()['grades'], [dict(grade) for grade in expected])
+
+
+class FastJSONRendererTest(TestCase):
+    """FastJSONRenderer должен выдавать тот же JSON, что и JSONRenderer, с orjson и без него"""
+    data = {
+        'datetime': datetime(2024, 1, 1, 12, 30, tzinfo=timezone.utc),
+        'date': date(2024, 1, 2),
+        'decimal': Decimal('1.5'),
+        'lazy': gettext_lazy('Стажер'),
+        'text': 'строка\u2028',
+        1: [None, 1.5, True],
+    }
+
+    def test_same_output(self):
+        self.assertEqual(renderers.FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(renderers.FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+
+    def test_user_envelope(self):
+        renderer = renderers.UserJSONRenderer()
+        self.assertEqual(renderer.render({'email': 'trainee@test.ru', 'token': b'token'}),
+                         b'{"user":{"email":"trainee@test.ru","token":"token"}}')
+        self.assertEqual(renderer.render({'errors': {'error': ['Ошибка']}}),
+                         JSONRenderer().render({'errors': {'error': ['Ошибка']}}))
+
+
+class ConditionalGetTest(TestCase):
+    """Ответ 304 по ETag, пока данные в области видимости пользователя не изменились"""
+
+    def setUp(self):
+        event = Event.objects.create(event_name='Мероприятие', date=date.today(), is_active=True)
+        self.stage = Stage.objects.create(stage_name='Этап', event=event, date=date.today(), is_active=True)
+        self.team = Team.objects.create(team_name='Команда')
+        self.user = User.objects.create_user('Стажер Стажеров', 'trainee@test.ru', 'password')
+        self.other = User.objects.create_user('Стажер Другой', 'other@test.ru', 'password')
+        for user in (self.user, self.other):
+            trainee = user.trainee
+            trainee.team = self.team
+            trainee.event = event
+            trainee.save()
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {self.user.token}'}
+
+    def _assert_revalidated(self, url, change):
+        etag = self.client.get(url, **self.auth)['ETag']
+        with self.assertNumQueries(2):
+            # пользователь при аутентификации и валидатор, без выборки данных
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag, **self.auth).status_code, 304)
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_team(self):
+        def rename():
+            self.other.username = 'Стажер Переименованный'
+            self.other.save()
+        self._assert_revalidated('/api/trainee/team', rename)
+
+    def test_grades(self):
+        grade = Grade.objects.create(user=self.other, trainee=self.user.trainee, stage=self.stage, competence1=1)
+        self._assert_revalidated('/api/grade/get/to', grade.delete)
+
+    def test_query_params(self):
+        etag = self.client.get('/api/grade/get/to', **self.auth)['ETag']
+        response = self.client.get('/api/grade/get/to', {'fields': 'id'}, HTTP_IF_NONE_MATCH=etag, **self.auth)
+        self.assertEqual(response.status_code, 200)
+
+
+class TraineeCsvImporterTest(TestCase):
+    """Импорт стажеров из CSV: ошибки по строкам, существующие пользователи, повторы, границы порций"""
+
+    def setUp(self):
+        self.team = Team.objects.create(team_name='Команда')
+        self.event = Event.objects.create(event_name='Мероприятие', date=date.today(), is_active=True)
+        User.objects.create_user('Стажер Существующий', 'Existing@test.ru', 'password')
+
+    @staticmethod
+    def row(email, username='Стажер Импортов', **fields):
+        return {'Частный e-mail': email, 'ФИО': username, **fields}
+
+    def test_import(self):
+        rows = [
+            self.row('first@test.ru', 'Стажер Первый', Команда='Команда', Мероприятие='Мероприятие', Курс='3'),
+            self.row(''),
+            self.row('noname@test.ru', ''),
+            self.row('course@test.ru', Курс='третий'),
+            self.row('existing@test.ru'),
+            self.row('FIRST@test.ru'),
+            self.row('second@test.ru', 'Стажер Второй', Команда='Неизвестная'),
+        ]
+        progress = []
+        with mock.patch.object(TraineeCsvImporter, 'chunk_size', 2):
+            result = TraineeCsvImporter(hash_workers=1, progress=lambda result: progress.append(result.processed)) \
+                .run(rows)
+
+        # повтор почты обнаруживается и в другой порции
+        self.assertEqual(progress, [2, 4, 6, 7])
+        self.assertEqual((result.processed, result.created), (7, 2))
+        errors = dict(result.errors)
+        self.assertEqual(sorted(errors), [3, 4, 5, 6, 7])
+        self.assertIn('Не указана почта', errors[3])
+        self.assertIn('Не указано ФИО', errors[4])
+        self.assertIn('Некорректный курс', errors[5])
+        self.assertIn('уже существует', errors[6])
+        self.assertIn('повторяется в файле', errors[7])
+
+        first = Trainee.objects.select_related('user').get(user__email='first@test.ru')
+        self.assertEqual((first.user.username, first.team_id, first.event_id, first.course),
+                         ('Стажер Первый', self.team.pk, self.event.pk, 3))
+        self.assertTrue(first.user.check_password(first.user.unhashed_password))
+        self.assertIsNone(Trainee.objects.get(user__email='second@test.ru').team_id)
+        self.assertEqual(User.objects.filter(email__iexact='existing@test.ru').count(), 1)
+
+    def test_concurrent_user(self):
+        bulk_create = User.objects.bulk_create
+
+        def concurrent(users, **kwargs):
+            # пользователя с почтой из файла создал другой запрос после проверки существующих
+            User.objects.create_user('Куратор Кураторов', 'race@test.ru', 'password', role='CURATOR')
+            return bulk_create(users, **kwargs)
+
+        with mock.patch.object(User.objects, 'bulk_create', concurrent):
+            result = TraineeCsvImporter(hash_workers=1).run([self.row('race@test.ru'), self.row('other@test.ru')])
+        self.assertEqual(result.created, 1)
+        self.assertEqual(result.errors, [(2, 'Пользователь с почтой race@test.ru уже существует')])
+        self.assertFalse(Trainee.objects.filter(user__email='race@test.ru').exists())
+        self.assertEqual(User.objects.get(email='race@test.ru').system_role, 'CURATOR')
+
+
+class BackgroundJobTest(TestCase):
+    """Очередь фоновых задач: захват, повтор с задержкой, возврат брошенных задач, импорт CSV"""
+
+    def setUp(self):
+        registry = mock.patch.dict(jobs._registry)
+        registry.start()
+        self.addCleanup(registry.stop)
+
+        @jobs.job(name='flaky', max_attempts=2)
+        def flaky(background_job, fail):
+            if fail:
+                raise RuntimeError('Сбой задачи')
+            return 'Готово'
+
+        self.flaky = flaky
+
+    def test_claim(self):
+        first, second = self.flaky.delay(fail=False), self.flaky.delay(fail=False)
+        BackgroundJob.objects.filter(pk=self.flaky.delay(fail=False).pk).update(run_after=now() + timedelta(hours=1))
+        claimed = jobs.claim_next()
+        self.assertEqual((claimed.pk, claimed.status, claimed.attempts), (first.pk, BackgroundJob.RUNNING, 1))
+        self.assertEqual(jobs.claim_next().pk, second.pk)
+        # отложенная задача еще не готова, захваченные повторно не выдаются
+        self.assertIsNone(jobs.claim_next())
+        jobs.run(claimed)
+        claimed.refresh_from_db()
+        self.assertEqual((claimed.status, claimed.result), (BackgroundJob.DONE, 'Готово'))
+
+    def test_retry_backoff(self):
+        background_job = self.flaky.delay(fail=True)
+        with self.assertLogs('uralapi.jobs', 'ERROR'):
+            jobs.run(jobs.claim_next())
+        background_job.refresh_from_db()
+        self.assertEqual(background_job.status, BackgroundJob.PENDING)
+        self.assertIn('Сбой задачи', background_job.error)
+        self.assertAlmostEqual((background_job.run_after - now()).total_seconds(), 60, delta=5)
+        self.assertIsNone(jobs.claim_next())
+
+        BackgroundJob.objects.filter(pk=background_job.pk).update(run_after=now())
+        with self.assertLogs('uralapi.jobs', 'ERROR'):
+            jobs.run(jobs.claim_next())
+        background_job.refresh_from_db()
+        # попытки исчерпаны
+        self.assertEqual((background_job.status, background_job.attempts), (BackgroundJob.FAILED, 2))
+        self.assertIsNotNone(background_job.finished_at)
+
+    @override_settings(BACKGROUND_JOB_STALE_TIMEOUT=60)
+    def test_recover_stale(self):
+        background_job = self.flaky.delay(fail=False)
+        jobs.claim_next()
+        self.assertEqual(jobs.recover_stale(), 0)
+        BackgroundJob.objects.filter(pk=background_job.pk).update(started_at=now() - timedelta(minutes=2))
+        self.assertEqual(jobs.recover_stale(), 1)
+        claimed = jobs.claim_next()
+        self.assertEqual((claimed.pk, claimed.attempts), (background_job.pk, 2))
+
+    def test_csv_upload_not_public(self):
+        roots = {name: tempfile.mkdtemp() for name in ('MEDIA_ROOT', 'PRIVATE_UPLOAD_ROOT')}
+        for root in roots.values():
+            self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        admin = User.objects.create_superuser('Админ Админов', 'admin@test.ru', 'password')
+        self.client.force_login(admin)
+        content = 'ФИО,Частный e-mail\nСтажер Импортов,import@test.ru\n'.encode('utf-8-sig')
+        with override_settings(**roots):
+            response = self.client.post('/admin/uralapi/trainee/import-csv/',
+                                        {'csv_file': SimpleUploadedFile('trainees.csv', content)})
+            self.assertEqual(response.status_code, 302)
+            path = BackgroundJob.objects.get(name='import_trainees_csv').payload['path']
+            self.assertTrue(os.path.exists(os.path.join(roots['PRIVATE_UPLOAD_ROOT'], path)))
+            self.assertEqual(os.listdir(roots['MEDIA_ROOT']), [])
+            jobs.run_worker(once=True)
+            self.assertFalse(os.path.exists(os.path.join(roots['PRIVATE_UPLOAD_ROOT'], path)))
+        self.assertTrue(Trainee.objects.filter(user__email='import@test.ru').exists())
+
+    def test_csv_retry(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        admin = User.objects.create_superuser('Админ Админов', 'admin@test.ru', 'password')
+        self.client.force_login(admin)
+        content = 'ФИО,Частный e-mail\nСтажер Импортов,import@test.ru\n'.encode('utf-8-sig')
+        with override_settings(PRIVATE_UPLOAD_ROOT=root):
+            for _ in range(2):
+                self.client.post('/admin/uralapi/trainee/import-csv/',
+                                 {'csv_file': SimpleUploadedFile('trainees.csv', content)})
+            with mock.patch.object(TraineeCsvImporter, 'run', side_effect=RuntimeError('Сбой импорта')), \
+                    self.assertLogs('uralapi.jobs', 'ERROR'):
+                jobs.run_worker(once=True)
+            failed, lost = BackgroundJob.objects.order_by('pk')
+            self.assertEqual((failed.status, lost.status), (BackgroundJob.FAILED, BackgroundJob.FAILED))
+            # файл задачи с ошибкой сохраняется для повтора
+            self.assertTrue(os.path.exists(os.path.join(root, failed.payload['path'])))
+            os.remove(os.path.join(root, lost.payload['path']))
+
+            response = self.client.post('/admin/uralapi/backgroundjob/', {
+                'action': 'retry', helpers.ACTION_CHECKBOX_NAME: [failed.pk, lost.pk]}, follow=True)
+            self.assertContains(response, 'Задач возвращено в очередь: 1')
+            self.assertContains(response, 'без загруженного файла: 1')
+            jobs.run_worker(once=True)
+            failed.refresh_from_db()
+            lost.refresh_from_db()
+            self.assertEqual((failed.status, lost.status), (BackgroundJob.DONE, BackgroundJob.FAILED))
+            self.assertEqual(os.listdir(os.path.join(root, 'imports')), [])
+        self.assertTrue(Trainee.objects.filter(user__email='import@test.ru').exists())
+
+
+@override_settings(MAIL_DELIVERY={'CONNECTIONS': 2, 'RATE_LIMIT': None, 'MAX_ATTEMPTS': 3, 'BACKOFF': 0})
+class MailDeliveryTest(TestCase):
+    """Рассылка данных для входа: пул соединений, ограничение скорости, повторы и журнал доставки"""
+
+    def setUp(self):
+        self.users = [User.objects.create_user(f'Стажер {index}', f'trainee{index}@test.ru', f'password{index}')
+                      for index in range(5)]
+
+    def send(self, **kwargs):
+        send_credentials.delay(user_ids=[user.pk for user in self.users], **kwargs)
+        jobs.run_worker(once=True)
+        return BackgroundJob.objects.latest('pk')
+
+    def test_dispatcher(self):
+        messages = [(index, EmailMessage('Тема', 'Текст', 'from@test.ru', [f'to{index}@test.ru'])) for index in range(20)]
+        results = list(MailDispatcher(connections=3).send(iter(messages)))
+        self.assertEqual(sorted(key for key, *_ in results), list(range(20)))
+        self.assertTrue(all(sent and attempts == 1 and error is None for _, sent, attempts, error in results))
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         sorted(f'to{index}@test.ru' for index in range(20)))
+
+    def test_rate_limiter(self):
+        with mock.patch('uralapi.mailing.time') as clock:
+            clock.monotonic.return_value = 100.0
+            limiter = RateLimiter(rate=4)
+            for _ in range(3):
+                limiter.wait()
+            RateLimiter().wait()
+        self.assertEqual([call.args[0] for call in clock.sleep.call_args_list], [0.25, 0.5])
+
+    def test_retry(self):
+        class FlakyBackend(locmem.EmailBackend):
+            failures = 2
+
+            def send_messages(self, messages):
+                if FlakyBackend.failures:
+                    FlakyBackend.failures -= 1
+                    raise SMTPServerDisconnected('Соединение разорвано')
+                return super().send_messages(messages)
+
+        message = EmailMessage('Тема', 'Текст', 'from@test.ru', ['to@test.ru'])
+        [(_, sent, attempts, error)] = MailDispatcher(connection_factory=FlakyBackend).send([(1, message)])
+        self.assertEqual((sent, attempts, error), (True, 3, None))
+        FlakyBackend.failures = 3
+        [(_, sent, attempts, error)] = MailDispatcher(connection_factory=FlakyBackend).send([(2, message)])
+        self.assertEqual((sent, attempts), (False, 3))
+        self.assertIn('SMTPServerDisconnected', error)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_worker_errors(self):
+        def broken_factory():
+            raise OSError('Сервер недоступен')
+
+        class ClosingBackend(locmem.EmailBackend):
+            def send_messages(self, messages):
+                raise SMTPServerDisconnected('Соединение разорвано')
+
+            def close(self):
+                raise SMTPServerDisconnected('Соединение уже закрыто')
+
+        messages = [(index, EmailMessage('Тема', 'Текст', 'from@test.ru', [f'to{index}@test.ru'])) for index in range(30)]
+        # ошибки соединения не завершают потоки: каждое письмо получает результат
+        for factory in (broken_factory, ClosingBackend):
+            results = list(MailDispatcher(connections=2, connection_factory=factory).send(messages))
+            self.assertEqual(sorted(key for key, *_ in results), list(range(30)))
+            self.assertFalse(any(sent for _, sent, *_ in results))
+        [(_, _, _, error)] = MailDispatcher(connection_factory=broken_factory).send(messages[:1])
+        self.assertIn('Сервер недоступен', error)
+
+        # если потоки все же завершились, send сообщает об ошибке, а не ждет результатов вечно
+        with mock.patch.object(MailDispatcher, '_work', lambda dispatcher, tasks, results: None), \
+                self.assertRaises(RuntimeError):
+            list(MailDispatcher(connections=2).send(messages))
+
+    def test_stop_early(self):
+        messages = ((index, EmailMessage('Тема', 'Текст', 'from@test.ru', ['to@test.ru'])) for index in range(1000))
+        threads = threading.active_count()
+        results = MailDispatcher(connections=3).send(messages)
+        next(results)
+        results.close()
+        self.assertEqual(threading.active_count(), threads)
+        self.assertLess(len(mail.outbox), 1000)
+
+    def test_skip_sent(self):
+        def interrupted(dispatcher, messages):
+            key, _ = next(iter(messages))
+            yield key, True, 1, None
+            raise SMTPServerDisconnected('Соединение разорвано')
+
+        # письмо, отправленное до сбоя задачи, уже записано в журнал
+        with mock.patch.object(MailDispatcher, 'send', interrupted), self.assertLogs('uralapi.jobs', 'ERROR'):
+            self.assertEqual(self.send().status, BackgroundJob.PENDING)
+        self.assertEqual(list(MailDelivery.objects.filter(status=MailDelivery.SENT).values_list('user_id', flat=True)),
+                         [self.users[0].pk])
+
+        self.assertEqual(self.send().status, BackgroundJob.DONE)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         sorted(user.email for user in self.users[1:]))
+        self.assertIn('Пароль - password1', next(message.body for message in mail.outbox
+                                                   if message.to == [self.users[1].email]))
+        self.assertEqual(MailDelivery.objects.filter(status=MailDelivery.SENT).count(), 5)
+
+        self.send()
+        self.assertEqual(len(mail.outbox), 4)
+        self.send(force=True)
+        self.assertEqual(len(mail.outbox), 9)
+        self.assertEqual(MailDelivery.objects.get(user=self.users[0]).attempts, 2)
+
+
+class TraineeImagePipelineTest(TestCase):
+    """Загруженное изображение обрабатывается фоновой задачей: метаданные удаляются, создаются миниатюры"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        team = Team.objects.create(team_name='Команда')
+        self.user = User.objects.create_user('Стажер Стажеров', 'trainee@test.ru', 'password')
+        self.other = User.objects.create_user('Стажер Другой', 'other@test.ru', 'password')
+        Trainee.objects.filter(user__in=[self.user, self.other]).update(team=team)
+        self.auth = {'HTTP_AUTHORIZATION': f'Token {self.user.token}'}
+
+    def photo(self):
+        """JPEG 2000x1000 с EXIF: поворот на 90 градусов и модель камеры"""
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x0110] = 'Camera'
+        buffer = BytesIO()
+        Image.new('RGB', (2000, 1000), 'red').save(buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/api/trainee/image-upload', encode_multipart(BOUNDARY, {'image': self.photo()}),
+                                         content_type=MULTIPART_CONTENT, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        trainee = Trainee.objects.get(user=self.user)
+        self.assertEqual(trainee.thumbnails, {})
+
+        jobs.run(jobs.claim_next())
+        trainee.refresh_from_db()
+        self.assertEqual(set(trainee.thumbnails), {'small', 'medium'})
+        with Image.open(trainee.image.path) as original:
+            self.assertEqual(original.size, (640, 1280))
+            self.assertEqual(len(original.getexif()), 0)
+        with trainee.image.storage.open(trainee.thumbnails['small']) as file, Image.open(file) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ('WEBP', (96, 96)))
+
+        team = self.client.get('/api/trainee/team', HTTP_AUTHORIZATION=f'Token {self.other.token}').json()['team']
+        self.assertEqual(team[0]['thumbnails']['medium'], trainee.image.storage.url(trainee.thumbnails['medium']))
+
+    def test_replace(self):
+        trainee = Trainee.objects.get(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            replace_trainee_image(trainee, self.photo())
+        jobs.run(jobs.claim_next())
+        trainee.refresh_from_db()
+        storage, thumbnails = trainee.image.storage, trainee.thumbnails
+
+        # при откате замены миниатюры остаются на месте, на них по-прежнему ссылается запись стажера
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            replace_trainee_image(Trainee.objects.get(pk=trainee.pk), None)
+            raise RuntimeError('Откат')
+        self.assertEqual(Trainee.objects.get(pk=trainee.pk).thumbnails, thumbnails)
+        self.assertTrue(all(storage.exists(name) for name in thumbnails.values()))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            replace_trainee_image(trainee, None)
+        self.assertFalse(any(storage.exists(name) for name in thumbnails.values()))
+
+
+class MediaServeTest(SimpleTestCase):
+    """Файлы с хэшем в имени кэшируются бессрочно, поддерживаются ETag, Range и X-Accel-Redirect"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        storage = HashedFileSystemStorage(location=self.root)
+        self.name = storage.save('images/1.png', SimpleUploadedFile('1.png', b'0123456789'))
+        self.factory = RequestFactory()
+
+    def serve(self, **headers):
+        return media.serve(self.factory.get(f'/media/{self.name}', **headers), self.name, document_root=self.root)
+
+    def test_cache_headers(self):
+        self.assertRegex(self.name, r'^images/1\.[0-9a-f]{12}\.png$')
+        response = self.serve()
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.serve(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_range(self):
+        response = self.serve(HTTP_RANGE='bytes=2-4')
+        self.assertEqual((response.status_code, response['Content-Range']), (206, 'bytes 2-4/10'))
+        self.assertEqual(b''.join(response.streaming_content), b'234')
+        self.assertEqual(b''.join(self.serve(HTTP_RANGE='bytes=-3').streaming_content), b'789')
+        self.assertEqual(self.serve(HTTP_RANGE='bytes=20-').status_code, 416)
+        self.assertEqual(self.serve(HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE='"old"').status_code, 200)
+
+    def test_sendfile(self):
+        with override_settings(MEDIA_SERVING={'MAX_AGE': 60, 'SENDFILE': 'X-Accel-Redirect',
+                                              'ACCEL_PREFIX': '/protected'}):
+            response = self.serve()
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/media/{self.name}')
+        self.assertEqual(response.content, b'')
+
+
+class MetricsTest(TestCase):
+    """Метрики запросов собираются по представлениям, превышение query_budget роняет тест"""
+
+    def setUp(self):
+        registry.clear()
+        self.event = Event.objects.create(event_name='Мероприятие', date=date.today(), is_active=True)
+        self.user = User.objects.create_user('Стажер Стажеров', 'trainee@test.ru', 'password')
+        self.admin = User.objects.create_superuser('Админ Админов', 'admin@test.ru', 'password')
+
+    def get(self, url, user):
+        return self.client.get(url, HTTP_AUTHORIZATION=f'Token {user.token}')
+
+    def test_prometheus(self):
+        response = self.get(f'/api/stages/{self.event.pk}', self.user)
+        self.assertEqual(response['X-Query-Count'], str(registry.samples[-1].queries))
+        self.assertGreater(registry.samples[-1].render, 0)
+        self.assertEqual(self.get('/api/_metrics', self.user).status_code, 403)
+
+        text = self.get('/api/_metrics', self.admin).content.decode()
+        self.assertIn('uralapi_requests_total{view="ListStagesAPIView",method="GET"} 1', text)
+        self.assertIn('uralapi_request_queries{view="ListStagesAPIView",method="GET",quantile="0.5"}', text)
+
+    def test_serializer_time(self):
+        self.assertEqual(self.get('/api/user', self.user).status_code, 200)
+        self.assertGreater(registry.samples[-1].serializer, 0)
+
+    def test_query_budget(self):
+        with mock.patch.object(ListStagesAPIView, 'query_budget', 0), self.assertRaises(QueryBudgetExceeded):
+            self.get(f'/api/stages/{self.event.pk}', self.user)
+
+
+class ProfileProvisioningTest(TestCase):
+    """Профили создаются bulk_provision одинаково при создании одного пользователя и пакетом"""
+    roles = ('TRAINEE', 'CURATOR', 'EXPERT', 'ADMIN')
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('Админ Админов', 'admin@test.ru', 'password')
+
+    def profiles(self, prefix):
+        """Профили пользователей {prefix}_{роль}@test.ru без полей, которые отличаются у разных записей"""
+        rows = []
+        for role in self.roles:
+            for model in PROFILE_MODELS.values():
+                for row in model.objects.filter(user__email=f'{prefix}_{role}@test.ru').values():
+                    rows.append((model.__name__, {key: value for key, value in row.items()
+                                                  if key not in ('id', 'user_id', 'updated_at')}))
+        return rows
+
+    def test_signal_and_bulk_identical(self):
+        for role in self.roles:
+            User.objects.create_user('Одиночный Пользователь', f'single_{role}@test.ru', 'password', role=role)
+        User.objects.bulk_create([User(username='Пакетный Пользователь', email=f'bulk_{role}@test.ru', system_role=role)
+                                  for role in self.roles])
+        bulk_provision(User.objects.filter(email__startswith='bulk_'))
+
+        self.assertEqual([model for model, _ in self.profiles('single')], ['Trainee', 'Curator', 'Expert'])
+        self.assertEqual(self.profiles('single'), self.profiles('bulk'))
+        trainees = Trainee.objects.filter(user__email__in=['single_TRAINEE@test.ru', 'bulk_TRAINEE@test.ru'])
+        self.assertEqual(ChangeLog.objects.filter(model='trainee', object_id__in=trainees.values('pk')).count(), 2)
+
+    def test_bulk_api(self):
+        url = '/api/user/bulk'
+        users = [{'username': 'Стажер Первый', 'email': 'first@test.ru'},
+                 {'username': 'Куратор Второй', 'email': 'second@test.ru', 'system_role': 'CURATOR',
+                  'password': 'secret'},
+                 {'username': 'Стажер Повтор', 'email': 'FIRST@test.ru'},
+                 {'username': 'Стажер', 'email': 'admin@test.ru'},
+                 {'username': 'Стажер Регистров', 'email': 'Admin@test.ru'}]
+        response = self.client.post(url, {'users': users}, content_type='application/json',
+                                    HTTP_AUTHORIZATION=f'Token {self.admin.token}')
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['created', 'created', 'error', 'error', 'error'])
+        self.assertIn('email', results[4]['errors'])
+        self.assertIn('username', results[3]['errors'])
+        self.assertEqual(Trainee.objects.get(user__email='first@test.ru').user_id, results[0]['id'])
+        curator = User.objects.get(email='second@test.ru')
+        self.assertTrue(curator.check_password('secret'))
+        self.assertTrue(Curator.objects.filter(user=curator).exists())
+
+        response = self.client.post(url, {'users': users}, content_type='application/json',
+                                    HTTP_AUTHORIZATION=f'Token {curator.token}')
+        self.assertEqual(response.status_code, 403)
+
+
+class BulkDeletionTest(TestCase):
+    """delete_users удаляет пользователей, профили и оценки запросами для всего набора"""
+
+    def setUp(self):
+        self.cohort = CohortGenerator(prefix='deletion', trainees=16, team_size=(4, 4), teams_per_curator=1,
+                                      experts=1, grades_per_trainee=(8, 8), batch_size=100).run()
+
+    def summaries(self):
+        return sorted(TraineeRatingSummary.objects.values_list('trainee_id', 'stage_id', 'bucket', 'team_id',
+                                                               *TraineeRatingSummary.SUM_FIELDS))
+
+    def test_delete_users(self):
+        teams = self.cohort['teams']
+        with CaptureQueriesContext(connection) as one:
+            delete_users(teams[0]['users'][:1])
+        with CaptureQueriesContext(connection) as many:
+            delete_users([team['users'][0] for team in teams[1:]])
+        # количество запросов не зависит от количества пользователей и их оценок
+        self.assertEqual(len(one.captured_queries), len(many.captured_queries))
+        delete_users([teams[1]['curator_user']] + teams[1]['users'])
+
+        deleted = [team['users'][0] for team in teams] + teams[1]['users'] + [teams[1]['curator_user']]
+        self.assertFalse(User.objects.filter(pk__in=deleted).exists())
+        self.assertFalse(Grade.objects.filter(Q(user_id__in=deleted) | Q(trainee__user_id__in=deleted)).exists())
+        self.assertIsNone(Team.objects.get(pk=teams[1]['id']).curator_id)
+        self.assertEqual(ChangeLog.objects.filter(model='trainee', deleted=True).count(), 7)
+        # сводные таблицы оставшихся стажеров совпадают с пересчитанными по оценкам
+        summaries = self.summaries()
+        call_command('rebuild_rating_summaries', stdout=StringIO())
+        self.assertEqual(summaries, self.summaries())
+
+    def test_admin_action(self):
+        admin = User.objects.get(pk=self.cohort['admin'])
+        self.client.force_login(admin)
+        team = self.cohort['teams'][0]
+        data = {'action': 'bulk_delete', 'index': 0, helpers.ACTION_CHECKBOX_NAME: team['trainees']}
+        response = self.client.post('/admin/uralapi/trainee/', data)
+        self.assertContains(response, 'Оценки: ')
+        self.assertEqual(Trainee.objects.filter(pk__in=team['trainees']).count(), 4)
+
+        response = self.client.post('/admin/uralapi/trainee/', {
+            'action': 'bulk_delete', 'confirm': 'yes', helpers.ACTION_CHECKBOX_NAME: team['trainees']})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(User.objects.filter(pk__in=team['users']).exists())
+
+
+class BenchmarkScenariosTest(SimpleTestCase):
+    """Для каждого маршрута API есть сценарий замера в manage.py benchmark_api"""
+
+    def test_all_routes(self):
+        self.assertEqual({str(pattern.pattern) for pattern in urlpatterns}, set(SCENARIOS))
+
+
+class CohortGeneratorTest(TestCase):
+    """manage.py seed_uralintern: при одинаковом seed создаются одинаковые данные"""
+
+    def seed(self, prefix, seed):
+        CohortGenerator(prefix=prefix, seed=seed, trainees=30, team_size=(3, 8), experts=2,
+                        grades_per_trainee=(0, 20), rebuild_summaries=False).run()
+        teams = Team.objects.filter(team_name__startswith=f'{prefix} ').order_by('pk')
+        return [[trainee.user.username for trainee in team.trainee_set.order_by('pk')] for team in teams], \
+            list(Grade.objects.filter(team__in=teams).order_by('pk').values_list('competence1', 'competence2'))
+
+    def test_deterministic(self):
+        teams, grades = self.seed('first', 1)
+        self.assertEqual(sum(map(len, teams)), 30)
+        self.assertTrue(all(3 <= len(team) <= 8 for team in teams[:-1]))
+        self.assertEqual(self.seed('second', 1), (teams, grades))
+        self.assertNotEqual(self.seed('third', 2), (teams, grades))
+        self.assertEqual(Trainee.objects.count(), 90)
+        self.assertEqual(Curator.objects.count(), User.objects.filter(system_role='CURATOR').count())
@@ -8,12 +8,18 @@ urlpatterns = [
     path('grade/get/to', ListGradeToTraineeAPIView.as_view()),# оцеки, которые выствили стажеру
     path('grade/get/from', ListGradeFromTraineeAPIView.as_view()),# оцеки, которые выствил стажер
     path('grade/get/report', ReportAPIView.as_view()),# получить общие баллы
+    path('grade/report/bulk', BulkReportAPIView.as_view()),# отчеты по всем доступным стажерам
+    path('grade/pivot', GradePivotAPIView.as_view()),# сводная таблица средних оценок стажер x этап
     path('grade/create-update', UpdateCreateGradeAPIView.as_view()),# выствить оценку
+    path('grade/create-update/batch', BatchUpdateCreateGradeAPIView.as_view()),# выставить несколько оценок
     path('trainee/team', ListTeamMembersAPIView.as_view()),# получить состав команды стажера
     path('trainee/image-upload', TraineeImageUploadAPIView.as_view()),# загрузить изображение
     path('trainee', TraineeRetrieveAPIView.as_view()),# информация о стажере
+    path('sync', SyncAPIView.as_view()),# изменения данных стажера после токена ?since=
+    path('_metrics', MetricsAPIView.as_view()),# метрики запросов в формате Prometheus, только для сотрудников
     path('user', UserRetrieveAPIView.as_view()),# информация о пользователе
     path('user/login', LoginAPIView.as_view()),# авторизиция
+    path('user/bulk', BulkUserCreateAPIView.as_view()),# создать несколько пользователей, только для сотрудников
     # состав команд, к которым привязан куратор, если это админ или эксперт, то составы всех команд
     path('expert/teams', ListTeamMembersForExpertAPIView.as_view())
 ]
\ No newline at end of file
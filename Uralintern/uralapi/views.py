@@ -1,15 +1,126 @@
+import hashlib
+import json
+from copy import copy
+from datetime import datetime, time
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Q
+from django.db.models.functions import Lower
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework import status
 from rest_framework.generics import RetrieveAPIView, ListAPIView, CreateAPIView, UpdateAPIView
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
 from rest_framework.parsers import MultiPartParser, FileUploadParser, FormParser
 from .models import *
 from .renderers import UserJSONRenderer
 from .serializers import *
 from rest_framework import exceptions
-from .functions import get_rating, serialize_stages
+from . import cache as reference_cache
+from .functions import COMPETENCES, generate_password, index_stages
+from .images import thumbnail_urls
+from .metrics import registry as metrics_registry, timer
+from .pagination import KeysetPagination
+from .pivot import GradePivot, GradePivotExporter
+from .profiles import bulk_provision
+from .sync import TraineeSync
+
+
+def reviewer_trainees(user):
+    """
+    Стажеры, которые доступны пользователю: куратору - стажеры курируемых команд,
+    администратору и эксперту - все стажеры.
+
+    :return: QuerySet стажеров
+    """
+    role = user.system_role
+    if role == 'TRAINEE':
+        raise exceptions.PermissionDenied('Пользователь не является экспертом!')
+    elif role == 'CURATOR':
+        return Trainee.objects.filter(team__curator__user_id=user.pk)
+    return Trainee.objects.all()
+
+
+def active_stages():
+    """Активные этапы всех мероприятий из кэша справочников
+
+    :return: (список сериализованных этапов, версия справочников)
+    """
+    def load():
+        with timer('serializer'):
+            return [dict(stage) for stage in StageSerializer(Stage.objects.filter(is_active=True), many=True).data]
+    return reference_cache.get_or_load('active_stages', load)
+
+
+def active_stages_index() -> dict:
+    """Активные этапы из кэша справочников, сгруппированные по id мероприятия"""
+    index, _ = reference_cache.get_or_load('active_stages_index', lambda: index_stages(
+        Stage.objects.filter(is_active=True).only('id', 'stage_name', 'event_id')))
+    return index
+
+
+def conditional_response(request, etag):
+    """Ответ 304, если клиент прислал If-None-Match с актуальным etag, иначе None"""
+    if etag is None:
+        return None
+    return get_conditional_response(request, etag=etag)
+
+
+def with_etag(response, etag):
+    if etag is not None:
+        response['ETag'] = etag
+        # клиент может хранить ответ, но должен перепроверять его по etag
+        response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Условный GET. До основного запроса считается дешевый валидатор ответа: количество записей и
+    максимальные даты изменения в области видимости пользователя (одним запросом aggregate),
+    версия справочников и адрес запроса с параметрами. Если клиент прислал If-None-Match
+    с тем же ETag, ответ 304 отдается без выборки и сериализации данных.
+
+    Представление определяет get_validator_queryset(), validator_fields - поля с датой изменения,
+    в том числе связанных моделей, и use_reference_version, если ответ содержит справочные данные.
+    Данные ответа формирует list() или retrieve() представления.
+    """
+    validator_fields = ('updated_at',)
+    use_reference_version = False
+
+    def get_validator_queryset(self, request):
+        """
+        :return: QuerySet записей, от которых зависит ответ, или None, если ответ зависит только от справочников
+        """
+        return None
+
+    def get_etag(self, request):
+        parts = [request.user.pk, request.get_full_path()]
+        if self.use_reference_version:
+            try:
+                parts.append(reference_cache.get_version())
+            except Exception:
+                # кэш Django недоступен - без версии справочников актуальность ответа проверить нельзя
+                return None
+        queryset = self.get_validator_queryset(request)
+        if queryset is not None:
+            aggregates = {f'updated_{index}': Max(field) for index, field in enumerate(self.validator_fields)}
+            row = queryset.order_by().aggregate(count=Count('pk'), **aggregates)
+            parts.append(row.pop('count'))
+            parts += [value.isoformat() if value else '' for value in row.values()]
+        return '"{}"'.format(hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest())
+
+    def get(self, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        not_modified = conditional_response(request, etag)
+        if not_modified:
+            return not_modified
+        return with_etag(super().get(request, *args, **kwargs), etag)
 
 
 class LoginAPIView(APIView):
@@ -31,146 +142,211 @@ class UserRetrieveAPIView(RetrieveAPIView):
     """Информация о пользователе"""
     permission_classes = (IsAuthenticated,)
     renderer_classes = (UserJSONRenderer,)
+    # бюджет запросов к базе на один запрос к API, проверяется MetricsMiddleware (uralapi/metrics.py):
+    # при JWT_STATELESS_AUTH поля пользователя из кэша и полная запись пользователя
+    query_budget = 2
     serializer_class = UserTokenSerializer
 
     def retrieve(self, request, *args, **kwargs):
-        serializer = self.serializer_class(request.user)
+        with timer('serializer'):
+            data = self.serializer_class(request.user).data
+
+        return Response(data, status=status.HTTP_200_OK)
 
-        return Response(serializer.data, status=status.HTTP_200_OK)
 
+class BulkUserCreateAPIView(APIView):
+    """Создаст несколько пользователей с профилями одним запросом, для каждого вернет результат.
+    Только для сотрудников"""
+    permission_classes = (IsAuthenticated, IsAdminUser)
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    # не зависит от размера пакета: по одному INSERT на таблицу пользователей и на каждую роль
+    query_budget = 13
+    serializer_class = BulkUserItemSerializer
+    # пароли хэшируются в запросе, большие списки загружаются импортом CSV в панели администратора
+    max_batch_size = 100
 
-class TraineeRetrieveAPIView(RetrieveAPIView):
+    def post(self, request, *args, **kwargs):
+        items = request.data.get('users', [])
+        if not isinstance(items, list):
+            raise exceptions.ValidationError({'users': 'Ожидается список пользователей'})
+        if len(items) > self.max_batch_size:
+            raise exceptions.ValidationError({'users': f'Не больше {self.max_batch_size} пользователей за запрос'})
+
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            serializer = self.serializer_class(data=item)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                results[index] = {'status': 'error', 'errors': serializer.errors}
+
+        # почта сравнивается без учета регистра и с существующими пользователями, и внутри пакета
+        existing = set(User.objects.annotate(email_lower=Lower('email'))
+                       .filter(email_lower__in=[data['email'].lower() for _, data in valid])
+                       .values_list('email_lower', flat=True))
+        users = []
+        seen = set()
+        for index, data in valid:
+            email = data['email']
+            error = None
+            if email.lower() in existing:
+                error = {'email': ['Пользователь с такой почтой уже существует']}
+            elif email.lower() in seen:
+                error = {'email': ['Почта повторяется в запросе']}
+            if error:
+                results[index] = {'status': 'error', 'errors': error}
+                continue
+            seen.add(email.lower())
+            user = User(username=data['username'], email=email, system_role=data['system_role'],
+                        social_url=data.get('social_url'))
+            user.set_password(data.get('password') or generate_password())
+            users.append((index, user))
+
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create([user for _, user in users])
+                # bulk_create не отправляет сигналы, профили создаются для всего пакета сразу
+                created = {user.email: user for user in User.objects.filter(email__in=[user.email for _, user in users])
+                           .only('id', 'email', 'system_role')}
+                bulk_provision(created.values())
+        except IntegrityError:
+            # пользователя с такой почтой одновременно создал другой запрос
+            raise exceptions.ValidationError('Пользователи были изменены другим запросом, повторите отправку')
+
+        for index, user in users:
+            results[index] = {'status': 'created', 'id': created[user.email].pk}
+        for index, result in enumerate(results):
+            result['index'] = index
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+class TraineeRetrieveAPIView(ConditionalGetMixin, RetrieveAPIView):
     """Информация о стажере"""
     permission_classes = (IsAuthenticated,)
-    renderer_classes = (JSONRenderer,)
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    query_budget = 3
     serializer_class = TraineeSerializer
+    validator_fields = ('updated_at', 'user__updated_at', 'team__updated_at', 'team__curator__user__updated_at')
+    use_reference_version = True
+
+    def get_validator_queryset(self, request):
+        return Trainee.objects.filter(user_id=request.user.pk)
 
     def retrieve(self, request, *args, **kwargs):
         if request.user.system_role != 'TRAINEE':
             raise exceptions.PermissionDenied('Пользователь не является стажером!')
-        trainee = Trainee.objects.get(user=request.user)
-        serializer = self.serializer_class(trainee)
-        return Response({"trainee": serializer.data}, status=status.HTTP_200_OK)
+        trainee = Trainee.objects.select_related('user', 'team__curator__user', 'event').get(user_id=request.user.pk)
+        with timer('serializer'):
+            data = self.serializer_class(trainee).data
+        return Response({"trainee": data}, status=status.HTTP_200_OK)
 
 
 class TraineeImageUploadAPIView(UpdateAPIView):
     """Загрузка изображения"""
     permission_classes = (IsAuthenticated,)
-    renderer_classes = (JSONRenderer,)
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    query_budget = 4
     serializer_class = TraineeImageSerializer
     parser_classes = (MultiPartParser, FormParser, FileUploadParser)
 
     def patch(self, request, *args, **kwargs):
         if request.user.system_role != 'TRAINEE':
             raise exceptions.PermissionDenied('Пользователь не является стажером!')
-        trainee = Trainee.objects.get(user=request.user)
-        serializer = self.serializer_class(trainee, data={'image': request.data.get('image', None)})
+        trainee = Trainee.objects.get(user_id=request.user.pk)
+        serializer = self.serializer_class(trainee, data={'image': request.data.get('image', None)},
+                                           context={'request': request})
         serializer.is_valid(raise_exception=True)
         serializer.save()
-        return Response({"image": serializer.validated_data}, status=status.HTTP_200_OK)
+        # в validated_data загруженный файл, он не сериализуется в JSON, поэтому отдается адрес сохраненного
+        with timer('serializer'):
+            data = serializer.data
+        return Response({"image": data}, status=status.HTTP_200_OK)
 
 
 class ListStagesAPIView(ListAPIView):
     """Активные этапы мероприятия"""
     permission_classes = (IsAuthenticated,)
-    renderer_classes = (JSONRenderer,)
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    query_budget = 2
     serializer_class = StageSerializer
 
     def get(self, request, *args, **kwargs):
         # self.kwargs.get('pk') - id мероприятия указывается в url зарпосе
-        stages = Stage.objects.filter(event=self.kwargs.get('pk'), is_active=True)
-        serializer = self.serializer_class(stages, many=True)
-        return Response({'stages': serializer.data}, status=status.HTTP_200_OK)
+        stages, version = active_stages()
+        etag = f'"{version}-{self.kwargs.get("pk")}"' if version else None
+        not_modified = conditional_response(request, etag)
+        if not_modified:
+            return not_modified
+        data = [stage for stage in stages if stage['event'] == self.kwargs.get('pk')]
+        return with_etag(Response({'stages': data}, status=status.HTTP_200_OK), etag)
 
 
-class ListTeamMembersAPIView(ListAPIView):
+class ListTeamMembersAPIView(ConditionalGetMixin, ListAPIView):
     """Участики команды, в которой состоит стажер и краткая информация об этом стажере"""
     permission_classes = (IsAuthenticated,)
-    renderer_classes = (JSONRenderer,)
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    query_budget = 5
     serializer_class = TraineeTeamSerializer
     parser_classes = (MultiPartParser, FormParser)
+    validator_fields = ('updated_at', 'user__updated_at', 'team__updated_at')
+    use_reference_version = True
 
-    def get(self, request, *args, **kwargs):
+    def get_validator_queryset(self, request):
+        # стажер и участники его команды
+        team = Trainee.objects.filter(user_id=request.user.pk).values('team_id')
+        return Trainee.objects.filter(Q(user_id=request.user.pk) | Q(team_id__in=team))
+
+    def list(self, request, *args, **kwargs):
         if request.user.system_role != 'TRAINEE':
             raise exceptions.PermissionDenied('Пользователь не является стажером!')
-        current_trainee = Trainee.objects.select_related('user', 'team', 'event').get(user=request.user)
-        all_stages = Stage.objects.select_related('event').all() # получаем все этапы, что бы закэшировать и использовать потом
+        current_trainee = Trainee.objects.select_related('user', 'team', 'event').get(user_id=request.user.pk)
+        # активные этапы всех мероприятий из кэша справочников, сгруппированные по id мероприятия
+        stages_index = active_stages_index()
         trainee_team = current_trainee.team
         # если стажер не состоит в команде, то поле team будте иметь null
         data = None
-        cash = list(all_stages)
 
         if trainee_team:
-            trainee_team_members = Trainee.objects.select_related('user', 'team', 'event').filter(
-                team__pk=trainee_team.pk).exclude(
-                pk=current_trainee.pk)
-
-            serializer = self.serializer_class(trainee_team_members, many=True)
-            data = []
-            for trainee in serializer.data:
-                # собираем пользовательскую информацию в более удобном виде
-                trainee_dict = {}
-                trainee_dict['id'] = trainee['id']
-                trainee_dict['username'] = trainee['user']['username']
-                trainee_dict['team_name'] = trainee['team']['team_name']
-                trainee_dict['internship'] = trainee['internship']
-                trainee_dict['image'] = trainee['image']
-                trainee_dict['social_url'] = trainee['user']['social_url']
-                trainee_dict['event'] = trainee['event']['id'] if trainee['event'] else None
-                trainee_dict['stages'] = serialize_stages(
-                    all_stages.filter(event=trainee['event']['id'], is_active=True)) \
-                    if trainee['event'] else []
-                data.append(trainee_dict)
+            trainee_team_members = Trainee.objects.filter(team__pk=trainee_team.pk).exclude(pk=current_trainee.pk)
+            data = TeamMemberValuesSerializer(trainee_team_members, stages_index).data
         return Response({"trainee":
                              {"id": current_trainee.pk,
                               "username": current_trainee.user.username,
                               "internship": current_trainee.internship,
                               "image": current_trainee.image.url if current_trainee.image else None,
+                              "thumbnails": thumbnail_urls(current_trainee.image.storage,
+                                                           current_trainee.thumbnails),
                               "event": current_trainee.event.id if current_trainee.event else None,
-                              "stages": serialize_stages(
-                                  all_stages.filter(event=current_trainee.event.id, is_active=True)) \
-                                  if current_trainee.event else []},
+                              "stages": stages_index.get(current_trainee.event_id, [])},
                          "team": data}, status=status.HTTP_200_OK)
 
 
-class ListTeamMembersForExpertAPIView(ListAPIView):
+class ListTeamMembersForExpertAPIView(ConditionalGetMixin, ListAPIView):
     """Участики команды для эксертов, кураторов и администраторов"""
     permission_classes = (IsAuthenticated,)
-    renderer_classes = (JSONRenderer,)
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    query_budget = 4
     serializer_class = TraineeTeamSerializer
     parser_classes = (MultiPartParser, FormParser)
+    validator_fields = ('updated_at', 'user__updated_at', 'team__updated_at')
+    use_reference_version = True
 
-    def get(self, request, *args, **kwargs):
+    def get_validator_queryset(self, request):
+        return reviewer_trainees(request.user)
+
+    def list(self, request, *args, **kwargs):
         # team_members зависит от роли пользователя, если Curator, то отобразятся команды, которые он курирует, если
         # Если админ или эксперт, то все команды
-        teams_members = None
-        role = request.user.system_role
-
-        if role == 'TRAINEE':
-            raise exceptions.PermissionDenied('Пользователь не является экспертом!')
-        elif role == 'CURATOR':
-            curator = Curator.objects.select_related('user').get(user=request.user)
-            teams_members = Trainee.objects.select_related('user', 'team').filter(team__curator=curator).order_by(
-                'team__team_name')
-        else:
-            teams_members = Trainee.objects.select_related('user', 'team').all().order_by('team__team_name')
-
-        all_stages = Stage.objects.select_related('event').all() # получаем все этапы, что бы закэшировать и использовать потом
-        serializer = self.serializer_class(teams_members, many=True)
-        cash = list(all_stages) # запрос кэшируется
+        teams_members = reviewer_trainees(request.user).order_by('team__team_name')
+
+        # активные этапы всех мероприятий из кэша справочников, сгруппированные по id мероприятия
+        stages_index = active_stages_index()
         data = {}
-        for trainee in serializer.data:
-            trainee_dict = {}
-            trainee_dict['id'] = trainee['id']
-            trainee_dict['username'] = trainee['user']['username']
+        for trainee_dict in TeamMemberValuesSerializer(teams_members, stages_index).data:
             # если стажер не состоит в команде, то по умолчанию его закинет в поле "Без команды"
-            trainee_dict['team_name'] = trainee['team']['team_name'] if trainee['team'] else 'Без команды'
-            trainee_dict['internship'] = trainee['internship']
-            trainee_dict['image'] = trainee['image']
-            trainee_dict['social_url'] = trainee['user']['social_url']
-            trainee_dict['event'] = trainee['event']['id'] if trainee['event'] else None
-            trainee_dict['stages'] = serialize_stages(all_stages.filter(event=trainee['event']['id'], is_active=True)) \
-                if trainee['event'] else []
+            if trainee_dict['team_name'] is None:
+                trainee_dict['team_name'] = 'Без команды'
 
             # если команда еще не в словаре, то создаст, если уже там, то добавит
             if trainee_dict['team_name'] not in data.keys():
@@ -181,38 +357,83 @@ class ListTeamMembersForExpertAPIView(ListAPIView):
         return Response({"teams": data}, status=status.HTTP_200_OK)
 
 
-class ListGradeToTraineeAPIView(ListAPIView):
-    """Оценки, которые получил стажеру"""
+class BaseGradeListAPIView(ConditionalGetMixin, ListAPIView):
+    """
+    Вывод оценок стажера без ModelSerializer: записи читаются через values().
+    ?fields=<поле>,... - выбор полей, ?stage=<id> и ?since=<дата ISO 8601> - фильтры,
+    ?limit= и ?cursor= - постраничный вывод по ключу (date, id), курсор следующей страницы в поле next
+    """
     permission_classes = (IsAuthenticated,)
-    renderer_classes = (JSONRenderer,)
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    query_budget = 3
     serializer_class = ListGradeSerializer
+    allowed_fields = ('id', *ListGradeSerializer.Meta.fields, 'date')
 
-    def get(self, request, *args, **kwargs):
+    def get_grades(self, request):
+        raise NotImplementedError
+
+    def get_validator_queryset(self, request):
+        return self.get_grades(request)
+
+    def list(self, request, *args, **kwargs):
         if request.user.system_role != 'TRAINEE':
             raise exceptions.PermissionDenied('Пользователь не является стажером!')
-        grades = Grade.objects.filter(trainee__user=request.user)
-        serializer = self.serializer_class(grades, many=True)
-        return Response({"grades": serializer.data}, status=status.HTTP_200_OK)
+        fields = self._fields(request)
+        grades = self._filter(request, self.get_grades(request))
+        pagination = KeysetPagination(request)
+        # date и id нужны для курсора, даже если не запрошены
+        page, cursor = pagination.paginate(grades.values(*{*fields, 'date', 'id'}))
+        data = [{field: row[field] for field in fields} for row in page]
+        return Response({"grades": data, "next": cursor}, status=status.HTTP_200_OK)
+
+    def _fields(self, request):
+        value = request.query_params.get('fields')
+        if not value:
+            return ListGradeSerializer.Meta.fields
+        fields = tuple(field.strip() for field in value.split(','))
+        unknown = set(fields) - set(self.allowed_fields)
+        if unknown:
+            raise exceptions.ValidationError({'fields': f'Неизвестные поля: {", ".join(sorted(unknown))}'})
+        return fields
+
+    def _filter(self, request, grades):
+        stage = request.query_params.get('stage')
+        if stage is not None:
+            if not stage.isdigit():
+                raise exceptions.ValidationError({'stage': 'Ожидается id'})
+            grades = grades.filter(stage_id=int(stage))
+        since = request.query_params.get('since')
+        if since is not None:
+            date = parse_datetime(since)
+            if date is None:
+                parsed = parse_date(since)
+                date = datetime.combine(parsed, time.min) if parsed else None
+            if date is None:
+                raise exceptions.ValidationError({'since': 'Ожидается дата в формате ISO 8601'})
+            if timezone.is_naive(date):
+                date = timezone.make_aware(date)
+            grades = grades.filter(date__gte=date)
+        return grades
+
+
+class ListGradeToTraineeAPIView(BaseGradeListAPIView):
+    """Оценки, которые получил стажеру"""
+
+    def get_grades(self, request):
+        return Grade.objects.filter(trainee__user_id=request.user.pk)
 
 
-class ListGradeFromTraineeAPIView(ListAPIView):
+class ListGradeFromTraineeAPIView(BaseGradeListAPIView):
     """Оценки, которые поставил стажер"""
-    permission_classes = (IsAuthenticated,)
-    renderer_classes = (JSONRenderer,)
-    serializer_class = ListGradeSerializer
 
-    def get(self, request, *args, **kwargs):
-        if request.user.system_role != 'TRAINEE':
-            raise exceptions.PermissionDenied('Пользователь не является стажером!')
-        grades = Grade.objects.filter(user=request.user)
-        serializer = self.serializer_class(grades, many=True)
-        return Response({"grades": serializer.data}, status=status.HTTP_200_OK)
+    def get_grades(self, request):
+        return Grade.objects.filter(user_id=request.user.pk)
 
 
 class UpdateCreateGradeAPIView(APIView):
     """Создаст или обновит существующую оценку"""
     permission_classes = (IsAuthenticated,)
-    renderer_classes = (JSONRenderer,)
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
     serializer_class = UpdateGradeSerializer
 
     def post(self, request, *args, **kwargs):
@@ -230,43 +451,223 @@ class UpdateCreateGradeAPIView(APIView):
         return Response(status=status.HTTP_200_OK)
 
 
+class BatchUpdateCreateGradeAPIView(APIView):
+    """Создаст или обновит несколько оценок одним запросом, для каждой оценки вернет результат"""
+    permission_classes = (IsAuthenticated,)
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    serializer_class = BatchGradeItemSerializer
+    max_batch_size = 500
+
+    def post(self, request, *args, **kwargs):
+        items = request.data.get('grades', [])
+        if not isinstance(items, list):
+            raise exceptions.ValidationError({'grades': 'Ожидается список оценок'})
+        if len(items) > self.max_batch_size:
+            raise exceptions.ValidationError({'grades': f'Не больше {self.max_batch_size} оценок за запрос'})
+
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            serializer = self.serializer_class(data=item)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                results[index] = {'status': 'error', 'errors': serializer.errors}
+
+        # стажеры, этапы и уже выставленные оценки загружаются для всего пакета сразу
+        trainees = Trainee.objects.only('id', 'user_id', 'team_id').in_bulk({data['trainee'] for _, data in valid})
+        stages = Stage.objects.only('id', 'is_active').in_bulk({data['stage'] for _, data in valid})
+        existing = {(grade.trainee_id, grade.stage_id): grade for grade in Grade.objects.filter(
+            user_id=request.user.pk, trainee_id__in=trainees, stage_id__in=stages)}
+
+        now = timezone.now()
+        created, updated, previous = [], [], []
+        seen = set()
+        for index, data in valid:
+            key = (data['trainee'], data['stage'])
+            trainee, stage = trainees.get(data['trainee']), stages.get(data['stage'])
+            error = None
+            if trainee is None:
+                error = {'trainee': ['Стажер не найден']}
+            elif stage is None:
+                error = {'stage': ['Этап не найден']}
+            elif not stage.is_active:
+                error = {'error': ['Невозможно дать оценку по не активному этапу!']}
+            elif key in seen:
+                error = {'error': ['Оценка по этому стажеру и этапу уже есть в запросе']}
+            if error:
+                results[index] = {'status': 'error', 'errors': error}
+                continue
+            seen.add(key)
+
+            grade = existing.get(key)
+            if grade is None:
+                grade = Grade(user_id=request.user.pk, trainee_id=trainee.pk, stage_id=stage.pk)
+                created.append(grade)
+                results[index] = {'status': 'created'}
+            else:
+                grade.trainee = trainee
+                previous.append(copy(grade))
+                updated.append(grade)
+                results[index] = {'status': 'updated'}
+            grade.trainee = trainee
+            grade.team_id = trainee.team_id
+            grade.date = now
+            # bulk_update не обновляет поля auto_now
+            grade.updated_at = now
+            # если в оценке есть такой ключ, перепишет данные, либо оставит то, что было
+            for competence in COMPETENCES:
+                setattr(grade, competence, data.get(competence, getattr(grade, competence)))
+
+        try:
+            with transaction.atomic():
+                Grade.objects.bulk_create(created)
+                Grade.objects.bulk_update(updated, COMPETENCES + ('team', 'date', 'updated_at'))
+                TraineeRatingSummary.objects.apply(added=created + updated, removed=previous,
+                                                   roles={request.user.pk: request.user.system_role})
+                # bulk_create и bulk_update не отправляют сигналы, id созданных оценок перечитываются из базы
+                changed = [grade.pk for grade in updated]
+                if created:
+                    changed += Grade.objects.filter(
+                        user_id=request.user.pk, trainee_id__in={grade.trainee_id for grade in created},
+                        stage_id__in={grade.stage_id for grade in created}).values_list('pk', flat=True)
+                ChangeLog.objects.record(Grade, changed)
+        except IntegrityError:
+            # оценку по этой паре стажер/этап одновременно создал другой запрос
+            raise exceptions.ValidationError('Оценки были изменены другим запросом, повторите отправку')
+
+        for index, result in enumerate(results):
+            result['index'] = index
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
 class ReportAPIView(RetrieveAPIView):
     """Сформировать отчет"""
     permission_classes = (IsAuthenticated,)
-    renderer_classes = (JSONRenderer,)
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    query_budget = 2
 
     def retrieve(self, request, *args, **kwargs):
         if request.user.system_role != 'TRAINEE':
             raise exceptions.PermissionDenied('Пользователь не является стажером!')
 
-        trainee = Trainee.objects.select_related('team').get(user=request.user)
-        grades_query = Grade.objects.select_related('user').filter(trainee=trainee) # оценки стажера
-        cash = list(grades_query) # кэшируем запрос
+        # отчет собирается из сводной таблицы, которая обновляется при выставлении оценок
+        return Response({"rating": TraineeRatingSummary.objects.report(request.user.pk)}, status=status.HTTP_200_OK)
 
-        self_rating_query = grades_query.filter(user=request.user) # самооценка
-        team_rating_query = grades_query.filter(team=trainee.team) # оценки от команды
-        expert_rating_query = grades_query.exclude(user__system_role="TRAINEE") # оценки от админа, куратора, экспертов
 
-        general_rating = get_rating(cash)
-        self_rating = get_rating(self_rating_query)
-        team_rating = get_rating(team_rating_query)
-        expert_rating = get_rating(expert_rating_query)
+class GradeDescriptionAPIView(ConditionalGetMixin, ListAPIView):
+    """Описание к выставляемым баллам"""
+    permission_classes = (IsAuthenticated,)
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    query_budget = 2
+    serializer_class = GradeDescriptionSerializer
+    use_reference_version = True
 
-        return Response({"rating": {
-            "general": general_rating,
-            "self": self_rating,
-            "team": team_rating,
-            "expert": expert_rating
-        }}, status=status.HTTP_200_OK)
+    def list(self, request, *args, **kwargs):
+        def load():
+            with timer('serializer'):
+                return [dict(description) for description in
+                        self.serializer_class(GradeDescription.objects.all(), many=True).data]
+        descriptions, _ = reference_cache.get_or_load('grade_descriptions', load)
+        return Response({"descriptions": descriptions}, status=status.HTTP_200_OK)
 
 
-class GradeDescriptionAPIView(ListAPIView):
-    """Описание к выставляемым баллам"""
+class BulkReportAPIView(APIView):
+    """Отчеты по всем доступным стажерам, с фильтрами ?event=<id> и ?team=<id>"""
     permission_classes = (IsAuthenticated,)
-    renderer_classes = (JSONRenderer,)
-    serializer_class = GradeDescriptionSerializer
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    chunk_size = 500 # количество отчетов в одной порции ответа
+
+    def get(self, request, *args, **kwargs):
+        trainees = reviewer_trainees(request.user)
+        for param in ('event', 'team'):
+            value = request.query_params.get(param)
+            if value is not None:
+                if not value.isdigit():
+                    raise exceptions.ValidationError({param: 'Ожидается id'})
+                trainees = trainees.filter(**{f'{param}_id': int(value)})
+
+        response = StreamingHttpResponse(self._stream(trainees), content_type='application/json')
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    def _stream(self, trainees):
+        """Генератор ответа {"reports": [...]}, отдает отчеты порциями по chunk_size"""
+        yield '{"reports": ['
+        chunk = []
+        separator = ''
+        for row, report in TraineeRatingSummary.objects.iter_reports(trainees):
+            chunk.append(json.dumps({
+                'id': row['id'],
+                'username': row['user__username'],
+                'team_name': row['team__team_name'],
+                'event': row['event_id'],
+                'rating': report
+            }, ensure_ascii=False))
+            if len(chunk) == self.chunk_size:
+                yield separator + ','.join(chunk)
+                separator = ','
+                chunk = []
+        if chunk:
+            yield separator + ','.join(chunk)
+        yield ']}'
+
+
+class GradePivotAPIView(APIView):
+    """
+    Сводная таблица средних оценок стажер x этап x компетенция по доступным стажерам.
+    Фильтры ?event=<id>, ?stage=<id>, ?team=<id>; ?export=csv или ?export=xlsx отдает файл
+    """
+    permission_classes = (IsAuthenticated,)
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    query_budget = 4
+    filters = {'event': 'stage__event_id', 'stage': 'stage_id', 'team': 'trainee__team_id'}
+
+    def get(self, request, *args, **kwargs):
+        grades = Grade.objects.filter(trainee__in=reviewer_trainees(request.user))
+        for param, lookup in self.filters.items():
+            value = request.query_params.get(param)
+            if value is not None:
+                if not value.isdigit():
+                    raise exceptions.ValidationError({param: 'Ожидается id'})
+                grades = grades.filter(**{lookup: int(value)})
+
+        export = request.query_params.get('export')
+        if export not in (None, 'csv', 'xlsx'):
+            raise exceptions.ValidationError({'export': 'Ожидается csv или xlsx'})
+        pivot = GradePivot(grades).compute()
+        if export == 'csv':
+            return GradePivotExporter(pivot).csv_response()
+        if export == 'xlsx':
+            return GradePivotExporter(pivot).xlsx_response()
+        return Response({'pivot': list(pivot.records())}, status=status.HTTP_200_OK)
+
+
+class SyncAPIView(APIView):
+    """
+    Изменения стажеров команды, команды, этапов и оценок стажера после токена ?since=<token>.
+    Без токена отдает все данные; токен для следующего запроса возвращается в поле token
+    """
+    permission_classes = (IsAuthenticated,)
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    query_budget = 8
+
+    def get(self, request, *args, **kwargs):
+        if request.user.system_role != 'TRAINEE':
+            raise exceptions.PermissionDenied('Пользователь не является стажером!')
+        since = request.query_params.get('since')
+        if since is not None and not since.isdigit():
+            raise exceptions.ValidationError({'since': 'Неверный токен'})
+        trainee = Trainee.objects.only('id', 'user_id', 'team_id', 'event_id').get(user_id=request.user.pk)
+        data = TraineeSync(trainee, request).changes_since(int(since) if since is not None else None)
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class MetricsAPIView(APIView):
+    """Метрики запросов к API процесса в текстовом формате Prometheus (uralapi/metrics.py), только для сотрудников"""
+    permission_classes = (IsAuthenticated, IsAdminUser)
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    query_budget = 1
 
     def get(self, request, *args, **kwargs):
-        descriptions = GradeDescription.objects.all()
-        serializer = self.serializer_class(descriptions, many=True)
-        return Response({"descriptions": serializer.data}, status=status.HTTP_200_OK)
+        return HttpResponse(metrics_registry.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')